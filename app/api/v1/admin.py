@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.database import get_db
 from app.models import User
 from app.dependencies import get_current_user
+from app.services.slow_queries import SLOW_QUERIES
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -30,13 +31,13 @@ def get_system_stats(current_user: User = Depends(get_current_user), db: Session
         SELECT 
             COUNT(*) as total,
             SUM(CASE WHEN geometry IS NOT NULL THEN 1 ELSE 0 END) as con_geometria,
-            SUM(ST_Length(geometry::geography)) / 1000 as longitud_total_km
+            SUM(ST_Length(geometry_utm)) / 1000 as longitud_total_km
         FROM transporte.patterns
     """)).fetchone()
     
     cobertura = db.execute(text("""
         SELECT 
-            ST_Area(ST_ConvexHull(ST_Collect(geom))::geography) / 1000000 as area_km2
+            ST_Area(ST_ConvexHull(ST_Collect(geom_utm))) / 1000000 as area_km2
         FROM transporte.paradas
         WHERE activa = true
     """)).fetchone()
@@ -60,6 +61,26 @@ def get_system_stats(current_user: User = Depends(get_current_user), db: Session
         }
     }
 
+@router.get("/slow-queries")
+def get_slow_queries(
+    limit: int = Query(default=20, ge=1, le=200),
+    order: str = Query(default="total_ms", pattern="^(total_ms|max_ms|count|slow_count)$"),
+    reset: bool = Query(default=False, description="Vaciar el registro después de leerlo"),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.rol != "Administrador":
+        raise HTTPException(status_code=403, detail="No autorizado")
+    
+    queries = SLOW_QUERIES.top(limit=limit, order=order)
+    result = {
+        "since": SLOW_QUERIES.since,
+        "threshold_ms": SLOW_QUERIES.threshold_ms,
+        "queries": queries
+    }
+    if reset:
+        SLOW_QUERIES.reset()
+    return result
+
 @router.get("/health")
 def system_health_check(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if current_user.rol != "Administrador":
@@ -1,18 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List
 from app.database import get_db
-from app.schemas.line import LineCreate, LineResponse, LineUpdate
+from app.schemas.line import (
+    LineCreate, LineResponse, LineUpdate, NearbyLineResponse, NearbyPatternResponse
+)
 from app.crud.line import crud_line
 from app.models import User
 from app.dependencies import get_current_user
+from app.services.network_snapshot import get_network_snapshot
 
 router = APIRouter(prefix="/lines", tags=["lines"])
 
+MAX_NEARBY_RADIUS_M = 2000
+
 @router.get("/", response_model=List[LineResponse])
 def get_all_lines(db: Session = Depends(get_db)):
     return crud_line.get_all_active(db)
 
+@router.get("/nearby", response_model=List[NearbyLineResponse])
+def get_nearby_lines(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(300, gt=0, le=MAX_NEARBY_RADIUS_M),
+    db: Session = Depends(get_db)
+):
+    """
+    Líneas activas cuyo trazado pasa a menos de `radius` metros del punto, la
+    más cercana primero, con sus patterns y el segmento más cercano de cada uno.
+    Sale del índice espacial del snapshot en memoria (sin queries).
+    """
+    network = get_network_snapshot(db)
+    if network is None:
+        raise HTTPException(status_code=503, detail="Red de transporte no disponible")
+
+    near = network.patterns_within(lat, lon, radius)
+    lines: Dict[int, NearbyLineResponse] = {}
+    for idx, segment, distance in zip(near.pattern.tolist(), near.segment.tolist(),
+                                      near.distance.tolist()):
+        pattern_id = network.pattern_ids[idx]
+        line = network.line_for_pattern(pattern_id)
+        if line is None or not line.activa:
+            continue
+        entry = lines.get(line.id_linea)
+        if entry is None:
+            # Los patterns llegan ordenados por distancia: el primero es el de la línea
+            entry = lines[line.id_linea] = NearbyLineResponse(
+                id_linea=line.id_linea, short_name=line.short_name, long_name=line.long_name,
+                color=line.color, text_color=line.text_color, distance=round(distance, 1),
+                patterns=[]
+            )
+        entry.patterns.append(NearbyPatternResponse(
+            pattern_id=pattern_id, sentido=network.pattern_sentidos[idx],
+            distance=round(distance, 1), segment=segment
+        ))
+    return list(lines.values())
+
 @router.get("/{id_linea}", response_model=LineResponse)
 def get_line(id_linea: int, db: Session = Depends(get_db)):
     line = crud_line.get_by_id(db, id_linea)
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends, Query
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy.orm import Session
 from app.dependencies import get_db
-from app.services.route_planner import route_planner
+from app.services.route_planner import parse_modes, route_planner
 from app.schemas.otp_schemas import PlanResponse
+from app.services.timing import timing_scope
 
 router = APIRouter(tags=["OTP Compatible"])
 
 @router.get("/plan", response_model=PlanResponse)
 def plan_route(
+    response: Response,
     fromPlace: str = Query(..., description="Origin coordinates: lat,lon"),
     toPlace: str = Query(..., description="Destination coordinates: lat,lon"),
     date: str = Query(default="today", description="Date MM-DD-YYYY"),
@@ -15,6 +18,8 @@ def plan_route(
     numItineraries: int = Query(default=5, description="Number of itineraries"),
     maxWalkDistance: float = Query(default=1500.0, description="Max walk distance in meters"),
     mode: str = Query(default="WALK,BUS", description="Transport modes"),
+    budgetMs: Optional[int] = Query(default=None, description="Latency budget in ms (capped server-side)"),
+    debug: bool = Query(default=False, description="Include per-stage planner timings"),
     db: Session = Depends(get_db)
 ):
     """
@@ -27,15 +32,20 @@ def plan_route(
         to_lat, to_lon = map(float, toPlace.split(','))
         
         # Call planner service
-        plan = route_planner.plan_route(
-            db=db,
-            from_lat=from_lat,
-            from_lon=from_lon,
-            to_lat=to_lat,
-            to_lon=to_lon,
-            max_walk_distance=maxWalkDistance,
-            num_itineraries=numItineraries
-        )
+        with timing_scope() as timer:
+            plan = route_planner.plan_route(
+                db=db,
+                from_lat=from_lat,
+                from_lon=from_lon,
+                to_lat=to_lat,
+                to_lon=to_lon,
+                max_walk_distance=maxWalkDistance,
+                num_itineraries=numItineraries,
+                budget_ms=budgetMs,
+                modes=parse_modes(mode),
+                debug=debug
+            )
+            response.headers["Server-Timing"] = timer.server_timing()
         
         return PlanResponse(plan=plan)
     except Exception as e:
@@ -12,6 +12,7 @@ router = APIRouter(prefix="/patterns", tags=["patterns"])
 @router.get("/", response_model=List[PatternResponse])
 def get_all_patterns(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     patterns = crud_pattern.get_all(db, skip=skip, limit=limit)
+    geometries = crud_pattern.get_geometries_geojson(db, [p.id for p in patterns])
     
     result = []
     for pattern in patterns:
@@ -25,7 +26,7 @@ def get_all_patterns(skip: int = 0, limit: int = 100, db: Session = Depends(get_
             "short_name_linea": pattern.linea.short_name if pattern.linea else None,
         }
         
-        geometry = crud_pattern.get_geometry_geojson(db, pattern.id)
+        geometry = geometries.get(pattern.id)
         if geometry:
             pattern_dict["geometry_geojson"] = geometry
         
@@ -76,9 +77,11 @@ def get_patterns_by_line(id_linea: int, db: Session = Depends(get_db)):
     if not patterns:
         raise HTTPException(status_code=404, detail=f"No patterns para línea {id_linea}")
     
+    geometries = crud_pattern.get_geometries_geojson(db, [p.id for p in patterns])
+    
     result = []
     for pattern in patterns:
-        geometry = crud_pattern.get_geometry_geojson(db, pattern.id)
+        geometry = geometries.get(pattern.id)
         result.append({
             "id": pattern.id,
             "name": pattern.name,
@@ -14,6 +14,45 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "Planificador Rutas Micros SC"
     
+    # Cache de planes (pares origen/destino frecuentes)
+    PLAN_CACHE_ENABLED: bool = True
+    PLAN_CACHE_MAX_ENTRIES: int = 2048
+    PLAN_CACHE_TTL_SECONDS: int = 600
+    PLAN_CACHE_CELL_METERS: int = 50
+    
+    # Búsquedas del planificador en paralelo (0 = secuencial en la sesión del request);
+    # se limita a la mitad de las conexiones del pool de SQLAlchemy
+    PLANNER_SEARCH_WORKERS: int = 4
+    # Presupuesto de tiempo por request (ms) y techo duro para budgetMs
+    PLANNER_BUDGET_MS: int = 4000
+    PLANNER_MAX_BUDGET_MS: int = 10000
+    # Nivel de log del planificador (DEBUG muestra el top de candidatos)
+    PLANNER_LOG_LEVEL: str = "WARNING"
+    # Raster de líneas candidatas por celda (radio de caminata que cubre; 0 = sin raster)
+    CANDIDATE_RASTER_RADIUS_M: int = 1200
+    CANDIDATE_RASTER_CELL_M: int = 100
+    # Segundos antes de reintentar una carga fallida del snapshot de la red
+    SNAPSHOT_RETRY_SECONDS: int = 30
+    
+    # Métricas en formato Prometheus en /metrics
+    METRICS_ENABLED: bool = True
+    
+    # Captura anonimizada de /api/v1/plan, /api y /graphql a JSONL (vacío = desactivada)
+    REQUEST_CAPTURE_FILE: str = ""
+    REQUEST_CAPTURE_PRECISION: int = 3  # Decimales de las coordenadas (3 ≈ 110 m)
+    REQUEST_CAPTURE_SAMPLE_RATE: float = 1.0
+    
+    # Headers X-Query-Count / X-Query-Budget con las queries SQL de cada request
+    QUERY_DEBUG_HEADERS: bool = False
+    
+    # Queries lentas por fingerprint (/api/v1/admin/slow-queries)
+    SLOW_QUERY_ENABLED: bool = True
+    SLOW_QUERY_THRESHOLD_MS: int = 500
+    SLOW_QUERY_MAX_FINGERPRINTS: int = 200
+    # EXPLAIN (ANALYZE, BUFFERS) de las peores: vuelve a ejecutar la query
+    SLOW_QUERY_EXPLAIN: bool = False
+    SLOW_QUERY_EXPLAIN_TOP: int = 10
+    
     class Config:
         env_file = ".env"
 
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from app.models.line import Line
 from app.schemas.line import LineCreate, LineUpdate
+from app.services.network_snapshot import invalidate_network_snapshot
 
 class CRUDLine:
     def get_all_active(self, db: Session) -> List[Line]:
@@ -15,6 +16,7 @@ class CRUDLine:
         db.add(db_line)
         db.commit()
         db.refresh(db_line)
+        invalidate_network_snapshot()
         return db_line
     
     def update(self, db: Session, db_line: Line, line_update: LineUpdate):
@@ -24,10 +26,12 @@ class CRUDLine:
         db.add(db_line)
         db.commit()
         db.refresh(db_line)
+        invalidate_network_snapshot()
         return db_line
     
     def delete(self, db: Session, db_line: Line):
         db.delete(db_line)
         db.commit()
+        invalidate_network_snapshot()
 
 crud_line = CRUDLine()
@@ -1,9 +1,30 @@
-from sqlalchemy.orm import Session
+import logging
+
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import text
-from typing import List, Optional
+from typing import Dict, List, Optional
 from app.models.pattern import Pattern
 from app.models.pattern_stop import PatternStop
 from app.schemas.pattern import PatternCreate, PatternUpdate, PatternStopCreate
+from app.services.network_snapshot import invalidate_network_snapshot
+from app.services.pattern_transfers import discard_transfer_table, refresh_pattern_transfers
+
+logger = logging.getLogger(__name__)
+
+# Misma cuenta que migrations/005_pattern_stop_measures.sql, para un pattern
+UPDATE_STOP_MEASURES = text("""
+    UPDATE transporte.pattern_stops ps
+    SET measure_m = loc.fraction * ST_Length(p.geometry_utm),
+        vertex_index = CASE WHEN loc.fraction = 0 THEN 0
+                            ELSE ST_NumPoints(ST_LineSubstring(p.geometry_utm, 0, loc.fraction)) - 1 END
+    FROM transporte.patterns p,
+         transporte.paradas s,
+         LATERAL (SELECT ST_LineLocatePoint(p.geometry_utm, s.geom_utm) AS fraction) loc
+    WHERE ps.pattern_id = :pattern_id
+    AND p.id = ps.pattern_id
+    AND s.id_parada = ps.id_parada
+    AND p.geometry_utm IS NOT NULL
+""")
 
 class CRUDPattern:
     
@@ -11,10 +32,11 @@ class CRUDPattern:
         return db.query(Pattern).filter(Pattern.id == pattern_id).first()
     
     def get_all(self, db: Session, skip: int = 0, limit: int = 100) -> List[Pattern]:
-        return db.query(Pattern).offset(skip).limit(limit).all()
+        # La línea viene en el mismo SELECT (sin una query extra por pattern)
+        return db.query(Pattern).options(joinedload(Pattern.linea)).offset(skip).limit(limit).all()
     
     def get_by_line(self, db: Session, id_linea: int) -> List[Pattern]:
-        return db.query(Pattern).filter(Pattern.id_linea == id_linea).all()
+        return db.query(Pattern).options(joinedload(Pattern.linea)).filter(Pattern.id_linea == id_linea).all()
     
     def create(self, db: Session, pattern: PatternCreate) -> Pattern:
         pattern_id = f"pattern:{pattern.id_linea}:{pattern.sentido}"
@@ -45,7 +67,10 @@ class CRUDPattern:
             sentido=pattern.sentido
         )
         
+        db.add(db_pattern)
         if geometry_wkt:
+            # La fila tiene que existir antes del UPDATE de la geometría
+            db.flush()
             query = text("""
                 UPDATE transporte.patterns 
                 SET geometry = ST_GeomFromText(:wkt, 4326)
@@ -53,14 +78,17 @@ class CRUDPattern:
             """)
             db.execute(query, {"wkt": geometry_wkt, "pattern_id": pattern_id})
         
-        db.add(db_pattern)
         db.commit()
         db.refresh(db_pattern)
+        invalidate_network_snapshot()
         
+        if geometry_wkt:
+            self._refresh_transfers(db, db_pattern.id)
         return db_pattern
     
     def update(self, db: Session, db_pattern: Pattern, pattern: PatternUpdate) -> Pattern:
         update_data = pattern.model_dump(exclude_unset=True)
+        geometry_changed = bool(update_data.get('geometry_geojson'))
         
         if 'geometry_geojson' in update_data:
             geometry_geojson = update_data.pop('geometry_geojson')
@@ -83,13 +111,38 @@ class CRUDPattern:
         for field, value in update_data.items():
             setattr(db_pattern, field, value)
         
+        if geometry_changed:
+            # Las paradas quedan en otra posición del nuevo trazado
+            db.execute(UPDATE_STOP_MEASURES, {"pattern_id": db_pattern.id})
         db.commit()
         db.refresh(db_pattern)
+        invalidate_network_snapshot()
+        
+        if geometry_changed:
+            self._refresh_transfers(db, db_pattern.id)
         return db_pattern
     
+    @staticmethod
+    def _refresh_transfers(db: Session, pattern_id: str) -> None:
+        """Recalcula solo los transbordos de este pattern en transporte.pattern_transfers"""
+        try:
+            refresh_pattern_transfers(db, pattern_id)
+        except Exception:
+            db.rollback()
+            logger.exception("transfer_refresh_failed pattern=%s", pattern_id)
+            # Las filas guardadas quedaron viejas: descartarlas para que la
+            # próxima carga calcule todos los transbordos desde cero
+            try:
+                discard_transfer_table(db)
+            except Exception:
+                db.rollback()
+                logger.exception("transfer_discard_failed pattern=%s", pattern_id)
+            invalidate_network_snapshot()
+    
     def delete(self, db: Session, db_pattern: Pattern) -> None:
         db.delete(db_pattern)
         db.commit()
+        invalidate_network_snapshot()
     
     def add_stops(self, db: Session, pattern_id: str, stops: List[PatternStopCreate]) -> List[PatternStop]:
         db.query(PatternStop).filter(PatternStop.pattern_id == pattern_id).delete()
@@ -104,7 +157,10 @@ class CRUDPattern:
             db.add(db_stop)
             db_stops.append(db_stop)
         
+        db.flush()
+        db.execute(UPDATE_STOP_MEASURES, {"pattern_id": pattern_id})
         db.commit()
+        invalidate_network_snapshot()
         return db_stops
     
     def get_stops(self, db: Session, pattern_id: str):
@@ -136,15 +192,29 @@ class CRUDPattern:
             return result.geojson
         return None
     
+    def get_geometries_geojson(self, db: Session, pattern_ids: List[str]) -> Dict[str, dict]:
+        """GeoJSON de varios patterns en una sola query (para listados)"""
+        if not pattern_ids:
+            return {}
+        query = text("""
+            SELECT id, ST_AsGeoJSON(geometry)::json as geojson
+            FROM transporte.patterns
+            WHERE id = ANY(:pattern_ids)
+            AND geometry IS NOT NULL
+        """)
+        
+        results = db.execute(query, {"pattern_ids": list(pattern_ids)}).fetchall()
+        return {r.id: r.geojson for r in results if r.geojson}
+    
     def get_stats(self, db: Session, pattern_id: str) -> dict:
         query = text("""
             SELECT 
                 COUNT(ps.id) as total_stops,
-                ST_Length(p.geometry::geography) / 1000 as route_length_km
+                ST_Length(p.geometry_utm) / 1000 as route_length_km
             FROM transporte.patterns p
             LEFT JOIN transporte.pattern_stops ps ON p.id = ps.pattern_id
             WHERE p.id = :pattern_id
-            GROUP BY p.id, p.geometry
+            GROUP BY p.id, p.geometry_utm
         """)
         
         result = db.execute(query, {"pattern_id": pattern_id}).fetchone()
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from app.models.stop import Stop
 from app.schemas.stop import StopCreate, StopUpdate
+from app.services.network_snapshot import invalidate_network_snapshot
 
 class CRUDStop:
     def get_all_active(self, db: Session) -> List[Stop]:
@@ -20,6 +21,7 @@ class CRUDStop:
         db.add(db_stop)
         db.commit()
         db.refresh(db_stop)
+        invalidate_network_snapshot()
         return db_stop
     
     def update(self, db: Session, db_stop: Stop, stop_update: StopUpdate):
@@ -33,32 +35,26 @@ class CRUDStop:
         db.add(db_stop)
         db.commit()
         db.refresh(db_stop)
+        invalidate_network_snapshot()
         return db_stop
 
     def get_nearby(self, db: Session, lat: float, lon: float, radius: float) -> List[Stop]:
-        # radius in meters. ST_DWithin takes degrees if SRID is 4326, so we need to cast to geography or use appropriate SRID.
-        # Assuming data is stored as Geometry(Point, 4326).
-        # Casting to geography allows using meters for distance.
+        # radius in meters. geom_utm is the stop projected to UTM 20S (EPSG:32720, meters),
+        # kept in sync by a trigger (migrations/003_projected_geometries.sql).
+        # Comparing against it directly (no ::geography cast) lets ST_DWithin use its GiST index.
         from geoalchemy2.functions import ST_DWithin, ST_MakePoint
         from sqlalchemy import func
         
-        # Create a point from input lat/lon
-        point = ST_MakePoint(lon, lat)
+        # Create a point from input lat/lon, projected like the column
+        point = func.ST_Transform(func.ST_SetSRID(ST_MakePoint(lon, lat), 4326), 32720)
         
-        # Use ST_DWithin with geography cast for meters distance
-        # Note: This assumes the 'geom' column exists and is populated.
-        # If 'geom' is not yet populated in the DB, this will return empty or fail.
-        # We need to ensure 'geom' is defined in the model.
         return db.query(Stop).filter(
-            ST_DWithin(
-                Stop.geom.cast(func.geography),
-                func.ST_SetSRID(point, 4326).cast(func.geography),
-                radius
-            )
+            ST_DWithin(Stop.geom_utm, point, radius)
         ).all()
 
     def delete(self, db: Session, db_stop: Stop):
         db.delete(db_stop)
         db.commit()
+        invalidate_network_snapshot()
 
 crud_stop = CRUDStop()
@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.config import settings
 
@@ -13,10 +15,38 @@ engine = create_engine(
     connect_args=connect_args
 )
 
+# Tiempos por fingerprint de query para /admin/slow-queries
+if settings.SLOW_QUERY_ENABLED:
+    from app.services.slow_queries import SLOW_QUERIES
+    SLOW_QUERIES.threshold_ms = settings.SLOW_QUERY_THRESHOLD_MS
+    SLOW_QUERIES.max_fingerprints = settings.SLOW_QUERY_MAX_FINGERPRINTS
+    SLOW_QUERIES.explain = settings.SLOW_QUERY_EXPLAIN
+    SLOW_QUERIES.explain_top = settings.SLOW_QUERY_EXPLAIN_TOP
+    SLOW_QUERIES.install(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Triggers que llenan geom_utm / geometry_utm (create_all crea las columnas, no los triggers)
+PROJECTED_GEOMETRY_MIGRATION = Path(__file__).parent.parent / "migrations" / "003_projected_geometries.sql"
+PROJECTED_GEOMETRY_TRIGGERS = ("trg_paradas_geom_utm", "trg_points_of_interest_geom_utm", "trg_patterns_geometry_utm")
+
+def ensure_projected_geometries(connection) -> bool:
+    """
+    Aplica la migración 003 (triggers + backfill de las columnas UTM) si
+    falta alguno de sus triggers. Sin ellos las búsquedas por distancia
+    filtran sobre columnas vacías y no devuelven nada. True si la aplicó.
+    """
+    found = connection.execute(
+        text("SELECT tgname FROM pg_trigger WHERE tgname = ANY(:names)"),
+        {"names": list(PROJECTED_GEOMETRY_TRIGGERS)}
+    ).scalars().all()
+    if set(found) >= set(PROJECTED_GEOMETRY_TRIGGERS):
+        return False
+    connection.exec_driver_sql(PROJECTED_GEOMETRY_MIGRATION.read_text(encoding="utf-8"))
+    return True
+
 def get_db():
     db = SessionLocal()
     try:
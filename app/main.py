@@ -1,11 +1,15 @@
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 # Import models to ensure they are registered with Base (will be used later for migrations/creation)
-from app.models import user, line, stop, route, trip, transfer, payment, pattern, pattern_stop, poi
-from app.database import engine, Base
+from app.models import user, line, stop, route, trip, transfer, payment, pattern, pattern_stop, pattern_transfer, poi
+from app.database import engine, Base, ensure_projected_geometries
 from sqlalchemy import text
 
+# Logs de la app (cada módulo ajusta su nivel, ver PLANNER_LOG_LEVEL)
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
 # Create tables (for development purposes, usually handled by Alembic in prod)
 with engine.connect() as connection:
     try:
@@ -20,6 +24,13 @@ with engine.connect() as connection:
     
 Base.metadata.create_all(bind=engine)
 
+# En una base nueva faltan los triggers de las columnas UTM: sin ellos las
+# búsquedas de paradas, rutas y geocoding devuelven vacío sin ningún error
+with engine.connect() as connection:
+    if ensure_projected_geometries(connection):
+        logging.getLogger(__name__).warning("projected_geometries_installed migration=003")
+    connection.commit()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json"
@@ -36,6 +47,46 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Métricas Prometheus: latencia por ruta, etapas del planificador, caches y pool de la DB
+if settings.METRICS_ENABLED:
+    from fastapi.responses import PlainTextResponse
+    from app.services.metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware, instrument_pool
+
+    app.add_middleware(MetricsMiddleware)
+    instrument_pool(engine)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# Queries SQL por request: presupuesto por endpoint y headers X-Query-Count
+from app.services.query_budget import QueryCountMiddleware, install_query_counter
+
+install_query_counter()
+app.add_middleware(QueryCountMiddleware, headers=lambda: settings.QUERY_DEBUG_HEADERS)
+
+# Captura de tráfico real para reproducirlo con benchmarks/replay.py
+if settings.REQUEST_CAPTURE_FILE:
+    from app.services.request_capture import RequestCapture, RequestCaptureMiddleware
+
+    app.add_middleware(RequestCaptureMiddleware, capture=RequestCapture(
+        settings.REQUEST_CAPTURE_FILE,
+        precision=settings.REQUEST_CAPTURE_PRECISION,
+        sample_rate=settings.REQUEST_CAPTURE_SAMPLE_RATE
+    ))
+
+
+@app.on_event("startup")
+def load_transit_network():
+    """Carga la red de transporte en memoria para el planificador"""
+    from app.database import SessionLocal
+    from app.services.network_snapshot import load_network_snapshot
+    db = SessionLocal()
+    try:
+        load_network_snapshot(db)
+    finally:
+        db.close()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Planificador Rutas Micros SC API"}
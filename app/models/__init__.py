@@ -7,6 +7,7 @@ from .transfer import Transfer
 from .payment import Payment
 from .pattern import Pattern
 from .pattern_stop import PatternStop
+from .pattern_transfer import PatternTransfer
 from .poi import PointOfInterest
 from .favorite import Favorite
 from .report import Report
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, ForeignKey, Index
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from geoalchemy2 import Geometry
 from app.database import Base
 
@@ -26,6 +26,8 @@ class Pattern(Base):
     
     # Geometría de la ruta completa (LineString)
     geometry = Column(Geometry('LINESTRING', srid=4326), nullable=True)
+    # UTM 20S en metros, la mantiene un trigger (migrations/003_projected_geometries.sql)
+    geometry_utm = deferred(Column(Geometry('LINESTRING', srid=32720), nullable=True))
     
     # Relaciones
     linea = relationship("Line", back_populates="patterns")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Index, UniqueConstraint
+from sqlalchemy import Column, Float, Integer, String, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -19,6 +19,9 @@ class PatternStop(Base):
     pattern_id = Column(String(50), ForeignKey('transporte.patterns.id', ondelete='CASCADE'), nullable=False)
     id_parada = Column(Integer, ForeignKey('transporte.paradas.id_parada', ondelete='CASCADE'), nullable=False)
     sequence = Column(Integer, nullable=False)  # Orden en la secuencia (1, 2, 3, ...)
+    # Referencia lineal sobre el trazado (migrations/005_pattern_stop_measures.sql)
+    measure_m = Column(Float, nullable=True)  # Metros desde el inicio del pattern
+    vertex_index = Column(Integer, nullable=True)  # Primer vértice en o después de la parada
     
     # Relaciones
     pattern = relationship("Pattern", back_populates="stops")
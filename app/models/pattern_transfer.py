@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
+from app.database import Base
+
+class PatternTransfer(Base):
+    """
+    Transbordo precalculado entre dos patterns.
+    Una fila por par ordenado de patterns y por tramo (~1 km) del pattern de origen,
+    con el nodo de abordaje virtual de cada pattern donde conviene bajar/subir
+    (medida en metros desde el inicio del pattern) y la caminata entre ambos.
+    
+    Se regenera con scripts/rebuild_pattern_transfers.py y de forma incremental
+    al crear un pattern con geometría o editar la de uno existente.
+    """
+    __tablename__ = "pattern_transfers"
+    __table_args__ = (
+        Index('idx_pattern_transfers_from', 'from_pattern_id'),
+        Index('idx_pattern_transfers_to', 'to_pattern_id'),
+        {'schema': 'transporte'}
+    )
+    
+    id = Column(Integer, primary_key=True)
+    from_pattern_id = Column(String(50), ForeignKey('transporte.patterns.id', ondelete='CASCADE'), nullable=False)
+    to_pattern_id = Column(String(50), ForeignKey('transporte.patterns.id', ondelete='CASCADE'), nullable=False)
+    from_vertex = Column(Integer, nullable=False)  # Primer vértice en o después del nodo (origen)
+    to_vertex = Column(Integer, nullable=False)    # Primer vértice en o después del nodo (destino)
+    from_measure = Column(Float)  # Metros desde el inicio del pattern de origen
+    to_measure = Column(Float)    # Metros desde el inicio del pattern de destino
+    from_lat = Column(Float, nullable=False)
+    from_lon = Column(Float, nullable=False)
+    to_lat = Column(Float, nullable=False)
+    to_lon = Column(Float, nullable=False)
+    walk_m = Column(Float, nullable=False)  # Distancia en línea recta entre ambos puntos
+    
+    def __repr__(self):
+        return f"<PatternTransfer('{self.from_pattern_id}' -> '{self.to_pattern_id}', {self.walk_m:.0f}m)>"
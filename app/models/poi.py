@@ -5,6 +5,7 @@ Consolida: salud, seguridad, educación, transporte, infraestructura
 from sqlalchemy import Column, Integer, String, DateTime, Boolean
 from sqlalchemy.types import JSON
 from sqlalchemy.sql import func
+from sqlalchemy.orm import deferred
 from geoalchemy2 import Geometry
 from app.database import Base
 
@@ -34,6 +35,8 @@ class PointOfInterest(Base):
     latitud = Column(String(20), nullable=False)
     longitud = Column(String(20), nullable=False)
     geom = Column(Geometry('POINT', srid=4326), nullable=True)
+    # UTM 20S en metros, la mantiene un trigger (migrations/003_projected_geometries.sql)
+    geom_utm = deferred(Column(Geometry('POINT', srid=32720), nullable=True))
     
     # Información adicional
     direccion = Column(String(500), nullable=True)
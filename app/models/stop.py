@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, Float, DateTime, func, Numeric, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from app.database import Base
 from geoalchemy2 import Geometry
 
@@ -12,6 +12,8 @@ class Stop(Base):
     latitud = Column(Numeric(10, 7), nullable=False)
     longitud = Column(Numeric(10, 7), nullable=False)
     geom = Column(Geometry('POINT', srid=4326), nullable=True)  # PostGIS Point
+    # UTM 20S en metros, la mantiene un trigger (migrations/003_projected_geometries.sql)
+    geom_utm = deferred(Column(Geometry('POINT', srid=32720), nullable=True))
     descripcion = Column(String(255), nullable=True)
     activa = Column(Boolean, default=True)
     fecha_creacion = Column(DateTime, server_default=func.now())
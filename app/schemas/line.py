@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class LineBase(BaseModel):
@@ -23,3 +23,18 @@ class LineResponse(LineBase):
     
     class Config:
         from_attributes = True
+
+class NearbyPatternResponse(BaseModel):
+    pattern_id: str
+    sentido: str
+    distance: float
+    segment: int
+
+class NearbyLineResponse(BaseModel):
+    id_linea: int
+    short_name: str
+    long_name: str
+    color: str
+    text_color: str
+    distance: float
+    patterns: List[NearbyPatternResponse]
@@ -69,6 +69,8 @@ class PlanSchema(BaseModel):
     # IMPORTANTE: from y to nunca deben ser null, trufi-core espera objetos válidos
     from_: PlaceSchema = Field(default_factory=lambda: PlaceSchema(name="Origin"), alias="from")
     to: PlaceSchema = Field(default_factory=lambda: PlaceSchema(name="Destination"))
+    truncated: bool = False  # True si la búsqueda se cortó por el presupuesto de tiempo
+    debug: Optional[dict] = None  # Tiempos por etapa del planificador (solo con debug=true)
     
     class Config:
         populate_by_name = True
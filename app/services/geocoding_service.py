@@ -99,12 +99,12 @@ class GeocodingService:
                 latitud,
                 longitud,
                 direccion,
-                ST_Distance(
-                    geom::geography,
-                    ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography
-                ) as distance
-            FROM transporte.points_of_interest
-            ORDER BY distance ASC
+                ST_Distance(geom_utm, origin.pt) as distance
+            FROM transporte.points_of_interest,
+                 (SELECT ST_Transform(ST_SetSRID(ST_MakePoint(:lon, :lat), 4326), 32720) as pt) origin
+            WHERE geom_utm IS NOT NULL
+            -- <-> es búsqueda KNN sobre el índice GiST (sin calcular la distancia a todos)
+            ORDER BY geom_utm <-> origin.pt
             LIMIT 1
         """)
         
@@ -0,0 +1,240 @@
+"""
+Métricas en memoria con salida en formato de texto de Prometheus (/metrics).
+
+Implementación mínima sin dependencias: contadores, gauges e histogramas con
+labels, protegidos por un lock. Cada proceso (worker de gunicorn) tiene sus
+propias métricas; Prometheus las agrega por instancia.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Buckets en segundos, de 1 ms a 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 200)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.type_name}"] + self.samples()
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(Metric):
+    """Gauge calculado al momento de exportar (p. ej. estado del pool de conexiones)"""
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def samples(self):
+        with self._lock:
+            items = list(self._functions.items())
+        lines = []
+        for key, function in items:
+            try:
+                value = function()
+            except Exception:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[LabelValues, list] = {}  # [conteos por bucket..., suma, cantidad]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets, series):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Requests HTTP atendidos", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Latencia de los requests HTTP por ruta", ("method", "route")))
+PLANNER_STAGE_LATENCY = REGISTRY.register(Histogram(
+    "planner_stage_duration_seconds", "Tiempo por etapa del planificador (por request)", ("stage",)))
+PLANNER_STAGE_CANDIDATES = REGISTRY.register(Histogram(
+    "planner_stage_candidates", "Candidatos producidos por etapa del planificador", ("stage",), COUNT_BUCKETS))
+PLANNER_STAGE_SKIPPED = REGISTRY.register(Counter(
+    "planner_stage_skipped_total", "Etapas del planificador omitidas por StageController", ("stage",)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cache_requests_total", "Consultas a caches en memoria", ("cache", "result")))
+DB_POOL_CHECKOUT_WAIT = REGISTRY.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Espera para obtener una conexión del pool de SQLAlchemy"))
+DB_POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    "db_pool_connections", "Conexiones del pool de SQLAlchemy por estado", ("state",)))
+HTTP_DB_QUERIES = REGISTRY.register(Histogram(
+    "http_request_db_queries", "Statements SQL emitidos por request", ("route",), COUNT_BUCKETS))
+PLANNER_SEARCH_TIMEOUTS = REGISTRY.register(Counter(
+    "planner_search_timeouts_total", "Búsquedas en paralelo abandonadas al agotarse el presupuesto",
+    ("stage", "state")))
+PLANNER_SEARCH_SEQUENTIAL = REGISTRY.register(Counter(
+    "planner_search_sequential_total", "Requests que buscaron en secuencia por falta de hilos libres"))
+DB_QUERY_BUDGET_EXCEEDED = REGISTRY.register(Counter(
+    "db_query_budget_exceeded_total", "Requests que superaron su presupuesto de queries", ("route",)))
+
+
+def observe_stage_timings(totals_ms: Dict[str, float]) -> None:
+    """Vuelca los totales de un StageTimer (ms por etapa) en el histograma de etapas"""
+    for stage, ms in totals_ms.items():
+        PLANNER_STAGE_LATENCY.observe(ms / 1000.0, stage=stage)
+
+
+def instrument_pool(engine) -> None:
+    """Mide la espera de checkout del pool y exporta su ocupación como gauges"""
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+    for state in ("size", "checkedout", "checkedin", "overflow"):
+        function = getattr(pool, state, None)
+        if callable(function):
+            DB_POOL_CONNECTIONS.set_function(function, state=state)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: cuenta requests y mide su latencia por plantilla de ruta
+    (`/api/v1/plan`, no la URL con parámetros) para acotar la cardinalidad.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=method, route=path)
+            HTTP_REQUESTS.inc(method=method, route=path, status=str(status["code"]))
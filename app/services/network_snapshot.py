@@ -0,0 +1,628 @@
+"""
+Snapshot en memoria de la red de transporte.
+
+Carga una sola vez patterns, líneas, paradas y pattern_stops desde Postgres
+y los guarda en arreglos NumPy contiguos. El planificador lee la geometría
+de aquí en lugar de hacer un ST_DumpPoints por cada candidato. Además de
+lat/lon guarda cada vértice y parada en un plano local en metros: largos,
+proyecciones y distancias son aritmética euclídea vectorizada.
+
+El snapshot es de solo lectura: cuando un administrador edita la red se
+incrementa la versión global y el próximo request dispara la reconstrucción
+en un hilo aparte; mientras tanto se sigue sirviendo el snapshot anterior.
+Si la carga falla se reintenta recién después de SNAPSHOT_RETRY_SECONDS.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.services.geometry import (
+    Projection, local_xy, measure_at, meters_per_degree, project_xy, segment_inverse_len2
+)
+from app.services.polyline import PatternPolyline
+from app.services.spatial_index import CandidateRaster, NearbyPatterns, SegmentGrid
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.PLANNER_LOG_LEVEL)
+
+SEGMENT_BLOCK = 16  # Segmentos por bloque del índice de proyección
+LOOP_MAX_GAP_M = 1000  # Extremos más cerca que esto = ruta circular
+LOOP_MIN_VERTICES = 10
+
+
+class LineInfo(NamedTuple):
+    """Metadatos de una línea (con los mismos fallbacks que usan las queries)"""
+    id_linea: int
+    nombre: str
+    short_name: str
+    long_name: str
+    color: str
+    text_color: str
+    activa: bool
+
+
+class StopInfo(NamedTuple):
+    """Parada con los nombres de columna de transporte.paradas"""
+    id_parada: int
+    nombre_parada: str
+    latitud: float
+    longitud: float
+    activa: bool
+
+
+class NetworkSnapshot:
+    """
+    Red de transporte en arreglos compactos.
+
+    - Coordenadas de todos los patterns concatenadas en `lats`/`lons`;
+      el pattern `i` ocupa `offsets[i]:offsets[i+1]`.
+    - Tabla de líneas indexada por `pattern_line[i]`.
+    - Paradas en arreglos paralelos y pattern_stops en formato CSR
+      (`ps_offsets`, `ps_stop`, `ps_sequence`, `ps_measure`).
+    """
+
+    def __init__(
+        self,
+        version: int,
+        lines: Sequence[LineInfo],
+        patterns: Sequence[Tuple[str, int, str, Sequence[Tuple[float, float]]]],
+        stops: Sequence[StopInfo],
+        pattern_stops: Sequence[Tuple[str, int, int, Optional[float]]],
+        transfer_rows: Optional[Sequence[Tuple[str, float, str, float, float]]] = None,
+    ):
+        self.version = version
+
+        # ----- Líneas -----
+        self.lines: List[LineInfo] = list(lines)
+        self.line_index: Dict[int, int] = {l.id_linea: i for i, l in enumerate(self.lines)}
+        self.line_activa = np.array([bool(l.activa) for l in self.lines], dtype=bool)
+
+        # ----- Patterns (coordenadas contiguas) -----
+        self.pattern_ids: List[str] = []
+        self.pattern_sentidos: List[str] = []
+        pattern_line = []
+        sizes = []
+        all_coords = []
+        for pattern_id, id_linea, sentido, coords in patterns:
+            self.pattern_ids.append(pattern_id)
+            self.pattern_sentidos.append(sentido)
+            pattern_line.append(self.line_index.get(id_linea, -1))
+            sizes.append(len(coords))
+            all_coords.extend(coords)
+
+        self.pattern_index: Dict[str, int] = {pid: i for i, pid in enumerate(self.pattern_ids)}
+        self.pattern_line = np.array(pattern_line, dtype=np.int32)
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        if sizes:
+            np.cumsum(sizes, out=self.offsets[1:])
+
+        coords_array = np.array(all_coords, dtype=np.float64).reshape(-1, 2)
+        self.lats = np.ascontiguousarray(coords_array[:, 0])
+        self.lons = np.ascontiguousarray(coords_array[:, 1])
+
+        # Bounding box por pattern (lat_min, lat_max, lon_min, lon_max) para descartar rápido
+        self.pattern_bbox = np.full((len(sizes), 4), np.nan)
+        non_empty = np.nonzero(np.diff(self.offsets) > 0)[0]
+        if len(non_empty):
+            starts = self.offsets[non_empty]
+            self.pattern_bbox[non_empty, 0] = np.minimum.reduceat(self.lats, starts)
+            self.pattern_bbox[non_empty, 1] = np.maximum.reduceat(self.lats, starts)
+            self.pattern_bbox[non_empty, 2] = np.minimum.reduceat(self.lons, starts)
+            self.pattern_bbox[non_empty, 3] = np.maximum.reduceat(self.lons, starts)
+
+        # Coordenadas planas (metros) alrededor del centro de la red y vector de cada
+        # segmento, para proyectar puntos sobre los trazados sin trigonometría por request
+        if len(self.lats):
+            self.origin = (float(self.lats.mean()), float(self.lons.mean()))
+        else:
+            self.origin = (0.0, 0.0)
+        self.meters_per_degree = meters_per_degree(self.origin[0])
+        # Una columna por vértice: (x, y, dx, dy, 1/largo²) del segmento que empieza en él.
+        # La última columna de cada pattern cruza al siguiente y nunca se usa.
+        self.segment_table = np.zeros((5, len(self.lats)), dtype=np.float64)
+        self.xs, self.ys, self.seg_dx, self.seg_dy, self.seg_inv_len2 = self.segment_table
+        self.xs[:], self.ys[:] = local_xy(self.lats, self.lons, *self.origin)
+        if len(self.lats) > 1:
+            self.seg_dx[:-1] = np.diff(self.xs)
+            self.seg_dy[:-1] = np.diff(self.ys)
+        self.seg_inv_len2[:] = segment_inverse_len2(self.seg_dx, self.seg_dy)
+
+        # Distancia acumulada (metros) desde el inicio de cada pattern, en el plano
+        # local: largo de cada segmento sin trigonometría
+        segment = np.zeros(len(self.lats), dtype=np.float64)
+        if len(self.lats) > 1:
+            segment[1:] = np.hypot(self.seg_dx[:-1], self.seg_dy[:-1])
+        segment[self.offsets[:-1][np.diff(self.offsets) > 0]] = 0.0
+        cum = np.cumsum(segment)
+        starts = np.repeat(self.offsets[:-1], np.diff(self.offsets))
+        self.cum_dist = cum - cum[starts] if len(cum) else cum
+
+        # Largo total y detección de rutas circulares (extremos a menos de LOOP_MAX_GAP_M)
+        sizes_array = np.diff(self.offsets)
+        has_coords = sizes_array > 0
+        self.pattern_length = np.zeros(len(sizes), dtype=np.float64)
+        self.pattern_closing_m = np.full(len(sizes), np.inf)
+        first, last = self.offsets[:-1][has_coords], self.offsets[1:][has_coords] - 1
+        self.pattern_length[has_coords] = self.cum_dist[last]
+        self.pattern_closing_m[has_coords] = np.hypot(
+            self.xs[first] - self.xs[last], self.ys[first] - self.ys[last]
+        )
+        self.pattern_is_loop = (sizes_array > LOOP_MIN_VERTICES) & (self.pattern_closing_m < LOOP_MAX_GAP_M)
+
+        # Distancias acumuladas de todos los patterns en un solo arreglo creciente
+        # (cada pattern desplazado en su largo + 1 m) para ubicar medidas con un searchsorted
+        stride = self.pattern_length + 1.0
+        self.locate_base = np.cumsum(stride) - stride
+        self.locate_keys = self.cum_dist + np.repeat(self.locate_base, sizes_array)
+
+        # Bloques de SEGMENT_BLOCK segmentos con un círculo que los contiene: al
+        # proyectar solo se recorren los bloques que pueden tener el más cercano
+        num_segments = np.maximum(np.diff(self.offsets) - 1, 0)
+        num_blocks = (num_segments + SEGMENT_BLOCK - 1) // SEGMENT_BLOCK
+        self.block_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        if len(sizes):
+            np.cumsum(num_blocks, out=self.block_offsets[1:])
+        block_pattern = np.repeat(np.arange(len(sizes)), num_blocks)
+        local_block = np.arange(len(block_pattern)) - self.block_offsets[block_pattern]
+        self.block_start = self.offsets[block_pattern] + local_block * SEGMENT_BLOCK
+        self.block_end = np.minimum(self.block_start + SEGMENT_BLOCK,
+                                    self.offsets[block_pattern] + num_segments[block_pattern])
+        if len(block_pattern):
+            # reduceat llega hasta el inicio del bloque siguiente, que incluye el
+            # vértice final del bloque (a lo sumo agrega vértices, nunca los pierde)
+            x_min = np.minimum.reduceat(self.xs, self.block_start)
+            x_max = np.maximum.reduceat(self.xs, self.block_start)
+            y_min = np.minimum.reduceat(self.ys, self.block_start)
+            y_max = np.maximum.reduceat(self.ys, self.block_start)
+            self.block_cx = (x_min + x_max) / 2
+            self.block_cy = (y_min + y_max) / 2
+            self.block_r = np.hypot(x_max - x_min, y_max - y_min) / 2
+        else:
+            self.block_cx = self.block_cy = self.block_r = np.zeros(0)
+
+        # ----- Paradas -----
+        self.stops: List[StopInfo] = list(stops)
+        self.stop_index: Dict[int, int] = {s.id_parada: i for i, s in enumerate(self.stops)}
+        self.stop_lats = np.array([s.latitud for s in self.stops], dtype=np.float64)
+        self.stop_lons = np.array([s.longitud for s in self.stops], dtype=np.float64)
+        self.stop_xs, self.stop_ys = local_xy(self.stop_lats, self.stop_lons, *self.origin)
+
+        # ----- pattern_stops (CSR por pattern, ordenado por secuencia) -----
+        # `measure_m` (metros desde el inicio del pattern) viene de la base;
+        # si falta se proyecta la parada sobre el trazado en memoria
+        per_pattern: Dict[int, List[Tuple[int, int, float]]] = {}
+        for pattern_id, id_parada, sequence, measure_m in pattern_stops:
+            p_idx = self.pattern_index.get(pattern_id)
+            s_idx = self.stop_index.get(id_parada)
+            if p_idx is None or s_idx is None:
+                continue
+            per_pattern.setdefault(p_idx, []).append(
+                (sequence, s_idx, np.nan if measure_m is None else float(measure_m)))
+
+        ps_sizes = np.zeros(len(self.pattern_ids), dtype=np.int64)
+        ps_stop = []
+        ps_sequence = []
+        ps_measure = []
+        for p_idx in range(len(self.pattern_ids)):
+            entries = sorted(per_pattern.get(p_idx, []))
+            ps_sizes[p_idx] = len(entries)
+            for sequence, s_idx, measure_m in entries:
+                ps_sequence.append(sequence)
+                ps_stop.append(s_idx)
+                ps_measure.append(measure_m)
+        self.ps_offsets = np.zeros(len(self.pattern_ids) + 1, dtype=np.int64)
+        if len(ps_sizes):
+            np.cumsum(ps_sizes, out=self.ps_offsets[1:])
+        self.ps_stop = np.array(ps_stop, dtype=np.int32)
+        self.ps_sequence = np.array(ps_sequence, dtype=np.int32)
+        self.ps_measure = np.array(ps_measure, dtype=np.float64)
+        ps_pattern = np.repeat(np.arange(len(ps_sizes)), ps_sizes)
+        for p_idx in np.unique(ps_pattern[np.isnan(self.ps_measure)]).tolist():
+            if sizes[p_idx] < 2:
+                continue
+            rows = np.arange(self.ps_offsets[p_idx], self.ps_offsets[p_idx + 1])
+            rows = rows[np.isnan(self.ps_measure[rows])]
+            proj = self.project(p_idx, self.stop_lats[self.ps_stop[rows]], self.stop_lons[self.ps_stop[rows]])
+            self.ps_measure[rows] = measure_at(self.pattern_cum_dist(p_idx), proj.segment, proj.fraction)
+
+        # Estructuras derivadas que se calculan bajo demanda
+        self._derived_lock = threading.Lock()
+        self._transfers = None
+        self._segment_index = None
+        self._candidate_raster: Optional[CandidateRaster] = None
+        self._polylines: Dict[int, PatternPolyline] = {}
+        # Filas de transporte.pattern_transfers (None = calcular en memoria)
+        self._transfer_rows = transfer_rows or None
+
+    @classmethod
+    def load(cls, db: Session, version: int = 0) -> "NetworkSnapshot":
+        """Construye el snapshot con una query por tabla"""
+        line_rows = db.execute(text("""
+            SELECT id_linea,
+                   nombre,
+                   COALESCE(short_name, nombre) as short_name,
+                   COALESCE(long_name, nombre) as long_name,
+                   COALESCE(color, '0088FF') as color,
+                   COALESCE(text_color, 'FFFFFF') as text_color,
+                   COALESCE(activa, true) as activa
+            FROM transporte.lineas
+        """)).fetchall()
+
+        pattern_rows = db.execute(text("""
+            SELECT id, id_linea, sentido, ST_AsGeoJSON(geometry) as geojson
+            FROM transporte.patterns
+            ORDER BY id
+        """)).fetchall()
+
+        stop_rows = db.execute(text("""
+            SELECT id_parada, nombre_parada, latitud, longitud,
+                   COALESCE(activa, true) as activa
+            FROM transporte.paradas
+        """)).fetchall()
+
+        pattern_stop_rows = db.execute(text("""
+            SELECT pattern_id, id_parada, sequence, measure_m
+            FROM transporte.pattern_stops
+            ORDER BY pattern_id, sequence
+        """)).fetchall()
+
+        # Transbordos precalculados (tabla opcional, ver scripts/rebuild_pattern_transfers.py)
+        transfer_rows = None
+        if db.execute(text("SELECT to_regclass('transporte.pattern_transfers')")).scalar():
+            transfer_rows = [
+                (r.from_pattern_id, r.from_measure, r.to_pattern_id, r.to_measure, r.walk_m)
+                for r in db.execute(text("""
+                    SELECT from_pattern_id, from_measure, to_pattern_id, to_measure, walk_m
+                    FROM transporte.pattern_transfers
+                    WHERE from_measure IS NOT NULL AND to_measure IS NOT NULL
+                """)).fetchall()
+            ]
+
+        lines = [
+            LineInfo(r.id_linea, r.nombre, r.short_name, r.long_name,
+                     r.color, r.text_color, bool(r.activa))
+            for r in line_rows
+        ]
+
+        patterns = []
+        for r in pattern_rows:
+            coords = []
+            if r.geojson:
+                geojson = json.loads(r.geojson) if isinstance(r.geojson, str) else r.geojson
+                # GeoJSON guarda (lon, lat); internamente usamos (lat, lon)
+                coords = [(float(c[1]), float(c[0])) for c in geojson.get("coordinates", [])]
+            patterns.append((r.id, r.id_linea, r.sentido, coords))
+
+        stops = [
+            StopInfo(r.id_parada, r.nombre_parada or "", float(r.latitud),
+                     float(r.longitud), bool(r.activa))
+            for r in stop_rows
+        ]
+
+        pattern_stops = [(r.pattern_id, r.id_parada, r.sequence, r.measure_m) for r in pattern_stop_rows]
+
+        return cls(version, lines, patterns, stops, pattern_stops, transfer_rows)
+
+    # ----- Acceso -----
+
+    @property
+    def num_patterns(self) -> int:
+        return len(self.pattern_ids)
+
+    @property
+    def num_vertices(self) -> int:
+        return int(self.offsets[-1])
+
+    def has_pattern(self, pattern_id: str) -> bool:
+        return pattern_id in self.pattern_index
+
+    def pattern_arrays(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Vistas (sin copia) de las coordenadas del pattern `idx`"""
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.lats[start:end], self.lons[start:end]
+
+    def patterns_near_bbox(self, lat: float, lon: float, radius: float) -> np.ndarray:
+        """Patterns cuyo bounding box está a menos de `radius` metros del punto"""
+        dlat = radius / 111320.0
+        dlon = radius / (111320.0 * max(np.cos(np.radians(lat)), 1e-6))
+        bbox = self.pattern_bbox
+        with np.errstate(invalid="ignore"):
+            mask = (bbox[:, 0] - dlat <= lat) & (lat <= bbox[:, 1] + dlat) & \
+                   (bbox[:, 2] - dlon <= lon) & (lon <= bbox[:, 3] + dlon)
+        return np.nonzero(mask)[0]
+
+    @property
+    def segment_index(self) -> SegmentGrid:
+        """Grilla de segmentos para búsquedas por radio (se arma una vez por snapshot)"""
+        if self._segment_index is None:
+            with self._derived_lock:
+                if self._segment_index is None:
+                    self._segment_index = SegmentGrid(self)
+        return self._segment_index
+
+    @property
+    def candidate_raster(self) -> Optional[CandidateRaster]:
+        """Raster de candidatos (None hasta que termina de armarse)"""
+        return self._candidate_raster
+
+    def build_candidate_raster(self, radius_m: float, cell_m: float,
+                               previous: Optional["NetworkSnapshot"] = None) -> CandidateRaster:
+        """
+        Arma el raster de candidatos. Con el snapshot anterior (mismo radio y
+        celda) solo se recalculan las celdas de los patterns editados.
+        """
+        old = previous.candidate_raster if previous is not None else None
+        if old is not None and old.radius_m == radius_m and old.cell_m == cell_m:
+            raster = old.refreshed(self)
+        else:
+            raster = CandidateRaster.build(self, radius_m, cell_m)
+        self._candidate_raster = raster
+        return raster
+
+    def patterns_within(self, lat: float, lon: float, radius: float) -> NearbyPatterns:
+        """
+        Patterns con algún segmento a menos de `radius` metros, el más cercano
+        primero. Lee el raster de candidatos si lo hay y alcanza el radio; si
+        no, la grilla de segmentos.
+        """
+        raster = self._candidate_raster
+        if raster is not None and radius <= raster.radius_m:
+            return raster.lookup(lat, lon, radius)
+        qx, qy = local_xy(lat, lon, *self.origin)
+        return self.segment_index.query(float(qx), float(qy), radius)
+
+    def pattern_cum_dist(self, idx: int) -> np.ndarray:
+        """Distancia acumulada (metros) de cada vértice del pattern `idx`"""
+        return self.cum_dist[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def locate(self, patterns, measures) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Posiciones dadas en metros desde el inicio de cada pattern (referencia
+        lineal) → (primer vértice en o después de la posición, lat, lon).
+        Vectorizado: `patterns` y `measures` son arreglos paralelos.
+        """
+        patterns = np.atleast_1d(np.asarray(patterns, dtype=np.int64))
+        measures = np.clip(np.atleast_1d(np.asarray(measures, dtype=np.float64)),
+                           0.0, self.pattern_length[patterns])
+        start = self.offsets[patterns]
+        vertex = np.searchsorted(self.locate_keys, self.locate_base[patterns] + measures, side="left")
+        prev = np.maximum(vertex - 1, start)
+        length = self.cum_dist[vertex] - self.cum_dist[prev]
+        fraction = np.ones_like(length)
+        np.divide(measures - self.cum_dist[prev], length, out=fraction, where=length > 0)
+        lat = self.lats[prev] + fraction * (self.lats[vertex] - self.lats[prev])
+        lon = self.lons[prev] + fraction * (self.lons[vertex] - self.lons[prev])
+        return vertex - start, lat, lon
+
+    def ride_distance(self, idx: int, from_m: float, to_m: float) -> Optional[float]:
+        """
+        Metros en micro entre dos posiciones del pattern (metros desde su inicio).
+        En rutas circulares se puede pasar por el final y seguir desde el inicio;
+        en las demás devuelve None si el destino está antes que el origen.
+        """
+        if to_m >= from_m:
+            return to_m - from_m
+        if self.pattern_is_loop[idx]:
+            return float(self.pattern_length[idx] - from_m + self.pattern_closing_m[idx] + to_m)
+        return None
+
+    def project(self, idx: int, lats, lons) -> Projection:
+        """Proyecta uno o varios puntos sobre los segmentos del pattern `idx` (≥ 2 vértices)"""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        lat0, lon0 = self.origin
+        kx, ky = self.meters_per_degree
+        qx = (lons - lon0) * kx
+        qy = (lats - lat0) * ky
+
+        # Descartar bloques cuyo círculo está más lejos que el peor caso del mejor bloque
+        blocks = slice(self.block_offsets[idx], self.block_offsets[idx + 1])
+        d = np.hypot(self.block_cx[blocks] - qx[:, None], self.block_cy[blocks] - qy[:, None])
+        r = self.block_r[blocks]
+        upper = (d + r).min(axis=1, keepdims=True)
+        candidates = blocks.start + np.nonzero((d - r <= upper).any(axis=0))[0]
+        starts = self.block_start[candidates]
+        lengths = self.block_end[candidates] - starts
+        # Rangos [start, end) de cada bloque concatenados sin bucle
+        segments = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        x0, y0, dx, dy, inv_len2 = self.segment_table[:, segments]
+        best, fraction, px, py, distance = project_xy(x0, y0, dx, dy, inv_len2, qx, qy)
+        plat = lat0 + py / ky
+        plon = lon0 + px / kx
+        return Projection(segments[best] - self.offsets[idx], fraction, plat, plon, distance)
+
+    @property
+    def transfers(self):
+        """Tabla de transbordos entre patterns (se calcula una vez por snapshot)"""
+        if self._transfers is None:
+            with self._derived_lock:
+                if self._transfers is None:
+                    from app.services.pattern_transfers import (
+                        build_transfer_table, links_from_rows, table_from_links
+                    )
+                    if self._transfer_rows is not None:
+                        self._transfers = table_from_links(self, links_from_rows(self, self._transfer_rows))
+                    else:
+                        self._transfers = build_transfer_table(self)
+        return self._transfers
+
+    def polyline(self, idx: int) -> PatternPolyline:
+        """Polyline pre-codificada del pattern `idx` (se arma la primera vez que se usa)"""
+        polyline = self._polylines.get(idx)
+        if polyline is None:
+            polyline = PatternPolyline(*self.pattern_arrays(idx))
+            self._polylines[idx] = polyline
+        return polyline
+
+    def pattern_coords(self, pattern_id: str) -> List[Tuple[float, float]]:
+        """Coordenadas (lat, lon) del pattern, mismo formato que _get_pattern_geometry"""
+        idx = self.pattern_index.get(pattern_id)
+        if idx is None:
+            return []
+        lats, lons = self.pattern_arrays(idx)
+        if len(lats) <= 2:
+            return []
+        return list(zip(lats.tolist(), lons.tolist()))
+
+    def line_for_pattern(self, pattern_id: str) -> Optional[LineInfo]:
+        idx = self.pattern_index.get(pattern_id)
+        if idx is None or self.pattern_line[idx] < 0:
+            return None
+        return self.lines[self.pattern_line[idx]]
+
+    def stop(self, id_parada: int) -> Optional[StopInfo]:
+        idx = self.stop_index.get(id_parada)
+        if idx is None:
+            return None
+        return self.stops[idx]
+
+    def pattern_stop_ids(self, pattern_id: str) -> List[int]:
+        """IDs de paradas del pattern ordenadas por secuencia"""
+        idx = self.pattern_index.get(pattern_id)
+        if idx is None:
+            return []
+        start, end = self.ps_offsets[idx], self.ps_offsets[idx + 1]
+        return [self.stops[s].id_parada for s in self.ps_stop[start:end]]
+
+    def stop_measure(self, idx: int, sequence: int) -> Optional[float]:
+        """Metros desde el inicio del pattern `idx` hasta su parada número `sequence`"""
+        start, end = self.ps_offsets[idx], self.ps_offsets[idx + 1]
+        k = start + int(np.searchsorted(self.ps_sequence[start:end], sequence))
+        if k == end or self.ps_sequence[k] != sequence or np.isnan(self.ps_measure[k]):
+            return None
+        return float(self.ps_measure[k])
+
+
+# ===== Snapshot global del proceso =====
+
+_snapshot: Optional[NetworkSnapshot] = None
+_network_version = 0
+_lock = threading.Lock()  # Versión y snapshot publicado (nunca se toma durante una carga)
+_load_lock = threading.Lock()  # Una sola carga desde la base a la vez
+_reloading = False
+_failed_version: Optional[int] = None
+_failed_at = 0.0
+
+
+def get_network_version() -> int:
+    return _network_version
+
+
+def invalidate_network_snapshot() -> None:
+    """Marca el snapshot como desactualizado (llamar tras editar la red)"""
+    global _network_version
+    with _lock:
+        _network_version += 1
+
+
+def _retry_pending(version: int) -> bool:
+    """True si la carga de `version` falló hace menos de SNAPSHOT_RETRY_SECONDS"""
+    return _failed_version == version and time.monotonic() - _failed_at < settings.SNAPSHOT_RETRY_SECONDS
+
+
+def serving_stale_snapshot() -> bool:
+    """True mientras se sirve un snapshot de una versión anterior de la red"""
+    snapshot = _snapshot
+    return snapshot is not None and snapshot.version != _network_version
+
+
+def load_network_snapshot(db: Session) -> Optional[NetworkSnapshot]:
+    """
+    Reconstruye el snapshot desde la base de datos y lo publica. Si falla
+    devuelve el anterior (o None), deja la sesión usable y no reintenta esa
+    versión hasta que pase SNAPSHOT_RETRY_SECONDS.
+    """
+    global _snapshot, _failed_version, _failed_at
+    with _load_lock:
+        version = _network_version
+        if _snapshot is not None and _snapshot.version == version:
+            return _snapshot
+        if _retry_pending(version):
+            return _snapshot
+        try:
+            snapshot = NetworkSnapshot.load(db, version=version)
+            # Precalcular transbordos y la grilla de segmentos antes de publicar
+            # para no cargar el primer request
+            snapshot.transfers
+            snapshot.segment_index
+        except Exception as e:
+            db.rollback()
+            _failed_version, _failed_at = version, time.monotonic()
+            logger.warning("snapshot_load_failed version=%d error=%r", version, e)
+            return _snapshot
+        with _lock:
+            previous, _snapshot = _snapshot, snapshot
+            _failed_version = None
+        logger.info("snapshot_loaded version=%d patterns=%d vertices=%d stops=%d",
+                    version, snapshot.num_patterns, snapshot.num_vertices, len(snapshot.stops))
+
+    if settings.CANDIDATE_RASTER_RADIUS_M > 0:
+        # El raster tarda segundos: se arma fuera del lock y se publica al
+        # terminar; mientras tanto patterns_within usa la grilla de segmentos
+        threading.Thread(target=_build_candidate_raster, args=(snapshot, previous),
+                         name="candidate-raster", daemon=True).start()
+    return snapshot
+
+
+def _build_candidate_raster(snapshot: NetworkSnapshot, previous: Optional[NetworkSnapshot]) -> None:
+    if _snapshot is not snapshot:
+        return  # Ya se publicó una versión más nueva
+    try:
+        raster = snapshot.build_candidate_raster(settings.CANDIDATE_RASTER_RADIUS_M,
+                                                 settings.CANDIDATE_RASTER_CELL_M, previous=previous)
+    except Exception:
+        logger.exception("candidate_raster_failed version=%d", snapshot.version)
+        return
+    logger.info("candidate_raster_built version=%d entries=%d", snapshot.version, len(raster))
+
+
+def _reload_in_background() -> None:
+    global _reloading
+    from app.database import SessionLocal
+    db = SessionLocal()
+    try:
+        load_network_snapshot(db)
+    except Exception:
+        logger.exception("snapshot_reload_failed")
+    finally:
+        db.close()
+        with _lock:
+            _reloading = False
+
+
+def get_network_snapshot(db: Optional[Session] = None) -> Optional[NetworkSnapshot]:
+    """
+    Devuelve el snapshot vigente. Si está desactualizado y se pasa una sesión,
+    lanza la reconstrucción en un hilo aparte y devuelve el anterior; solo si
+    todavía no hay ninguno lo carga en este request con la sesión recibida.
+    Sin sesión devuelve el último disponible (o None).
+    """
+    global _reloading
+    snapshot = _snapshot
+    if db is None or (snapshot is not None and snapshot.version == _network_version):
+        return snapshot
+    if _retry_pending(_network_version):
+        return snapshot
+    if snapshot is None:
+        return load_network_snapshot(db)
+    with _lock:
+        if _reloading:
+            return snapshot
+        _reloading = True
+    threading.Thread(target=_reload_in_background, name="snapshot-reload", daemon=True).start()
+    return snapshot
+
+
+def set_network_snapshot(snapshot: Optional[NetworkSnapshot]) -> None:
+    """Publica un snapshot ya construido (tests, benchmarks)"""
+    global _snapshot
+    with _lock:
+        _snapshot = snapshot
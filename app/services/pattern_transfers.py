@@ -0,0 +1,413 @@
+"""
+Transbordos a pie entre patterns.
+
+Cada pattern se discretiza en nodos de abordaje virtuales cada ~100 m de
+recorrido (los micros paran en cualquier esquina, no solo en las paradas
+cargadas): cada nodo es una posición sobre el trazado con su medida lineal
+(metros desde el inicio del pattern), no un vértice. Se buscan pares de nodos
+de líneas distintas a menos de `max_walk_m` usando un hash de grilla: solo se
+comparan nodos de celdas vecinas. Por cada par de patterns se guarda el mejor
+transbordo de cada tramo (`corridor_m`) del pattern de origen, así el motor de
+búsqueda tiene trabajo acotado por ronda.
+
+Los transbordos se persisten en transporte.pattern_transfers (ver
+scripts/rebuild_pattern_transfers.py); si la tabla está vacía se calculan
+en memoria al cargar el snapshot.
+"""
+from typing import Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.geometry import local_xy, walking_distance_np
+
+TRANSFER_MAX_WALK_M = 500  # Igual que el ST_DWithin(..., 500) de las queries anteriores
+NODE_SPACING_M = 100
+CORRIDOR_M = 1000
+
+# Vecindario "medio" de la grilla: cada par de celdas se compara una sola vez
+_HALF_STENCIL = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+_FULL_STENCIL = tuple((dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+_FAR = 1e12
+
+
+class TransferLinks(NamedTuple):
+    """Filas de transporte.pattern_transfers con índices de pattern del snapshot"""
+    from_pattern: np.ndarray
+    from_measure: np.ndarray  # Metros desde el inicio del pattern de origen
+    to_pattern: np.ndarray
+    to_measure: np.ndarray
+    walk_m: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "TransferLinks":
+        ints = np.zeros(0, dtype=np.int32)
+        return cls(ints, np.zeros(0), ints, np.zeros(0), np.zeros(0))
+
+    def __len__(self) -> int:
+        return len(self.from_pattern)
+
+
+class BoardingNodes(NamedTuple):
+    """Nodos de abordaje virtuales, ordenados por pattern y medida"""
+    pattern: np.ndarray
+    measure: np.ndarray  # Metros desde el inicio del pattern
+    vertex: np.ndarray  # Primer vértice en o después del nodo
+    lat: np.ndarray
+    lon: np.ndarray
+
+    @classmethod
+    def at(cls, snapshot, pattern: np.ndarray, measure: np.ndarray) -> "BoardingNodes":
+        vertex, lat, lon = snapshot.locate(pattern, measure)
+        return cls(pattern.astype(np.int32), measure.astype(np.float64), vertex.astype(np.int32), lat, lon)
+
+
+class TransferTable:
+    """
+    Nodos de abordaje y transbordos entre ellos.
+
+    Nodos (ordenados por pattern y medida):
+        node_pattern, node_measure, node_vertex, node_lat, node_lon,
+        node_offsets (CSR por pattern)
+    Transbordos (ordenados por pattern de origen):
+        from_node, to_node, walk_m, offsets (CSR por pattern de origen)
+    """
+
+    def __init__(self, num_patterns: int, nodes: BoardingNodes,
+                 from_node: np.ndarray, to_node: np.ndarray, walk_m: np.ndarray):
+        self.num_patterns = num_patterns
+        self.node_pattern = nodes.pattern.astype(np.int32)
+        self.node_measure = nodes.measure.astype(np.float64)
+        self.node_vertex = nodes.vertex.astype(np.int32)
+        self.node_lat, self.node_lon = nodes.lat, nodes.lon
+        self.node_offsets = np.searchsorted(self.node_pattern, np.arange(num_patterns + 1)).astype(np.int64)
+
+        order = np.lexsort((walk_m, from_node))
+        self.from_node = from_node[order].astype(np.int32)
+        self.to_node = to_node[order].astype(np.int32)
+        self.walk_m = walk_m[order].astype(np.float64)
+        self.street_walk_m = walking_distance_np(self.walk_m)
+        from_pattern = self.node_pattern[self.from_node]
+        self.offsets = np.searchsorted(from_pattern, np.arange(num_patterns + 1)).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.from_node)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_pattern)
+
+    def outgoing(self, pattern_idx: int) -> slice:
+        """Filas de transbordos que salen del pattern `pattern_idx`"""
+        return slice(self.offsets[pattern_idx], self.offsets[pattern_idx + 1])
+
+    def pattern_nodes(self, pattern_idx: int) -> slice:
+        return slice(self.node_offsets[pattern_idx], self.node_offsets[pattern_idx + 1])
+
+
+def sample_boarding_nodes(snapshot, spacing_m: float = NODE_SPACING_M) -> BoardingNodes:
+    """
+    Nodos virtuales cada `spacing_m` metros de recorrido (y uno en el final)
+    en cada pattern con línea, sin importar dónde caigan los vértices.
+    """
+    sizes = np.diff(snapshot.offsets)
+    eligible = np.nonzero((snapshot.pattern_line >= 0) & (sizes >= 2))[0]
+    lengths = snapshot.pattern_length[eligible]
+    # Marcas 0, s, 2s, ... < largo, más el final
+    counts = np.ceil(lengths / spacing_m).astype(np.int64) + 1
+    pattern = np.repeat(eligible, counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    measure = np.minimum(k * float(spacing_m), np.repeat(lengths, counts))
+    return BoardingNodes.at(snapshot, pattern, measure)
+
+
+def _best_per_group(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Índices del menor `value` de cada `key`"""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Un solo argsort de enteros y mínimos por grupos contiguos (lexsort con
+    # dos claves era lo más caro de toda la pasada)
+    order = np.argsort(keys, kind="stable")
+    keys, values = keys[order], values[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    group_min = np.minimum.reduceat(values, starts)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(keys)]))
+    positions = np.arange(len(order))
+    return order[np.minimum.reduceat(np.where(values == group_min[group], positions, len(order)), starts)]
+
+
+def compute_transfer_links(snapshot, pattern_indices: Optional[Iterable[int]] = None,
+                           max_walk_m: float = TRANSFER_MAX_WALK_M,
+                           node_spacing_m: float = NODE_SPACING_M,
+                           corridor_m: float = CORRIDOR_M) -> TransferLinks:
+    """
+    Calcula los transbordos con un hash de grilla.
+    Con `pattern_indices` solo se calculan los que salen o llegan a esos patterns
+    (reconstrucción incremental tras editar un pattern).
+    """
+    nodes = sample_boarding_nodes(snapshot, node_spacing_m)
+    node_pattern = nodes.pattern
+    num_patterns = snapshot.num_patterns
+    if len(node_pattern) == 0:
+        return TransferLinks.empty()
+
+    x, y = local_xy(nodes.lat, nodes.lon, *snapshot.origin)
+    node_line = snapshot.pattern_line[node_pattern]
+    corridor = (nodes.measure // corridor_m).astype(np.int64)
+    max_corridor = int(corridor.max()) + 1
+
+    cx = np.floor(x / max_walk_m).astype(np.int64)
+    cy = np.floor(y / max_walk_m).astype(np.int64)
+    cy_span = int(cy.max() - cy.min()) + 3
+    cell_key = (cx - cx.min() + 1) * cy_span + (cy - cy.min() + 1)
+
+    # Dentro de cada celda los nodos quedan agrupados por (pattern, tramo): cada
+    # bloque de celdas vecinas se reduce a la mínima distancia entre grupos y
+    # solo para los ganadores se busca el par de nodos concreto
+    group_key = node_pattern.astype(np.int64) * max_corridor + corridor
+    order = np.lexsort((group_key, cell_key))
+    sorted_keys = cell_key[order]
+    sorted_groups = group_key[order]
+    unique_keys, starts = np.unique(sorted_keys, return_index=True)
+    ends = np.append(starts[1:], len(order))
+    cells = {int(k): np.arange(s, e) for k, s, e in zip(unique_keys, starts, ends)}
+
+    if pattern_indices is None:
+        selected = None
+        stencil = _HALF_STENCIL
+    else:
+        selected = np.isin(node_pattern, np.fromiter(pattern_indices, dtype=np.int64))[order]
+        stencil = _FULL_STENCIL
+
+    sx, sy = x[order], y[order]
+    s_pattern = node_pattern[order].astype(np.int64)
+    s_line = node_line[order]
+    s_corridor = corridor[order]
+
+    def group_starts(positions):
+        keys = sorted_groups[positions]
+        return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+    chunks_key, chunks_dist, chunks_from, chunks_to = [], [], [], []
+    max_walk_sq = max_walk_m * max_walk_m
+
+    def emit(rows, row_starts, cols, col_starts, gi, gj, d2):
+        """Candidatos del grupo de filas `gi` al grupo de columnas `gj`"""
+        a, b = rows[row_starts[gi]], cols[col_starts[gj]]
+        chunks_key.append((s_pattern[a] * num_patterns + s_pattern[b]) * max_corridor + s_corridor[a])
+        chunks_dist.append(d2)
+        chunks_from.append(a)
+        chunks_to.append(b)
+
+    for key, members in cells.items():
+        if selected is not None:
+            members = members[selected[members]]
+            if len(members) == 0:
+                continue
+        member_starts = group_starts(members)
+        for dx, dy in stencil:
+            neighbors = cells.get(key + dx * cy_span + dy)
+            if neighbors is None:
+                continue
+            neighbor_starts = group_starts(neighbors)
+            d2 = np.square(np.subtract.outer(sx[members], sx[neighbors]))
+            d2 += np.square(np.subtract.outer(sy[members], sy[neighbors]))
+            block = np.minimum.reduceat(np.minimum.reduceat(d2, neighbor_starts, axis=1), member_starts, axis=0)
+            gi, gj = np.nonzero((block <= max_walk_sq) &
+                                (s_line[members[member_starts]][:, None] != s_line[neighbors[neighbor_starts]][None, :]))
+            if len(gi) == 0:
+                continue
+            emit(members, member_starts, neighbors, neighbor_starts, gi, gj, block[gi, gj])
+            if selected is not None or (dx, dy) != (0, 0):
+                # Emitir ambas direcciones (la misma celda ya las incluye en la pasada completa)
+                emit(neighbors, neighbor_starts, members, member_starts, gj, gi, block[gi, gj])
+
+    if not chunks_key:
+        return TransferLinks.empty()
+
+    keep = _best_per_group(np.concatenate(chunks_key), np.concatenate(chunks_dist))
+    from_first = np.concatenate(chunks_from)[keep]
+    to_first = np.concatenate(chunks_to)[keep]
+    from_node, to_node = _closest_pair(sx, sy, sorted_groups, from_first, to_first)
+    walk = np.sqrt(np.concatenate(chunks_dist)[keep])
+    from_node, to_node = order[from_node], order[to_node]
+    return TransferLinks(node_pattern[from_node], nodes.measure[from_node],
+                         node_pattern[to_node], nodes.measure[to_node], walk)
+
+
+def _closest_pair(x: np.ndarray, y: np.ndarray, groups: np.ndarray,
+                  from_first: np.ndarray, to_first: np.ndarray,
+                  chunk: int = 1 << 16) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Par de nodos más cercano entre dos grupos contiguos de (pattern, tramo)
+    que empiezan en `from_first` y `to_first` (posiciones del orden por celda).
+    Los grupos dentro de una celda tienen pocos nodos: se comparan todos.
+    """
+    run_end = np.r_[np.flatnonzero(groups[1:] != groups[:-1]) + 1, len(groups)]
+    from_size = run_end[np.searchsorted(run_end, from_first, side="right")] - from_first
+    to_size = run_end[np.searchsorted(run_end, to_first, side="right")] - to_first
+    # Por tamaño creciente: cada bloque se rellena solo hasta su grupo más grande
+    by_size = np.argsort(np.maximum(from_size, to_size), kind="stable")
+    from_node = np.empty_like(from_first)
+    to_node = np.empty_like(to_first)
+    for lo in range(0, len(by_size), chunk):
+        rows = by_size[lo:lo + chunk]
+        first_a, first_b = from_first[rows, None], to_first[rows, None]
+        width = int(max(from_size[rows].max(), to_size[rows].max()))
+        offsets = np.arange(width)
+        a_valid = offsets < from_size[rows, None]
+        b_valid = offsets < to_size[rows, None]
+        a = np.where(a_valid, first_a + offsets, first_a)
+        b = np.where(b_valid, first_b + offsets, first_b)
+        # El relleno queda lejísimos (en lados opuestos) y nunca es el mínimo
+        xa, ya = np.where(a_valid, x[a], _FAR), np.where(a_valid, y[a], _FAR)
+        xb, yb = np.where(b_valid, x[b], -_FAR), np.where(b_valid, y[b], -_FAR)
+        d2 = (xa[:, :, None] - xb[:, None, :]) ** 2 + (ya[:, :, None] - yb[:, None, :]) ** 2
+        best = d2.reshape(len(rows), -1).argmin(axis=1)
+        picked = np.arange(len(rows))
+        from_node[rows] = a[picked, best // width]
+        to_node[rows] = b[picked, best % width]
+    return from_node, to_node
+
+
+def table_from_links(snapshot, links: TransferLinks) -> TransferTable:
+    """Arma la TransferTable del motor descartando patterns de líneas inactivas"""
+    num_patterns = snapshot.num_patterns
+    line = snapshot.pattern_line
+    active = (line >= 0) & snapshot.line_activa[np.maximum(line, 0)] if len(line) else np.zeros(0, dtype=bool)
+    keep = active[links.from_pattern] & active[links.to_pattern] if len(links) else np.zeros(0, dtype=bool)
+
+    # Nodo = (pattern, medida en centímetros) en un solo int64
+    stride = np.int64(1) << 32
+    from_key = links.from_pattern[keep].astype(np.int64) * stride + _centimeters(links.from_measure[keep])
+    to_key = links.to_pattern[keep].astype(np.int64) * stride + _centimeters(links.to_measure[keep])
+    node_keys = np.unique(np.concatenate([from_key, to_key]))
+    nodes = BoardingNodes.at(snapshot, node_keys // stride, (node_keys % stride) / 100.0)
+    return TransferTable(
+        num_patterns,
+        nodes,
+        np.searchsorted(node_keys, from_key),
+        np.searchsorted(node_keys, to_key),
+        links.walk_m[keep],
+    )
+
+
+def _centimeters(measure: np.ndarray) -> np.ndarray:
+    return np.round(np.asarray(measure, dtype=np.float64) * 100.0).astype(np.int64)
+
+
+def build_transfer_table(snapshot) -> TransferTable:
+    """Tabla de transbordos de toda la red calculada en memoria"""
+    return table_from_links(snapshot, compute_transfer_links(snapshot))
+
+
+def links_from_rows(snapshot, rows: Sequence[Tuple[str, float, str, float, float]]) -> TransferLinks:
+    """Convierte filas (from_pattern_id, from_measure, to_pattern_id, to_measure, walk_m) a índices"""
+    sizes = np.diff(snapshot.offsets)
+    columns = ([], [], [], [], [])
+    for from_id, from_measure, to_id, to_measure, walk_m in rows:
+        p = snapshot.pattern_index.get(from_id)
+        q = snapshot.pattern_index.get(to_id)
+        if p is None or q is None or sizes[p] < 2 or sizes[q] < 2:
+            continue
+        # Filas sin medida (anteriores a 004_transfer_measures.sql) o de
+        # geometrías viejas (medida más allá del largo actual) se ignoran
+        if from_measure is None or to_measure is None or \
+                from_measure > snapshot.pattern_length[p] + 1.0 or to_measure > snapshot.pattern_length[q] + 1.0:
+            continue
+        for column, value in zip(columns, (p, from_measure, q, to_measure, walk_m)):
+            column.append(value)
+    if not columns[0]:
+        return TransferLinks.empty()
+    return TransferLinks(np.array(columns[0], dtype=np.int32), np.array(columns[1], dtype=np.float64),
+                         np.array(columns[2], dtype=np.int32), np.array(columns[3], dtype=np.float64),
+                         np.array(columns[4], dtype=np.float64))
+
+
+# ===== Persistencia en transporte.pattern_transfers =====
+
+def save_transfer_links(db: Session, snapshot, links: TransferLinks,
+                        pattern_ids: Optional[Sequence[str]] = None) -> int:
+    """
+    Reemplaza las filas de transporte.pattern_transfers.
+    Con `pattern_ids` solo se reemplazan las filas que tocan esos patterns.
+    """
+    if pattern_ids is None:
+        db.execute(text("DELETE FROM transporte.pattern_transfers"))
+    else:
+        db.execute(text("""
+            DELETE FROM transporte.pattern_transfers
+            WHERE from_pattern_id = ANY(:ids) OR to_pattern_id = ANY(:ids)
+        """), {"ids": list(pattern_ids)})
+
+    from_vertex, from_lat, from_lon = snapshot.locate(links.from_pattern, links.from_measure)
+    to_vertex, to_lat, to_lon = snapshot.locate(links.to_pattern, links.to_measure)
+    rows = [
+        {
+            "from_pattern_id": snapshot.pattern_ids[p],
+            "to_pattern_id": snapshot.pattern_ids[q],
+            "from_vertex": fv,
+            "to_vertex": tv,
+            "from_measure": fm,
+            "to_measure": tm,
+            "from_lat": flat,
+            "from_lon": flon,
+            "to_lat": tlat,
+            "to_lon": tlon,
+            "walk_m": w,
+        }
+        for p, fv, fm, flat, flon, q, tv, tm, tlat, tlon, w in zip(
+            links.from_pattern.tolist(), from_vertex.tolist(), links.from_measure.tolist(),
+            from_lat.tolist(), from_lon.tolist(),
+            links.to_pattern.tolist(), to_vertex.tolist(), links.to_measure.tolist(),
+            to_lat.tolist(), to_lon.tolist(), links.walk_m.tolist()
+        )
+    ]
+    if rows:
+        db.execute(text("""
+            INSERT INTO transporte.pattern_transfers
+                (from_pattern_id, to_pattern_id, from_vertex, to_vertex, from_measure, to_measure,
+                 from_lat, from_lon, to_lat, to_lon, walk_m)
+            VALUES
+                (:from_pattern_id, :to_pattern_id, :from_vertex, :to_vertex, :from_measure, :to_measure,
+                 :from_lat, :from_lon, :to_lat, :to_lon, :walk_m)
+        """), rows)
+    db.commit()
+    return len(rows)
+
+
+def rebuild_transfer_table(db: Session) -> int:
+    """Recalcula todos los transbordos y los guarda (comando de rebuild)"""
+    from app.services.network_snapshot import NetworkSnapshot, invalidate_network_snapshot
+    snapshot = NetworkSnapshot.load(db)
+    count = save_transfer_links(db, snapshot, compute_transfer_links(snapshot))
+    invalidate_network_snapshot()
+    return count
+
+
+def discard_transfer_table(db: Session) -> None:
+    """
+    Vacía transporte.pattern_transfers: el snapshot vuelve a calcular todos
+    los transbordos en memoria hasta el próximo rebuild.
+    """
+    db.execute(text("DELETE FROM transporte.pattern_transfers"))
+    db.commit()
+
+
+def refresh_pattern_transfers(db: Session, pattern_id: str) -> int:
+    """
+    Recalcula solo los transbordos que salen o llegan a `pattern_id`.
+    Si la tabla nunca se construyó (vacía) no hace nada: el snapshot
+    seguirá calculando los transbordos en memoria.
+    """
+    from app.services.network_snapshot import NetworkSnapshot, invalidate_network_snapshot
+    in_use = db.execute(text("SELECT EXISTS (SELECT 1 FROM transporte.pattern_transfers)")).scalar()
+    if not in_use:
+        return 0
+    snapshot = NetworkSnapshot.load(db)
+    idx = snapshot.pattern_index.get(pattern_id)
+    links = compute_transfer_links(snapshot, [idx]) if idx is not None else TransferLinks.empty()
+    count = save_transfer_links(db, snapshot, links, pattern_ids=[pattern_id])
+    invalidate_network_snapshot()
+    return count
@@ -0,0 +1,117 @@
+"""
+Cache de planes para pares origen/destino frecuentes.
+
+La clave es la celda de grilla (~PLAN_CACHE_CELL_METERS) del origen y del
+destino más los parámetros del request. El plan se guarda como JSON
+comprimido y al devolverlo se corre a la hora actual y se ajustan los
+extremos de las caminatas a las coordenadas exactas del request.
+
+Cualquier edición de líneas, patterns o paradas incrementa la versión de la
+red (ver network_snapshot.invalidate_network_snapshot) y vacía el cache.
+"""
+import math
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from app.schemas.otp_schemas import PlanSchema
+from app.services.metrics import CACHE_REQUESTS
+from app.services.network_snapshot import get_network_version
+from app.services.polyline import encode_polyline
+
+METERS_PER_DEGREE = 111320.0
+
+
+def grid_cell(lat: float, lon: float, cell_m: float) -> Tuple[int, int]:
+    """Celda de ~cell_m metros que contiene el punto"""
+    step = cell_m / METERS_PER_DEGREE
+    row = math.floor(lat / step)
+    lon_step = step / max(math.cos(math.radians((row + 0.5) * step)), 1e-6)
+    return row, math.floor(lon / lon_step)
+
+
+class PlanCache:
+    """LRU con vencimiento (TTL) de planes serializados"""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 600, cell_m: float = 50):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cell_m = cell_m
+        self._entries: "OrderedDict[Hashable, Tuple[float, bytes]]" = OrderedDict()
+        self._version = get_network_version()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float,
+                 *params: Hashable) -> Hashable:
+        return (grid_cell(from_lat, from_lon, self.cell_m),
+                grid_cell(to_lat, to_lon, self.cell_m)) + tuple(params)
+
+    def _check_version(self) -> None:
+        version = get_network_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: Hashable) -> Optional[PlanSchema]:
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="plan", result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="plan", result="hit")
+            payload = entry[1]
+        return PlanSchema.model_validate_json(zlib.decompress(payload))
+
+    def put(self, key: Hashable, plan: PlanSchema) -> None:
+        payload = zlib.compress(plan.model_dump_json(by_alias=True).encode())
+        with self._lock:
+            self._check_version()
+            self._entries[key] = (time.monotonic(), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def retime_plan(plan: PlanSchema, now_ms: int, from_lat: float, from_lon: float,
+                to_lat: float, to_lon: float) -> PlanSchema:
+    """
+    Adapta un plan cacheado al request actual: corre todos los horarios a
+    `now_ms` y mueve el inicio/fin de las caminatas al origen/destino exactos.
+    """
+    shift = now_ms - plan.date
+    plan.date = now_ms
+    plan.from_.lat, plan.from_.lon = from_lat, from_lon
+    plan.to.lat, plan.to.lon = to_lat, to_lon
+    for itinerary in plan.itineraries:
+        itinerary.startTime += shift
+        itinerary.endTime += shift
+        for leg in itinerary.legs:
+            leg.startTime += shift
+            leg.endTime += shift
+        if not itinerary.legs:
+            continue
+        first, last = itinerary.legs[0], itinerary.legs[-1]
+        if first.mode == "WALK" and first.from_.name == "Origin":
+            first.from_.lat, first.from_.lon = from_lat, from_lon
+            first.legGeometry.points = encode_polyline([(from_lat, from_lon), (first.to.lat, first.to.lon)])
+        if last.mode == "WALK" and last.to.name == "Destination":
+            last.to.lat, last.to.lon = to_lat, to_lon
+            last.legGeometry.points = encode_polyline([(last.from_.lat, last.from_.lon), (to_lat, to_lon)])
+    return plan
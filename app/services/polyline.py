@@ -0,0 +1,123 @@
+"""
+Codificación de polylines (formato Google, precisión E5).
+
+Cada punto de una polyline se codifica como el delta E5 respecto del punto
+anterior, así que el tramo [i, j] de un pattern es: el punto i codificado
+desde (0, 0) seguido de los deltas ya codificados de i+1..j. PatternPolyline
+guarda esos deltas una vez por pattern y arma cualquier tramo copiando texto.
+
+El planificador guarda los tramos (VertexRange + puntos sueltos) en los
+candidatos y codifica solo los itinerarios que sobreviven al ranking final.
+"""
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+
+
+def _encode_value(val: int, out: List[str]) -> None:
+    val = ~(val << 1) if val < 0 else (val << 1)
+    while val >= 0x20:
+        out.append(chr((0x20 | (val & 0x1f)) + 63))
+        val >>= 5
+    out.append(chr(val + 63))
+
+
+def encode_polyline(coordinates: List[Tuple[float, float]]) -> str:
+    """Codifica coordenadas en formato polyline de Google"""
+    if not coordinates:
+        return ""
+
+    encoded = []
+    prev_lat = 0
+    prev_lon = 0
+
+    for lat, lon in coordinates:
+        lat_e5 = int(round(lat * 1e5))
+        lon_e5 = int(round(lon * 1e5))
+
+        _encode_value(lat_e5 - prev_lat, encoded)
+        _encode_value(lon_e5 - prev_lon, encoded)
+
+        prev_lat = lat_e5
+        prev_lon = lon_e5
+
+    return ''.join(encoded)
+
+
+class PatternPolyline:
+    """
+    Polyline de un pattern pre-codificada.
+    `encoded[offsets[k]:offsets[k+1]]` es el delta del vértice k-1 al k
+    (vacío para k = 0).
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray):
+        self.lat_e5 = np.round(np.asarray(lats) * 1e5).astype(np.int64)
+        self.lon_e5 = np.round(np.asarray(lons) * 1e5).astype(np.int64)
+        chunks = [""]
+        for d_lat, d_lon in zip(np.diff(self.lat_e5).tolist(), np.diff(self.lon_e5).tolist()):
+            chunk = []
+            _encode_value(d_lat, chunk)
+            _encode_value(d_lon, chunk)
+            chunks.append(''.join(chunk))
+        self.offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in chunks], out=self.offsets[1:])
+        self.encoded = ''.join(chunks)
+
+    def __len__(self) -> int:
+        return len(self.lat_e5)
+
+    def point_e5(self, k: int) -> Tuple[int, int]:
+        return int(self.lat_e5[k]), int(self.lon_e5[k])
+
+    def chunks(self, i: int, j: int) -> str:
+        """Deltas ya codificados de los vértices i+1..j"""
+        return self.encoded[self.offsets[i + 1]:self.offsets[j + 1]]
+
+    def encode_slice(self, i: int, j: int) -> str:
+        """Polyline de los vértices i..j (inclusive)"""
+        return encode_pieces([VertexRange(self, i, j)])
+
+
+class VertexRange(NamedTuple):
+    """Vértices first..last (inclusive) de un pattern pre-codificado"""
+    polyline: PatternPolyline
+    first: int
+    last: int
+
+    def __len__(self) -> int:
+        return max(self.last - self.first + 1, 0)
+
+
+Piece = Union[VertexRange, Sequence[Tuple[float, float]]]
+
+
+def pieces_length(pieces: Sequence[Piece]) -> int:
+    return sum(len(piece) for piece in pieces)
+
+
+def encode_pieces(pieces: Sequence[Piece]) -> str:
+    """
+    Codifica una polyline formada por tramos de patterns (VertexRange) y
+    puntos sueltos (lista de (lat, lon)), p. ej. los puntos proyectados de
+    subida y bajada. De cada tramo solo se recodifica el primer vértice.
+    """
+    encoded = []
+    prev_lat, prev_lon = 0, 0
+    for piece in pieces:
+        if isinstance(piece, VertexRange):
+            if len(piece) == 0:
+                continue
+            lat_e5, lon_e5 = piece.polyline.point_e5(piece.first)
+            _encode_value(lat_e5 - prev_lat, encoded)
+            _encode_value(lon_e5 - prev_lon, encoded)
+            encoded.append(piece.polyline.chunks(piece.first, piece.last))
+            prev_lat, prev_lon = piece.polyline.point_e5(piece.last)
+        else:
+            for lat, lon in piece:
+                lat_e5 = int(round(lat * 1e5))
+                lon_e5 = int(round(lon * 1e5))
+                _encode_value(lat_e5 - prev_lat, encoded)
+                _encode_value(lon_e5 - prev_lon, encoded)
+                prev_lat, prev_lon = lat_e5, lon_e5
+    return ''.join(encoded)
@@ -0,0 +1,125 @@
+"""
+Conteo de statements SQL por request y presupuesto por endpoint.
+
+Un listener de SQLAlchemy (before_cursor_execute, registrado para todos los
+engines) suma cada statement al QueryCounter activo. Igual que el
+StageTimer, el contador vive en un ContextVar: lo heredan el threadpool de
+FastAPI y las búsquedas del planificador lanzadas con copy_context, así que
+también cuenta las queries de sus sesiones propias.
+
+QUERY_BUDGETS fija cuántos statements puede emitir cada endpoint (plantilla
+de ruta). Al pasarse se loguea y se cuenta en /metrics; con
+QUERY_DEBUG_HEADERS la respuesta trae X-Query-Count y X-Query-Budget, que
+usan los tests para fallar si un cambio reintroduce queries N+1.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.services.metrics import DB_QUERY_BUDGET_EXCEEDED, HTTP_DB_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# Statements permitidos por request (plantilla de ruta → máximo)
+QUERY_BUDGETS = {
+    # Búsquedas PostGIS + statement_timeout por etapa; la geometría sale del snapshot
+    "/api/v1/plan": 20,
+    # Patterns con su línea en un SELECT y las geometrías en otro
+    "/api/v1/patterns/": 3,
+    "/api/v1/patterns/line/{id_linea}": 3,
+    # Índice espacial del snapshot en memoria (se llama en cada movimiento del mapa)
+    "/api/v1/lines/nearby": 0,
+}
+
+
+class QueryCounter:
+    """Statements ejecutados (thread-safe); guarda los primeros `keep` para depurar"""
+
+    def __init__(self, keep: int = 0):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.keep = keep
+        self.statements: List[str] = []
+
+    def add(self, statement: str) -> None:
+        with self._lock:
+            self.count += 1
+            if len(self.statements) < self.keep:
+                self.statements.append(statement)
+
+
+_current: ContextVar[Optional[QueryCounter]] = ContextVar("sql_query_counter", default=None)
+
+
+def current_counter() -> Optional[QueryCounter]:
+    return _current.get()
+
+
+@contextmanager
+def count_queries(keep: int = 0) -> Iterator[QueryCounter]:
+    """Cuenta los statements ejecutados dentro del bloque (y en tareas con su contexto)"""
+    counter = QueryCounter(keep)
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _current.get()
+    if counter is not None:
+        counter.add(statement)
+
+
+def install_query_counter() -> None:
+    """Registra el listener para todos los engines (idempotente)"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+
+
+class QueryCountMiddleware:
+    """
+    Middleware ASGI: abre un QueryCounter por request, compara el total con
+    QUERY_BUDGETS y, si `headers()` es verdadero, lo agrega a la respuesta.
+    """
+
+    def __init__(self, app, headers: Callable[[], bool] = lambda: False):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        def budget() -> Optional[int]:
+            route = scope.get("route")
+            return QUERY_BUDGETS.get(getattr(route, "path", None))
+
+        with count_queries() as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start" and self.headers():
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-query-count", str(counter.count).encode()))
+                    limit = budget()
+                    if limit is not None:
+                        headers.append((b"x-query-budget", str(limit).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_count)
+            finally:
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                HTTP_DB_QUERIES.observe(counter.count, route=route)
+                limit = budget()
+                if limit is not None and counter.count > limit:
+                    DB_QUERY_BUDGET_EXCEEDED.inc(route=route)
+                    logger.warning("query_budget_exceeded route=%s queries=%d budget=%d",
+                                   route, counter.count, limit)
@@ -0,0 +1,258 @@
+"""
+Búsqueda por rondas estilo RAPTOR sobre el snapshot de la red.
+
+Ronda k = viajes con k micros (k-1 transbordos). En cada ronda solo se
+recorren los patterns que recibieron un abordaje nuevo en la ronda anterior,
+y desde ellos solo se evalúan sus transbordos precalculados (TransferTable),
+así el trabajo por ronda queda acotado sin importar cuántas líneas existan.
+
+Como los micros de Santa Cruz no tienen horarios, la etiqueta de cada nodo es
+un costo en segundos: viaje + espera + caminata (ponderada por
+`walk_reluctance`). Se usa el costo como criterio y las rondas como segundo
+criterio (Pareto costo × transbordos), igual que RAPTOR.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.services.geometry import measure_at, walking_distance_np
+
+INF = float("inf")
+
+
+@dataclass
+class RaptorParams:
+    walk_speed: float  # metros por minuto
+    bus_speed: float  # metros por minuto
+    wait_s: float  # espera en cada abordaje
+    walk_reluctance: float = 5.0
+    transfer_penalty_s: float = 0.0
+    access_radius_m: float = 1500.0
+    max_transfers: int = 3
+    max_transfer_walk_m: float = INF  # Caminata máxima (siguiendo calles) en cada transbordo
+    cost_slack_s: float = 1800.0  # Se descartan etiquetas peores que el mejor destino + slack
+    max_results: int = 60
+
+
+class Snap(NamedTuple):
+    """Posición sobre el trazado: origen/destino proyectado o nodo de abordaje virtual"""
+    vertex: int  # Primer vértice en o después de la posición
+    offset_m: float  # Metros de recorrido entre la posición y `vertex`
+    distance: float  # Metros en línea recta desde el origen/destino (0 en los nodos)
+    lat: float
+    lon: float
+    measure: float  # Metros desde el inicio del pattern
+
+
+@dataclass
+class JourneyLeg:
+    pattern_idx: int
+    board_vertex: int
+    alight_vertex: int
+    board_at: Optional[Snap] = None  # Punto de subida sobre el trazado
+    alight_at: Optional[Snap] = None  # Punto de bajada sobre el trazado
+
+
+@dataclass
+class Journey:
+    """Resultado de la búsqueda: micros abordados y caminatas (línea recta, metros)"""
+    legs: List[JourneyLeg]
+    walks: List[float] = field(default_factory=list)  # acceso, transbordos..., egreso
+    cost: float = 0.0
+
+    @property
+    def transfers(self) -> int:
+        return len(self.legs) - 1
+
+
+def snap_to_patterns(snapshot, lat: float, lon: float, radius: float) -> Dict[int, Snap]:
+    """
+    Proyección del punto sobre cada pattern (de línea activa) a menos de
+    `radius` metros, con una sola consulta al índice espacial del snapshot.
+    """
+    near = snapshot.patterns_within(lat, lon, radius)
+    result = {}
+    for p, segment, fraction, distance in zip(near.pattern.tolist(), near.segment.tolist(),
+                                              near.fraction.tolist(), near.distance.tolist()):
+        line = snapshot.pattern_line[p]
+        if line < 0 or not snapshot.line_activa[line]:
+            continue
+        cum = snapshot.pattern_cum_dist(p)
+        lats, lons = snapshot.pattern_arrays(p)
+        measure = float(measure_at(cum, segment, fraction))
+        result[p] = Snap(
+            segment + 1, float(cum[segment + 1]) - measure, distance,
+            float(lats[segment] + fraction * (lats[segment + 1] - lats[segment])),
+            float(lons[segment] + fraction * (lons[segment + 1] - lons[segment])),
+            measure,
+        )
+    return result
+
+
+def _ride(board_measure: np.ndarray, board_cost: np.ndarray, targets: np.ndarray,
+          bus_speed_mps: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Costo de llegada a cada posición de `targets` (metros desde el inicio del
+    pattern) viajando en él, dado un conjunto de abordajes ordenado por
+    posición. Solo se puede bajar estrictamente después de subir. Devuelve
+    (costo, índice del abordaje usado).
+
+    Con los abordajes ordenados basta un mínimo acumulado de
+    (costo - distancia/velocidad) y un searchsorted por destino: O(b + m log b).
+    """
+    reduced = board_cost - board_measure / bus_speed_mps
+    running_min = np.minimum.accumulate(reduced)
+    positions = np.arange(len(reduced))
+    running_arg = np.maximum.accumulate(np.where(reduced <= running_min, positions, -1))
+
+    k = np.searchsorted(board_measure, targets, side="left") - 1
+    valid = k >= 0
+    k = np.maximum(k, 0)
+    cost = np.where(valid, running_min[k] + targets / bus_speed_mps, INF)
+    return cost, running_arg[k]
+
+
+class RaptorSearch:
+    """Motor de búsqueda por rondas sobre un NetworkSnapshot"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.transfers = snapshot.transfers
+
+    def _walk_cost(self, straight_m, params: RaptorParams):
+        return self._street_walk_cost(walking_distance_np(straight_m), params)
+
+    def _street_walk_cost(self, street_m, params: RaptorParams):
+        return street_m / params.walk_speed * 60.0 * params.walk_reluctance
+
+    def search(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float,
+               params: RaptorParams, min_transfers: int = 0,
+               should_stop: Optional[Callable[[], bool]] = None) -> List[Journey]:
+        """
+        Journeys ordenados por costo. Si `should_stop` devuelve True entre
+        rondas se corta la búsqueda y se devuelve lo encontrado hasta ahí.
+        """
+        snapshot, table = self.snapshot, self.transfers
+        bus_speed_mps = params.bus_speed / 60.0
+        rounds = params.max_transfers + 1
+
+        access = snap_to_patterns(snapshot, from_lat, from_lon, params.access_radius_m)
+        egress = snap_to_patterns(snapshot, to_lat, to_lon, params.access_radius_m)
+        if not access or not egress:
+            return []
+
+        # Etiquetas: costo de abordar cada nodo por ronda y mejor costo en cualquier ronda
+        tau_star = np.full(table.num_nodes, INF)
+        board_cost = [np.full(table.num_nodes, INF) for _ in range(rounds + 1)]
+        parent_row = [np.full(table.num_nodes, -1, dtype=np.int64) for _ in range(rounds + 1)]
+        parent_node = [np.full(table.num_nodes, -1, dtype=np.int64) for _ in range(rounds + 1)]
+
+        # Ronda 1: abordajes desde el origen (punto proyectado, no necesariamente un nodo)
+        access_board = {
+            p: (a.measure, float(self._walk_cost(a.distance, params)) + params.wait_s)
+            for p, a in access.items()
+        }
+        marked = set(access_board)
+        best_target = INF
+        results = []  # (costo, ronda, pattern, nodo de abordaje)
+
+        for k in range(1, rounds + 1):
+            if k > 1 and should_stop is not None and should_stop():
+                break
+            next_marked = set()
+            for p in marked:
+                nodes = table.pattern_nodes(p)
+                node_ids = np.arange(nodes.start, nodes.stop)
+                if k == 1:
+                    m, c = access_board[p]
+                    bm, bc, bn = np.array([m]), np.array([c]), np.array([-1])
+                else:
+                    costs = board_cost[k][nodes]
+                    has = np.isfinite(costs)
+                    bm, bc, bn = table.node_measure[nodes][has], costs[has], node_ids[has]
+                if len(bm) == 0:
+                    continue
+
+                # Bajar cerca del destino
+                if p in egress:
+                    e = egress[p]
+                    arr, bi = _ride(bm, bc, np.array([e.measure]), bus_speed_mps)
+                    if np.isfinite(arr[0]):
+                        total = float(arr[0] + self._walk_cost(e.distance, params))
+                        best_target = min(best_target, total)
+                        if k - 1 >= min_transfers:
+                            results.append((total, k, p, int(bn[bi[0]])))
+
+                # Transbordar a otros patterns
+                if k == rounds:
+                    continue
+                rows = table.outgoing(p)
+                if rows.start == rows.stop:
+                    continue
+                from_nodes = table.from_node[rows]
+                arr, bi = _ride(bm, bc, table.node_measure[from_nodes], bus_speed_mps)
+                street_walk_m = table.street_walk_m[rows]
+                cand = arr + self._street_walk_cost(street_walk_m, params) + params.wait_s + params.transfer_penalty_s
+                cand[street_walk_m > params.max_transfer_walk_m] = INF
+                to_nodes = table.to_node[rows]
+                improving = np.nonzero(
+                    (cand < tau_star[to_nodes]) & (cand < best_target + params.cost_slack_s)
+                )[0]
+                if len(improving) == 0:
+                    continue
+                # Si varias filas llegan al mismo nodo, gana la de menor costo
+                improving = improving[np.argsort(cand[improving], kind="stable")]
+                _, first = np.unique(to_nodes[improving], return_index=True)
+                improving = improving[first]
+
+                targets = to_nodes[improving]
+                tau_star[targets] = cand[improving]
+                board_cost[k + 1][targets] = cand[improving]
+                parent_row[k + 1][targets] = rows.start + improving
+                parent_node[k + 1][targets] = bn[bi[improving]]
+                next_marked.update(table.node_pattern[targets].tolist())
+
+            marked = next_marked
+            if not marked:
+                break
+
+        results.sort(key=lambda r: r[0])
+        journeys = []
+        for total, k, p, node in results[:params.max_results]:
+            journey = self._reconstruct(k, p, node, egress[p], access, parent_row, parent_node)
+            journey.cost = total
+            journeys.append(journey)
+        return journeys
+
+    def _node_snap(self, node: int) -> Snap:
+        """Nodo de abordaje como posición sobre su pattern"""
+        table = self.transfers
+        vertex = int(table.node_vertex[node])
+        measure = float(table.node_measure[node])
+        cum = self.snapshot.pattern_cum_dist(int(table.node_pattern[node]))
+        return Snap(vertex, float(cum[vertex]) - measure, 0.0,
+                    float(table.node_lat[node]), float(table.node_lon[node]), measure)
+
+    def _reconstruct(self, k, p, node, egress_snap, access, parent_row, parent_node) -> Journey:
+        table = self.transfers
+        legs = [JourneyLeg(p, -1, egress_snap.vertex, alight_at=egress_snap)]
+        walks = [egress_snap.distance]
+        while k > 1:
+            legs[-1].board_at = self._node_snap(node)
+            row = parent_row[k][node]
+            prev_node = parent_node[k][node]
+            from_node = table.from_node[row]
+            alight_at = self._node_snap(from_node)
+            walks.append(float(table.walk_m[row]))
+            k -= 1
+            legs.append(JourneyLeg(int(table.node_pattern[from_node]), -1, alight_at.vertex,
+                                   alight_at=alight_at))
+            node = prev_node
+        legs[-1].board_at = access[legs[-1].pattern_idx]
+        walks.append(legs[-1].board_at.distance)
+        for leg in legs:
+            leg.board_vertex = leg.board_at.vertex
+        legs.reverse()
+        walks.reverse()
+        return Journey(legs=legs, walks=walks)
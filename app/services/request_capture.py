@@ -0,0 +1,158 @@
+"""
+Captura anonimizada de requests para reproducir tráfico real (opt-in).
+
+Con REQUEST_CAPTURE_FILE configurado, cada request a /api/v1/plan, /api
+(búsqueda Photon) y /graphql se agrega como una línea JSON al archivo:
+
+    {"ts": 1767225600.1, "method": "GET", "path": "/api/v1/plan",
+     "query": [["fromPlace", "-17.783,-63.182"], ...], "body": null,
+     "status": 200, "ms": 84.2}
+
+No se guardan headers, IP ni cookies, y las coordenadas se redondean a
+`precision` decimales (3 ≈ 110 m). benchmarks/replay.py reproduce el archivo.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_PATHS = ("/api/v1/plan", "/api", "/graphql")
+MAX_BODY_BYTES = 64 * 1024
+
+# Parámetros "lat,lon" (OTP) y coordenadas sueltas (Photon)
+COORDINATE_PAIR_PARAMS = {"fromPlace", "toPlace"}
+COORDINATE_PARAMS = {"lat", "lon"}
+_NUMBER = re.compile(r"-?\d+\.\d+")
+
+
+def _round_numbers(value: str, precision: int) -> str:
+    return _NUMBER.sub(lambda m: f"{float(m.group()):.{precision}f}", value)
+
+
+def anonymize_query(query: List[Tuple[str, str]], precision: int) -> List[List[str]]:
+    """Redondea las coordenadas de los parámetros del query string"""
+    result = []
+    for name, value in query:
+        if name in COORDINATE_PAIR_PARAMS or name in COORDINATE_PARAMS or name == "bbox":
+            value = _round_numbers(value, precision)
+        result.append([name, value])
+    return result
+
+
+def _round_floats(value: Any, precision: int) -> Any:
+    if isinstance(value, float):
+        return round(value, precision)
+    if isinstance(value, str) and _NUMBER.fullmatch(value.strip()):
+        return _round_numbers(value, precision)
+    if isinstance(value, dict):
+        return {k: _round_floats(v, precision) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_round_floats(v, precision) for v in value]
+    return value
+
+
+def anonymize_body(body: bytes, precision: int) -> Optional[dict]:
+    """
+    Body de GraphQL: se conservan query, operationName y variables (con los
+    números redondeados). Cualquier otro body se descarta.
+    """
+    if not body or len(body) > MAX_BODY_BYTES:
+        return None
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(payload, dict) or "query" not in payload:
+        return None
+    result = {"query": payload["query"]}
+    if payload.get("operationName"):
+        result["operationName"] = payload["operationName"]
+    if payload.get("variables"):
+        result["variables"] = _round_floats(payload["variables"], precision)
+    return result
+
+
+def should_capture(path: str) -> bool:
+    return (path.rstrip("/") or "/") in CAPTURED_PATHS
+
+
+class RequestCapture:
+    """Escribe los requests capturados en un JSONL (una línea por request, thread-safe)"""
+
+    def __init__(self, path: str, precision: int = 3, sample_rate: float = 1.0):
+        self.path = path
+        self.precision = precision
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._file = None
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, method: str, path: str, query_string: bytes, body: bytes,
+               status: int, ms: float) -> dict:
+        entry = {
+            "ts": round(time.time(), 1),
+            "method": method,
+            "path": path,
+            "query": anonymize_query(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True),
+                                     self.precision),
+            "body": anonymize_body(body, self.precision) if method == "POST" else None,
+            "status": status,
+            "ms": round(ms, 1),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                # Append + una escritura por línea: varios workers pueden compartir el archivo
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+        return entry
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RequestCaptureMiddleware:
+    """Middleware ASGI que registra en `capture` los requests de CAPTURED_PATHS"""
+
+    def __init__(self, app, capture: RequestCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_capture(scope["path"]) or not self.capture.sampled():
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+        chunks = []
+
+        async def receive_and_keep():
+            message = await receive()
+            if message["type"] == "http.request" and sum(map(len, chunks)) <= MAX_BODY_BYTES:
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_keep, send_with_status)
+        finally:
+            try:
+                self.capture.record(scope.get("method", ""), scope["path"], scope.get("query_string", b""),
+                                    b"".join(chunks), status["code"], (time.perf_counter() - start) * 1000.0)
+            except Exception:
+                logger.exception("request_capture_failed path=%s", scope["path"])
@@ -2,18 +2,40 @@
 Planificador de rutas mejorado con soporte para transbordos.
 Características:
 - Rutas directas (1 micro)
-- Rutas con 1 transbordo (2 micros)
+- Rutas con 1 a 3 transbordos (2 a 4 micros) vía búsqueda por rondas
 - Cálculo de tiempos realistas
 - Ordenamiento por tiempo total
 """
+import heapq
+import logging
+import threading
 import time
 import math
-from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+from app.config import settings
 from app.schemas.otp_schemas import (
     PlanSchema, ItinerarySchema, LegSchema, PlaceSchema, LegGeometry
 )
+from app.services.geometry import CITY_METRIC, measure_at
+from app.services.metrics import (
+    PLANNER_SEARCH_SEQUENTIAL, PLANNER_SEARCH_TIMEOUTS, PLANNER_STAGE_CANDIDATES, PLANNER_STAGE_SKIPPED,
+    observe_stage_timings
+)
+from app.services.network_snapshot import NetworkSnapshot, get_network_snapshot, serving_stale_snapshot
+from app.services.plan_cache import PlanCache, retime_plan
+from app.services.polyline import VertexRange, encode_pieces, encode_polyline, pieces_length
+from app.services.query_budget import current_counter
+from app.services.raptor import RaptorParams, RaptorSearch
+from app.services.timing import StageTimer, timed, timing_scope
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.PLANNER_LOG_LEVEL)
 
 # Constantes de velocidad (metros por minuto)
 WALK_SPEED = 70  # ~4.2 km/h (ligeramente más lento para penalizar caminatas largas)
@@ -22,37 +44,92 @@ BUS_SPEED = 333  # ~20 km/h (promedio considerando paradas y tráfico)
 # Tiempos fijos
 WAIT_TIME_MINUTES = 5  # Tiempo promedio de espera en parada
 TRANSFER_TIME_MINUTES = 3  # Tiempo adicional para transbordo
+TRANSFER_PENALTY_S = 240  # Mismo castigo por transbordo que el costo generalizado
 
-def encode_polyline(coordinates: List[Tuple[float, float]]) -> str:
-    """Codifica coordenadas en formato polyline de Google"""
-    if not coordinates:
-        return ""
-    
-    encoded = []
-    prev_lat = 0
-    prev_lon = 0
-    
-    for lat, lon in coordinates:
-        lat_e5 = int(round(lat * 1e5))
-        lon_e5 = int(round(lon * 1e5))
-        
-        d_lat = lat_e5 - prev_lat
-        d_lon = lon_e5 - prev_lon
-        
-        prev_lat = lat_e5
-        prev_lon = lon_e5
-        
-        for val in [d_lat, d_lon]:
-            val = ~(val << 1) if val < 0 else (val << 1)
-            while val >= 0x20:
-                encoded.append(chr((0x20 | (val & 0x1f)) + 63))
-                val >>= 5
-            encoded.append(chr(val + 63))
-    
-    return ''.join(encoded)
+# Caminata total máxima según cantidad de transbordos (más micros = más estricto).
+# Cada request puede bajarlas con maxWalkDistance (ver PlanLimits)
+MAX_WALK_BY_TRANSFERS = {0: 1200, 1: 1000, 2: 800, 3: 600}
+
+# Radios de búsqueda según la distancia directa: (hasta metros, geometría, paradas)
+SEARCH_RADIUS_TIERS = [(2000, 800, 1200), (5000, 1500, 2000), (float("inf"), 2500, 3000)]
+
+# Factor mínimo calle/línea recta de walking_distance_realistic: un punto a
+# más de max_walk / MIN_STREET_FACTOR en línea recta ya no se alcanza a pie
+MIN_STREET_FACTOR = 1.3
+
+# Modos OTP que habilitan la búsqueda en micro (el resto es solo caminata)
+TRANSIT_MODES = {"BUS", "TRANSIT"}
+
+# Colores por defecto para cada micro de un itinerario
+LEG_COLORS = ["0088FF", "FF5722", "4CAF50", "9C27B0"]
+
+
+class SearchPool:
+    """
+    Hilos compartidos para las búsquedas PostGIS en paralelo, sin cola: un
+    request reserva un hilo por búsqueda y, si no hay suficientes libres, las
+    corre en secuencia en su propia sesión. Así, con carga, los planes tardan
+    más en vez de volver truncados por esperar en la cola del pool.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planner-search")
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, count: int) -> bool:
+        """Reserva `count` hilos libres (cada submit libera uno al terminar)"""
+        with self._lock:
+            if self._busy + count > self.workers:
+                return False
+            self._busy += count
+            return True
+
+    def submit(self, fn, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future) -> None:
+        with self._lock:
+            self._busy -= 1
+
+
+def search_workers(engine, requested: int) -> int:
+    """
+    Hilos de búsqueda que admite el pool de SQLAlchemy: cada uno abre su propia
+    conexión además de la del request, así que se usa como mucho la mitad.
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return requested  # SQLite en tests y benchmarks
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    workers = max(min(requested, capacity // 2), 1)
+    if workers < requested:
+        logger.warning("search_workers_capped requested=%d workers=%d pool_capacity=%d",
+                       requested, workers, capacity)
+    return workers
+
+
+# Pool compartido para las búsquedas concurrentes (ver PLANNER_SEARCH_WORKERS)
+_search_pool: Optional[SearchPool] = None
+_search_pool_lock = threading.Lock()
+
+
+def get_search_pool() -> SearchPool:
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            from app.database import engine
+            _search_pool = SearchPool(search_workers(engine, settings.PLANNER_SEARCH_WORKERS))
+        return _search_pool
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calcula distancia en línea recta (como el vuelo de un pájaro)"""
+    """
+    Calcula distancia en línea recta (como el vuelo de un pájaro).
+    Referencia exacta: el planificador usa CITY_METRIC.distance (plano local, sin trigonometría).
+    """
     R = 6371000  # Radio de la Tierra en metros
     phi1 = math.radians(lat1)
     phi2 = math.radians(lat2)
@@ -81,7 +158,7 @@ def walking_distance_realistic(lat1: float, lon1: float, lat2: float, lon2: floa
     - Red vial completa en PostGIS con pgrouting
     - O servicio de routing (OSRM, GraphHopper)
     """
-    straight_distance = haversine_distance(lat1, lon1, lat2, lon2)
+    straight_distance = CITY_METRIC.distance(lat1, lon1, lat2, lon2)
     
     # Factor de corrección según distancia (calles en cuadrícula)
     if straight_distance < 200:
@@ -99,9 +176,338 @@ def walking_distance_realistic(lat1: float, lon1: float, lat2: float, lon2: floa
     return realistic_distance
 
 
+class RouteInfo(NamedTuple):
+    """Datos de la línea que se muestran en un leg de micro"""
+    name: str
+    route_id: str
+    short_name: str
+    long_name: str
+    color: str
+    text_color: str
+
+
+class GeometryRoute(NamedTuple):
+    """Fila de ROUTES_BY_GEOMETRY_QUERY (misma forma cuando sale del índice en memoria)"""
+    pattern_id: str
+    nombre_linea: str
+    short_name: str
+    long_name: str
+    color: str
+    text_color: str
+    dist_from_origin: float
+    dist_from_dest: float
+    route_length: float
+    sentido: str
+    total_walk_dist: float
+
+
+@dataclass
+class LegPlan:
+    """Leg de un candidato: solo números y referencias a la geometría (sin Pydantic)"""
+    mode: str  # WALK, BUS
+    duration: int  # segundos
+    distance: float  # metros
+    from_place: Tuple[float, float, str]  # (lat, lon, nombre)
+    to_place: Tuple[float, float, str]
+    wait: int = 0  # Segundos de espera antes de empezar el leg
+    route: Optional[RouteInfo] = None
+    pieces: list = field(default_factory=list)  # Geometría, ver polyline.encode_pieces
+
+
+class Candidate:
+    """Itinerario candidato liviano; se convierte a ItinerarySchema solo si queda entre los mejores"""
+    __slots__ = ("legs", "walk_time", "walk_distance", "transit_time", "bus_distance",
+                 "waiting_time", "transfers", "duration")
+
+    def __init__(self, legs: List[LegPlan]):
+        self.legs = legs
+        self.walk_time = sum(leg.duration for leg in legs if leg.mode == "WALK")
+        self.walk_distance = sum(leg.distance for leg in legs if leg.mode == "WALK")
+        self.transit_time = sum(leg.duration for leg in legs if leg.mode == "BUS")
+        self.bus_distance = sum(leg.distance for leg in legs if leg.mode == "BUS")
+        self.waiting_time = sum(leg.wait for leg in legs)
+        self.transfers = max(sum(1 for leg in legs if leg.mode == "BUS") - 1, 0)
+        self.duration = sum(leg.duration + leg.wait for leg in legs)
+
+
+def generalized_cost(candidate: Candidate, direct_distance: float) -> float:
+    """Costo generalizado para ordenar itinerarios - PRIORIDAD: MINIMIZAR CAMINATA"""
+    # CAMBIO CRÍTICO: Penalizar MUCHO MÁS la caminata
+    walk_penalty = 5.0  # Aumentado de 2.5 a 5.0
+    wait_penalty = 1.0
+    transfer_penalty = 240  # Reducido de 420 a 240 (4 min) - MEJOR hacer transbordo que caminar
+    transit_weight = 1.0
+    
+    # Penalización AGRESIVA por caminata excesiva
+    excess_walk_penalty = 0
+    if candidate.walk_distance > 300:  # Más estricto: desde 300m
+        excess_walk_penalty = (candidate.walk_distance - 300) * 2.0
+    if candidate.walk_distance > 800:  # Desde 800m penalizar MÁS
+        excess_walk_penalty += (candidate.walk_distance - 800) * 4.0
+    if candidate.walk_distance > 1500:  # Más de 1.5km es INACEPTABLE
+        excess_walk_penalty += (candidate.walk_distance - 1500) * 10.0
+    
+    # Bonificación para rutas directas SOLO si la caminata es razonable
+    direct_bonus = 0
+    if candidate.transfers == 0 and candidate.walk_distance < 500:
+        direct_bonus = -200  # Solo bonificar si camina poco
+    
+    # Penalizar rutas que dan muchas vueltas
+    route_efficiency = 1.5 if candidate.bus_distance > direct_distance * 2.0 else 1.0
+
+    cost = (candidate.transit_time * transit_weight * route_efficiency) + \
+           (candidate.walk_time * walk_penalty) + \
+           (candidate.waiting_time * wait_penalty) + \
+           (candidate.transfers * transfer_penalty) + \
+           excess_walk_penalty + direct_bonus
+           
+    return cost
+
+
+class CandidateRanking:
+    """
+    Top-k de candidatos por costo con heaps acotados (no se guarda el resto).
+    Equivale a ordenar todos los candidatos (orden estable) y cortar:
+    - best(): los mejores en general
+    - best_filtered(n): los n primeros en general + los mejores que cumplen `keep`
+    """
+
+    def __init__(self, k: int, cost: Callable[[Candidate], float], keep: Callable[[Candidate], bool]):
+        self.k = k
+        self.cost = cost
+        self.keep = keep
+        self._count = 0
+        self._best = []  # (-costo, -orden, candidato): el peor queda en la raíz
+        self._kept = []
+
+    def __len__(self) -> int:
+        return self._count
+
+    @staticmethod
+    def _push(heap, entry, size):
+        if len(heap) < size:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def push(self, candidate: Candidate) -> None:
+        entry = (-self.cost(candidate), -self._count, candidate)
+        self._count += 1
+        # Siempre se guardan al menos 5 para el filtro de caminata de plan_route
+        self._push(self._best, entry, max(self.k, 5))
+        if self.keep(candidate):
+            self._push(self._kept, entry, self.k)
+
+    def cutoff(self) -> float:
+        """Costo desde el cual un candidato nuevo ya no cambia best() ni best_filtered()"""
+        if len(self._best) < max(self.k, 5) or len(self._kept) < self.k:
+            return float("inf")
+        return max(-self._best[0][0], -self._kept[0][0])
+
+    def best(self) -> List[Candidate]:
+        return [entry[2] for entry in sorted(self._best, reverse=True)]
+
+    def best_filtered(self, keep_first: int) -> List[Candidate]:
+        first = sorted(self._best, reverse=True)[:keep_first]
+        merged = {entry[1]: entry for entry in first + self._kept}
+        return [entry[2] for entry in sorted(merged.values(), reverse=True)][:self.k]
+
+
+def transfer_cost_lower_bound(direct_distance: float, transfers: int) -> float:
+    """
+    Costo generalizado mínimo posible de un itinerario con `transfers` transbordos:
+    todo el recorrido en micro (lo más barato por metro), más las esperas y
+    castigos por transbordo que ese itinerario paga sí o sí.
+    """
+    buses = transfers + 1
+    ride_s = max(direct_distance / BUS_SPEED * 60 - buses, 0.0)  # -1 s por leg: _calculate_bus_time trunca
+    return ride_s + buses * WAIT_TIME_MINUTES * 60 + transfers * TRANSFER_PENALTY_S
+
+
+class StageController:
+    """
+    Agrega los candidatos de cada etapa al ranking (en el orden de los métodos)
+    y decide qué etapas siguientes vale la pena correr: con cotas inferiores de
+    costo se omiten las rondas de transbordos que no pueden entrar al top-k.
+    """
+
+    def __init__(self, ranking: CandidateRanking, direct_distance: float, limits: "PlanLimits"):
+        self.ranking = ranking
+        self.direct_distance = direct_distance
+        self.limits = limits
+        self.skipped: List[str] = []
+
+    def add(self, stage: str, candidates: List[Candidate]) -> None:
+        PLANNER_STAGE_CANDIDATES.observe(len(candidates), stage=stage)
+        for candidate in candidates:
+            self.ranking.push(candidate)
+
+    def skip(self, stage: str, reason: str) -> None:
+        self.skipped.append(stage)
+        PLANNER_STAGE_SKIPPED.inc(stage=stage)
+        logger.info("stage_skipped stage=%s reason=%r", stage, reason)
+
+    def wants_stops(self) -> bool:
+        """La búsqueda por paradas solo se corre si faltan itinerarios"""
+        if len(self.ranking) < self.limits.num_itineraries:
+            return True
+        self.skip("stops", f"ya hay {len(self.ranking)} itinerarios")
+        return False
+
+    def useful_transfers(self) -> int:
+        """Máximo de transbordos cuya cota inferior todavía puede entrar al top-k (0 = ninguno)"""
+        cutoff = self.ranking.cutoff()
+        useful = 0
+        for transfers in range(1, self.limits.max_transfers + 1):
+            if transfer_cost_lower_bound(self.direct_distance, transfers) < cutoff:
+                useful = transfers
+        if useful < self.limits.max_transfers:
+            bound = transfer_cost_lower_bound(self.direct_distance, useful + 1)
+            self.skip(f"transfers>{useful}", f"cota {bound:.0f} >= corte {cutoff:.0f}")
+        return useful
+
+
+class PlanDeadline:
+    """
+    Presupuesto de tiempo de un request (budget_ms). Las etapas consultan cuánto
+    queda y, si se acabó, cortan devolviendo lo encontrado hasta ese momento.
+    """
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self._end = time.monotonic() + budget_ms / 1000.0
+        self.truncated = False
+
+    def remaining_ms(self) -> float:
+        return max((self._end - time.monotonic()) * 1000.0, 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self._end
+
+    def cut(self, stage: str) -> bool:
+        """True (y marca el plan como truncado) si ya no queda tiempo para `stage`"""
+        if not self.expired():
+            return False
+        if not self.truncated:
+            logger.warning("budget_exhausted budget_ms=%.0f stage=%s", self.budget_ms, stage)
+        self.truncated = True
+        return True
+
+
+@dataclass
+class PlanLimits:
+    """Límites de búsqueda de un request (maxWalkDistance, mode, numItineraries...)"""
+    max_walk: float  # Caminata total máxima (metros siguiendo calles)
+    geometry_radius: float  # Radio en línea recta para trazados cerca del origen/destino
+    stop_radius: float
+    num_itineraries: int
+    max_transfers: int
+    transit: bool = True  # False si `mode` no incluye micros
+
+    @classmethod
+    def for_request(cls, direct_distance: float, max_walk_distance: float, num_itineraries: int,
+                    max_transfers: int, modes: Optional[Iterable[str]] = None) -> "PlanLimits":
+        _, geometry_radius, stop_radius = next(
+            tier for tier in SEARCH_RADIUS_TIERS if direct_distance < tier[0]
+        )
+        reach = max_walk_distance / MIN_STREET_FACTOR
+        return cls(
+            max_walk=max_walk_distance,
+            geometry_radius=min(geometry_radius, reach),
+            stop_radius=min(stop_radius, reach),
+            num_itineraries=num_itineraries,
+            max_transfers=max_transfers,
+            transit=modes is None or bool(TRANSIT_MODES & set(modes))
+        )
+
+    def max_walk_for(self, transfers: int) -> float:
+        """Caminata total permitida para un itinerario con `transfers` transbordos"""
+        return min(self.max_walk, MAX_WALK_BY_TRANSFERS.get(transfers, MAX_WALK_BY_TRANSFERS[3]))
+
+
+def parse_modes(mode: Optional[str]) -> Optional[frozenset]:
+    """'WALK,BUS' -> {'WALK', 'BUS'} (None si no se especificó)"""
+    if not mode:
+        return None
+    return frozenset(m.strip().upper() for m in mode.split(",") if m.strip())
+
+
+def plan_budget_ms(budget_ms: Optional[float] = None) -> float:
+    """Presupuesto pedido (o el default), nunca por encima del techo configurado"""
+    if budget_ms is None or budget_ms <= 0:
+        budget_ms = settings.PLANNER_BUDGET_MS
+    return min(budget_ms, settings.PLANNER_MAX_BUDGET_MS)
+
+
+# Búsquedas PostGIS de las etapas. Las distancias se miden en UTM 20S (EPSG:32720,
+# metros) sobre las columnas proyectadas geom_utm/geometry_utm: sin ::geography
+# ST_DWithin usa sus índices GiST (ver migrations/003_projected_geometries.sql)
+NEARBY_STOPS_QUERY = text("""
+    WITH origin AS (
+        SELECT ST_Transform(ST_SetSRID(ST_MakePoint(:lon, :lat), 4326), 32720) as pt
+    )
+    SELECT id_parada, nombre_parada, latitud, longitud,
+           ST_Distance(geom_utm, origin.pt) as distance
+    FROM transporte.paradas, origin
+    WHERE ST_DWithin(geom_utm, origin.pt, :radius)
+    AND activa = true
+    ORDER BY distance ASC
+    LIMIT :limit
+""")
+
+ROUTES_BY_GEOMETRY_QUERY = text("""
+    WITH points AS (
+        SELECT ST_Transform(ST_SetSRID(ST_MakePoint(:from_lon, :from_lat), 4326), 32720) as origin,
+               ST_Transform(ST_SetSRID(ST_MakePoint(:to_lon, :to_lat), 4326), 32720) as dest
+    ),
+    routes_near_origin AS (
+        SELECT DISTINCT p.id as pattern_id, 
+               p.id_linea,
+               p.sentido,
+               ST_Distance(p.geometry_utm, points.origin) as dist_from_origin,
+               ST_Length(p.geometry_utm) as route_length
+        FROM transporte.patterns p, points
+        WHERE ST_DWithin(p.geometry_utm, points.origin, :radius)
+    ),
+    routes_near_dest AS (
+        SELECT DISTINCT p.id as pattern_id,
+               ST_Distance(p.geometry_utm, points.dest) as dist_from_dest
+        FROM transporte.patterns p, points
+        WHERE ST_DWithin(p.geometry_utm, points.dest, :radius)
+    )
+    SELECT 
+        ro.pattern_id,
+        l.nombre as nombre_linea,
+        COALESCE(l.short_name, l.nombre) as short_name,
+        COALESCE(l.long_name, l.nombre) as long_name,
+        COALESCE(l.color, '0088FF') as color,
+        COALESCE(l.text_color, 'FFFFFF') as text_color,
+        ro.dist_from_origin,
+        rd.dist_from_dest,
+        ro.route_length,
+        ro.sentido,
+        (ro.dist_from_origin + rd.dist_from_dest) as total_walk_dist
+    FROM routes_near_origin ro
+    JOIN routes_near_dest rd ON ro.pattern_id = rd.pattern_id
+    JOIN transporte.patterns p ON ro.pattern_id = p.id
+    JOIN transporte.lineas l ON p.id_linea = l.id_linea
+    WHERE l.activa = true
+    AND ro.dist_from_origin + rd.dist_from_dest <= :max_total_walk
+    ORDER BY total_walk_dist ASC, ro.route_length ASC
+    LIMIT 200
+""")
+
+
 class RoutePlanner:
     """Planificador de rutas con soporte para transbordos"""
     
+    def __init__(self):
+        self.cache = PlanCache(
+            max_entries=settings.PLAN_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.PLAN_CACHE_TTL_SECONDS,
+            cell_m=settings.PLAN_CACHE_CELL_METERS
+        )
+    
     def plan_route(
         self,
         db: Session,
@@ -111,282 +517,434 @@ class RoutePlanner:
         to_lon: float,
         max_walk_distance: float = 1500.0,
         num_itineraries: int = 10,
-        max_transfers: int = 3  # NUEVO: Permitir hasta 3 transbordos (4 micros)
+        max_transfers: int = 3,  # NUEVO: Permitir hasta 3 transbordos (4 micros)
+        use_cache: bool = True,
+        budget_ms: Optional[float] = None,
+        modes: Optional[Iterable[str]] = None,
+        debug: bool = False
     ) -> PlanSchema:
+        """
+        Igual que _plan_route pero consultando primero el cache de planes
+        (origen/destino redondeados a una grilla + parámetros del request).
+        Los tiempos por etapa quedan en el StageTimer activo (ver timing_scope)
+        y, con `debug`, también en plan.debug.
+        """
+        modes = frozenset(modes) if modes is not None else None
+        with timing_scope() as timer:
+            if not (use_cache and settings.PLAN_CACHE_ENABLED):
+                plan, skipped = self._plan_route(db, from_lat, from_lon, to_lat, to_lon, max_walk_distance,
+                                                 num_itineraries, max_transfers, budget_ms, modes)
+                return self._finish(plan, timer, skipped, debug)
+            
+            key = self.cache.make_key(from_lat, from_lon, to_lat, to_lon,
+                                      num_itineraries, max_walk_distance, max_transfers, modes)
+            with timed("cache"):
+                cached = self.cache.get(key)
+            if cached is not None:
+                logger.info("plan_cache_hit itineraries=%d", len(cached.itineraries))
+                plan = retime_plan(cached, int(time.time() * 1000), from_lat, from_lon, to_lat, to_lon)
+                return self._finish(plan, timer, [], debug, cache="hit")
+            
+            # Mientras se reconstruye el snapshot el plan sale de la red anterior:
+            # se devuelve, pero no se guarda con la versión nueva
+            stale = serving_stale_snapshot()
+            plan, skipped = self._plan_route(db, from_lat, from_lon, to_lat, to_lon, max_walk_distance,
+                                             num_itineraries, max_transfers, budget_ms, modes)
+            # Solo se cachean planes completos con micros (no el fallback a pie)
+            if not stale and not plan.truncated and any(leg.transitLeg for it in plan.itineraries for leg in it.legs):
+                with timed("cache"):
+                    self.cache.put(key, plan)
+            return self._finish(plan, timer, skipped, debug, cache="miss")
+    
+    @staticmethod
+    def _finish(plan: PlanSchema, timer: StageTimer, skipped: List[str], debug: bool,
+                cache: Optional[str] = None) -> PlanSchema:
+        """Exporta los tiempos por etapa a /metrics y agrega el bloque `debug` si se pidió"""
+        totals = {name: stage["ms"] for name, stage in timer.as_dict().items()}
+        totals["total"] = timer.total_ms()
+        observe_stage_timings(totals)
+        if debug:
+            queries = current_counter()
+            plan.debug = {
+                "totalMs": round(timer.total_ms(), 2),
+                "stages": timer.as_dict(),
+                "skippedStages": skipped,
+                "cache": cache,
+                "sqlQueries": queries.count if queries is not None else None,
+            }
+        return plan
+    
+    def _plan_route(
+        self,
+        db: Session,
+        from_lat: float,
+        from_lon: float,
+        to_lat: float,
+        to_lon: float,
+        max_walk_distance: float = 1500.0,
+        num_itineraries: int = 10,
+        max_transfers: int = 3,
+        budget_ms: Optional[float] = None,
+        modes: Optional[Iterable[str]] = None
+    ) -> Tuple[PlanSchema, List[str]]:
         """
         Planifica ruta buscando la forma más rápida de llegar.
         1. Busca rutas directas (1 micro)
         2. Si no hay suficientes, busca rutas con 1 transbordo (2 micros)
         3. Ordena por tiempo total y devuelve las mejores
+        Si se agota `budget_ms` devuelve lo mejor encontrado y marca el plan como truncado.
+        `max_walk_distance` y `modes` acotan los radios y podan candidatos en cada etapa.
+        Devuelve el plan y las etapas omitidas.
         """
         current_time = int(time.time() * 1000)
-        itineraries = []
+        deadline = PlanDeadline(plan_budget_ms(budget_ms))
         
         # Calcular distancia directa para ajustar el radio de búsqueda
-        direct_distance = haversine_distance(from_lat, from_lon, to_lat, to_lon)
+        direct_distance = CITY_METRIC.distance(from_lat, from_lon, to_lat, to_lon)
+        # Candidatos livianos: solo se guardan los mejores (heap acotado)
+        ranking = CandidateRanking(
+            num_itineraries, lambda c: generalized_cost(c, direct_distance),
+            keep=lambda c: c.walk_distance < 2000
+        )
         
-        # Radio de búsqueda adaptativo para Santa Cruz
+        # Radio de búsqueda adaptativo para Santa Cruz, acotado por maxWalkDistance
         # En SCZ los micros paran en cualquier cuadra, optimizamos por geometría
-        if direct_distance < 2000:
-            geometry_radius = 800
-            stop_radius = 1200
-        elif direct_distance < 5000:
-            geometry_radius = 1500
-            stop_radius = 2000
+        limits = PlanLimits.for_request(
+            direct_distance, max_walk_distance, num_itineraries, max_transfers, modes
+        )
+        
+        # Los candidatos se agregan en el orden de los métodos para que el
+        # ranking (estable) sea el mismo en ambos modos
+        stages = StageController(ranking, direct_distance, limits)
+        network = get_network_snapshot(db)
+        if not limits.transit:
+            stages.skip("transit", "mode sin BUS/TRANSIT")
+        elif settings.PLANNER_SEARCH_WORKERS > 0 and self._search_concurrently(
+            network, from_lat, from_lon, to_lat, to_lon, limits, deadline, stages
+        ):
+            pass
         else:
-            geometry_radius = 2500
-            stop_radius = 3000
+            # Secuencial por configuración o porque el pool de búsquedas está ocupado
+            db.info["deadline"] = deadline
+            try:
+                self._search_sequentially(
+                    db, network, from_lat, from_lon, to_lat, to_lon, limits, deadline, stages
+                )
+            finally:
+                db.info.pop("deadline", None)
+                self._set_statement_timeout(db, None)
+        
+        # 3. Ordenar por "Costo Generalizado" (ver generalized_cost): solo los
+        # ganadores se convierten a ItinerarySchema
+        with timed("rank"):
+            best = ranking.best()
+            
+            # Filtrar solo rutas absurdamente malas (>2km caminata) si hay mejores opciones
+            if len(ranking) > 3:
+                best_walk = min(c.walk_distance for c in best[:5])
+                if best_walk < 1000:
+                    best = ranking.best_filtered(keep_first=3)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, c in enumerate(best[:3], 1):
+                logger.debug("top_candidate rank=%d walk_m=%.0f duration_min=%d transfers=%d",
+                             i, c.walk_distance, c.duration // 60, c.transfers)
+
+        with timed("materialize"):
+            itineraries = [
+                self._materialize_itinerary(c, current_time) for c in best[:num_itineraries]
+            ]
+        
+        # 4. Si aún no hay itinerarios, agregar ruta a pie como fallback
+        if not itineraries:
+            logger.info("walk_fallback reason=no_transit_routes")
+            walk_itinerary = self._build_walk_only_itinerary(
+                from_lat, from_lon, to_lat, to_lon, current_time
+            )
+            itineraries.append(walk_itinerary)
+        
+        logger.info("plan from=%.5f,%.5f to=%.5f,%.5f candidates=%d itineraries=%d truncated=%s skipped=%s",
+                    from_lat, from_lon, to_lat, to_lon, len(ranking), len(itineraries),
+                    deadline.truncated, ",".join(stages.skipped) or "-")
         
-        # ===== MÉTODO 1: Buscar rutas por GEOMETRÍA (PRIORITARIO) =====
+        plan = PlanSchema(
+            itineraries=itineraries,
+            date=current_time,
+            from_=PlaceSchema(name="Origin", lat=from_lat, lon=from_lon),
+            to=PlaceSchema(name="Destination", lat=to_lat, lon=to_lon),
+            truncated=deadline.truncated
+        )
+        return plan, stages.skipped
+
+    def _search_sequentially(self, db: Session, network, from_lat, from_lon, to_lat, to_lon,
+                             limits: PlanLimits, deadline: PlanDeadline, stages: StageController):
+        """Corre los métodos de búsqueda uno tras otro en la sesión del request"""
+        stages.add("geometry", self._geometry_candidates(db, from_lat, from_lon, to_lat, to_lon, limits, deadline))
+        if stages.wants_stops():
+            stages.add("stops", self._stop_candidates(db, from_lat, from_lon, to_lat, to_lon, limits, deadline))
+        stages.add("transfers", self._transfer_candidates(
+            network, from_lat, from_lon, to_lat, to_lon, limits, deadline, stages.useful_transfers()
+        ))
+
+    def _search_concurrently(self, network, from_lat, from_lon, to_lat, to_lon,
+                             limits: PlanLimits, deadline: PlanDeadline, stages: StageController) -> bool:
+        """
+        Corre las búsquedas PostGIS (geometría y paradas) en paralelo en el pool
+        de búsquedas, cada una con su propia sesión. Los transbordos se calculan
+        en memoria en este hilo apenas llega la geometría (mientras sigue la
+        búsqueda por paradas), así sus cotas ya podan rondas. Si la geometría
+        ya da suficientes itinerarios se cancela la búsqueda por paradas; si se
+        agota el presupuesto se dejan de esperar las búsquedas pendientes.
+        Devuelve False (sin buscar nada) si el pool no tiene dos hilos libres.
+        """
+        pool = get_search_pool()
+        if not pool.reserve(2):
+            PLANNER_SEARCH_SEQUENTIAL.inc()
+            return False
+        cancel = threading.Event()
+        # copy_context: los hilos del pool heredan el StageTimer del request
+        geometry_future = pool.submit(
+            copy_context().run, self._in_own_session, deadline, self._geometry_candidates,
+            from_lat, from_lon, to_lat, to_lon, limits, deadline, cancel
+        )
+        stops_future = pool.submit(
+            copy_context().run, self._in_own_session, deadline, self._stop_candidates,
+            from_lat, from_lon, to_lat, to_lon, limits, deadline, cancel
+        )
+        
+        stages.add("geometry", self._search_result(geometry_future, "geometry", "geometría", deadline, cancel))
+        wants_stops = stages.wants_stops()
+        if not wants_stops:
+            cancel.set()
+            stops_future.cancel()
+        transfers = self._transfer_candidates(
+            network, from_lat, from_lon, to_lat, to_lon, limits, deadline, stages.useful_transfers()
+        )
+        if wants_stops:
+            stages.add("stops", self._search_result(stops_future, "stops", "paradas", deadline, cancel))
+        stages.add("transfers", transfers)
+        return True
+
+    @staticmethod
+    def _in_own_session(deadline: PlanDeadline, search, *args):
+        """Ejecuta una búsqueda en un hilo del pool con una sesión propia"""
+        from app.database import SessionLocal
+        db = SessionLocal()
+        db.info["deadline"] = deadline
+        try:
+            return search(db, *args)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _search_result(future, stage: str, name: str, deadline: PlanDeadline,
+                       cancel: threading.Event) -> List[Candidate]:
+        try:
+            return future.result(timeout=deadline.remaining_ms() / 1000.0)
+        except FutureTimeout:
+            # La query sigue hasta su statement_timeout; su resultado se descarta
+            PLANNER_SEARCH_TIMEOUTS.inc(stage=stage, state="running" if future.running() else "queued")
+            cancel.set()
+            future.cancel()
+            deadline.cut(f"búsqueda por {name}")
+            return []
+        except Exception as e:
+            logger.error("search_failed stage=%s error=%r", stage, e)
+            return []
+
+    def _execute_stage(self, db: Session, name: str, query, params: dict):
+        """
+        Ejecuta (y cronometra como `name`) la query de una etapa de búsqueda.
+        Si la sesión tiene un presupuesto (db.info["deadline"]) se limita con
+        statement_timeout de Postgres a lo que queda de él.
+        """
+        deadline = db.info.get("deadline")
+        if deadline is not None:
+            self._set_statement_timeout(db, max(int(deadline.remaining_ms()), 1))
+        try:
+            with timed(name):
+                return db.execute(query, params).fetchall()
+        except Exception:
+            # Una query cancelada aborta la transacción: limpiarla para las etapas siguientes
+            db.rollback()
+            if deadline is not None:
+                deadline.cut("query SQL")
+            raise
+
+    @staticmethod
+    def _set_statement_timeout(db: Session, timeout_ms: Optional[int]) -> None:
+        """statement_timeout de la transacción actual (None = volver al default)"""
+        if db.get_bind().dialect.name != "postgresql":
+            return
+        value = "DEFAULT" if timeout_ms is None else str(int(timeout_ms))
+        db.execute(text(f"SET LOCAL statement_timeout = {value}"))
+
+    def _geometry_candidates(self, db: Session, from_lat, from_lon, to_lat, to_lon,
+                             limits: PlanLimits, deadline: PlanDeadline,
+                             cancel: Optional[threading.Event] = None) -> List[Candidate]:
+        """MÉTODO 1: rutas cuya geometría pasa cerca del origen y del destino (prioritario)"""
         # En Santa Cruz los micros paran en cualquier cuadra
-        print(f"[RoutePlanner] 🔍 Modo Santa Cruz: búsqueda por geometría (radius={geometry_radius}m)")
         geometry_routes = self._find_routes_by_geometry(
-            db, from_lat, from_lon, to_lat, to_lon, radius=geometry_radius
+            db, from_lat, from_lon, to_lat, to_lon, radius=limits.geometry_radius,
+            max_total_walk=limits.max_walk / MIN_STREET_FACTOR
         )
         
         # Procesar TODAS las rutas por geometría encontradas
-        geometry_success = 0
+        candidates = []
         geometry_failed = 0
         for route in geometry_routes[:100]:
+            if (cancel is not None and cancel.is_set()) or deadline.cut("geometría"):
+                break
             try:
-                itinerary = self._build_geometry_itinerary(
-                    db, route, from_lat, from_lon, to_lat, to_lon, current_time
-                )
-                if itinerary:
-                    itineraries.append(itinerary)
-                    geometry_success += 1
+                with timed("build.geometry"):
+                    candidate = self._build_geometry_candidate(
+                        db, route, from_lat, from_lon, to_lat, to_lon
+                    )
+                if candidate and candidate.walk_distance <= limits.max_walk:
+                    candidates.append(candidate)
                 else:
                     geometry_failed += 1
             except Exception as e:
                 geometry_failed += 1
-                print(f"[RoutePlanner] Error en geometría de línea {route.short_name}: {e}")
-        
-        print(f"[RoutePlanner] ✅ Rutas por geometría: {geometry_success} exitosas, {geometry_failed} fallidas")
-        
-        # ===== MÉTODO 2: Buscar por paradas (secundario) =====
-        if len(itineraries) < num_itineraries:
-            origin_stops = self._find_nearby_stops(db, from_lat, from_lon, radius=stop_radius, limit=50)
-            dest_stops = self._find_nearby_stops(db, to_lat, to_lon, radius=stop_radius, limit=50)
-            
-            print(f"[RoutePlanner] Origin stops: {len(origin_stops)}, Dest stops: {len(dest_stops)}")
-            
-            direct_routes = self._find_direct_routes(db, origin_stops, dest_stops)
-            print(f"[RoutePlanner] Direct routes found: {len(direct_routes)}")
-            
-            # Procesar más rutas directas (aumentado de 10 a 25)
-            for route in direct_routes[:25]:
-                itinerary = self._build_direct_itinerary(
-                    db, route, from_lat, from_lon, to_lat, to_lon, current_time
-                )
-                if itinerary:
-                    itineraries.append(itinerary)
+                logger.warning("geometry_candidate_failed line=%s error=%r", route.short_name, e)
         
-        # ===== MÉTODO 3: Rutas con 1 transbordo (2 micros) =====
-        print("[RoutePlanner] 🔄 Buscando transbordos (2 micros)...")
-        transfer_routes_geom = self._find_transfer_routes_by_geometry(
-            db, from_lat, from_lon, to_lat, to_lon, radius=geometry_radius
-        )
-        print(f"[RoutePlanner] 🔄 Transbordos por geometría: {len(transfer_routes_geom)}")
+        logger.info("stage=geometry radius_m=%.0f routes=%d candidates=%d rejected=%d",
+                    limits.geometry_radius, len(geometry_routes), len(candidates), geometry_failed)
+        return candidates
+
+    def _stop_candidates(self, db: Session, from_lat, from_lon, to_lat, to_lon,
+                         limits: PlanLimits, deadline: PlanDeadline,
+                         cancel: Optional[threading.Event] = None) -> List[Candidate]:
+        """MÉTODO 2: rutas directas por paradas (secundario)"""
+        def stopped():
+            return (cancel is not None and cancel.is_set()) or deadline.cut("paradas")
+        
+        if stopped():
+            return []
+        origin_stops = self._find_nearby_stops(db, from_lat, from_lon, radius=limits.stop_radius, limit=50)
+        if stopped():
+            return []
+        dest_stops = self._find_nearby_stops(db, to_lat, to_lon, radius=limits.stop_radius, limit=50)
         
-        for route in transfer_routes_geom[:50]:
-            itinerary = self._build_transfer_itinerary_by_geometry(
-                db, route, from_lat, from_lon, to_lat, to_lon, current_time
-            )
-            if itinerary and itinerary.walkDistance < 1000:
-                itineraries.append(itinerary)
+        if stopped():
+            return []
         
-        # ===== MÉTODO 4: Rutas con 2 transbordos (3 micros) =====
-        if max_transfers >= 2 and len(itineraries) < num_itineraries:
-            print("[RoutePlanner] 🔄🔄 Buscando rutas con 2 transbordos (3 micros)...")
-            triple_routes = self._find_triple_transfer_routes(
-                db, from_lat, from_lon, to_lat, to_lon, radius=geometry_radius
-            )
-            print(f"[RoutePlanner] 🔄🔄 Rutas con 2 transbordos: {len(triple_routes)}")
-            
-            for route in triple_routes[:30]:
-                itinerary = self._build_triple_transfer_itinerary(
-                    db, route, from_lat, from_lon, to_lat, to_lon, current_time
-                )
-                if itinerary and itinerary.walkDistance < 800:  # Más estricto para 3 micros
-                    itineraries.append(itinerary)
+        direct_routes = self._find_direct_routes(db, origin_stops, dest_stops)
         
-        # ===== MÉTODO 5: Rutas con 3 transbordos (4 micros) =====
-        if max_transfers >= 3 and len(itineraries) < num_itineraries:
-            print("[RoutePlanner] 🔄🔄🔄 Buscando rutas con 3 transbordos (4 micros)...")
-            quadruple_routes = self._find_quadruple_transfer_routes(
-                db, from_lat, from_lon, to_lat, to_lon, radius=geometry_radius
-            )
-            print(f"[RoutePlanner] 🔄🔄🔄 Rutas con 3 transbordos: {len(quadruple_routes)}")
-            
-            for route in quadruple_routes[:20]:
-                itinerary = self._build_quadruple_transfer_itinerary(
-                    db, route, from_lat, from_lon, to_lat, to_lon, current_time
+        # Procesar más rutas directas (aumentado de 10 a 25)
+        candidates = []
+        for route in direct_routes[:25]:
+            if stopped():
+                break
+            with timed("build.direct"):
+                candidate = self._build_direct_candidate(
+                    db, route, from_lat, from_lon, to_lat, to_lon, max_walk=limits.max_walk_for(0)
                 )
-                if itinerary and itinerary.walkDistance < 600:  # Muy estricto para 4 micros
-                    itineraries.append(itinerary)
-        
-        # 3. Ordenar por "Costo Generalizado" - PRIORIDAD: MINIMIZAR CAMINATA
-        def calculate_generalized_cost(itinerary):
-            # CAMBIO CRÍTICO: Penalizar MUCHO MÁS la caminata
-            walk_penalty = 5.0  # Aumentado de 2.5 a 5.0
-            wait_penalty = 1.0
-            transfer_penalty = 240  # Reducido de 420 a 240 (4 min) - MEJOR hacer transbordo que caminar
-            transit_weight = 1.0
-            
-            # Penalización AGRESIVA por caminata excesiva
-            excess_walk_penalty = 0
-            if itinerary.walkDistance > 300:  # Más estricto: desde 300m
-                excess_walk_penalty = (itinerary.walkDistance - 300) * 2.0
-            if itinerary.walkDistance > 800:  # Desde 800m penalizar MÁS
-                excess_walk_penalty += (itinerary.walkDistance - 800) * 4.0
-            if itinerary.walkDistance > 1500:  # Más de 1.5km es INACEPTABLE
-                excess_walk_penalty += (itinerary.walkDistance - 1500) * 10.0
-            
-            # Bonificación para rutas directas SOLO si la caminata es razonable
-            direct_bonus = 0
-            if itinerary.transfers == 0 and itinerary.walkDistance < 500:
-                direct_bonus = -200  # Solo bonificar si camina poco
-            
-            # Penalizar rutas que dan muchas vueltas
-            total_distance = sum(leg.distance for leg in itinerary.legs if leg.mode == "BUS")
-            route_efficiency = 1.5 if total_distance > direct_distance * 2.0 else 1.0
-
-            cost = (itinerary.transitTime * transit_weight * route_efficiency) + \
-                   (itinerary.walkTime * walk_penalty) + \
-                   (itinerary.waitingTime * wait_penalty) + \
-                   (itinerary.transfers * transfer_penalty) + \
-                   excess_walk_penalty + direct_bonus
-                   
-            return cost
-
-        itineraries.sort(key=calculate_generalized_cost)
-        
-        # Mostrar info de las mejores rutas para debugging
-        print(f"[RoutePlanner] 📊 Top 3 rutas antes de filtrar:")
-        for i, it in enumerate(itineraries[:3], 1):
-            transfers_text = f"{it.transfers} transbordo(s)" if it.transfers > 0 else "directo"
-            print(f"   {i}. Caminata: {it.walkDistance:.0f}m, Tiempo: {it.duration//60}min, {transfers_text}")
-        
-        # Filtrar solo rutas absurdamente malas (>2km caminata) si hay mejores opciones
-        if len(itineraries) > 3:
-            best_walk = min(it.walkDistance for it in itineraries[:5])
-            if best_walk < 1000:
-                itineraries = [it for it in itineraries if it.walkDistance < 2000 or itineraries.index(it) < 3]
+            if candidate:
+                candidates.append(candidate)
+        logger.info("stage=stops radius_m=%.0f origin_stops=%d dest_stops=%d routes=%d candidates=%d",
+                    limits.stop_radius, len(origin_stops), len(dest_stops), len(direct_routes), len(candidates))
+        return candidates
 
-        itineraries = itineraries[:num_itineraries]
-        
-        # 4. Si aún no hay itinerarios, agregar ruta a pie como fallback
-        if not itineraries:
-            print("[RoutePlanner] No transit routes, adding walk fallback")
-            walk_itinerary = self._build_walk_only_itinerary(
-                from_lat, from_lon, to_lat, to_lon, current_time
+    def _transfer_candidates(self, network, from_lat, from_lon, to_lat, to_lon,
+                             limits: PlanLimits, deadline: PlanDeadline,
+                             max_transfers: int) -> List[Candidate]:
+        """
+        MÉTODO 3: rutas con hasta `max_transfers` transbordos (2 a 4 micros).
+        Búsqueda por rondas (RAPTOR) sobre la red en memoria: una sola pasada
+        responde 1, 2 y 3 transbordos sin queries PostGIS. Si se agota el
+        presupuesto se devuelven las rondas ya completadas.
+        """
+        if max_transfers < 1 or network is None or deadline.cut("transbordos"):
+            return []
+        params = RaptorParams(
+            walk_speed=WALK_SPEED,
+            bus_speed=BUS_SPEED,
+            wait_s=WAIT_TIME_MINUTES * 60,
+            transfer_penalty_s=TRANSFER_PENALTY_S,
+            access_radius_m=limits.geometry_radius,
+            max_transfers=max_transfers,
+            max_transfer_walk_m=limits.max_walk_for(1)
+        )
+        with timed("transfers.search"):
+            journeys = RaptorSearch(network).search(
+                from_lat, from_lon, to_lat, to_lon, params, min_transfers=1,
+                should_stop=lambda: deadline.cut("transbordos")
             )
-            itineraries.append(walk_itinerary)
-        
-        print(f"[RoutePlanner] Final itineraries: {len(itineraries)}")
         
-        return PlanSchema(
-            itineraries=itineraries,
-            date=current_time,
-            from_=PlaceSchema(name="Origin", lat=from_lat, lon=from_lon),
-            to=PlaceSchema(name="Destination", lat=to_lat, lon=to_lon)
-        )
+        candidates = []
+        with timed("build.transfers"):
+            for journey in journeys:
+                if deadline.cut("transbordos"):
+                    break
+                candidate = self._build_journey_candidate(
+                    network, journey, from_lat, from_lon, to_lat, to_lon
+                )
+                if candidate and candidate.walk_distance < limits.max_walk_for(candidate.transfers):
+                    candidates.append(candidate)
+        logger.info("stage=transfers max_transfers=%d journeys=%d candidates=%d",
+                    max_transfers, len(journeys), len(candidates))
+        return candidates
 
     def _find_nearby_stops(self, db: Session, lat: float, lon: float, radius: int = 1000, limit: int = 20):
-        """Busca paradas cercanas usando PostGIS"""
-        query = text("""
-            SELECT id_parada, nombre_parada, latitud, longitud,
-                   ST_Distance(
-                       geom::geography, 
-                       ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography
-                   ) as distance
-            FROM transporte.paradas
-            WHERE ST_DWithin(
-                geom::geography,
-                ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography,
-                :radius
-            )
-            AND activa = true
-            ORDER BY distance ASC
-            LIMIT :limit
-        """)
-        result = db.execute(query, {"lat": lat, "lon": lon, "radius": radius, "limit": limit}).fetchall()
-        print(f"[RoutePlanner] Paradas encontradas a {radius}m: {len(result)}")
-        if result:
-            print(f"   Más cercana: {result[0].nombre_parada} a {result[0].distance:.0f}m")
-        return result
+        """Busca paradas cercanas usando PostGIS (columna UTM en metros, con índice GiST)"""
+        return self._execute_stage(db, "sql.stops", NEARBY_STOPS_QUERY,
+                                   {"lat": lat, "lon": lon, "radius": radius, "limit": limit})
 
     def _find_routes_by_geometry(self, db: Session, from_lat: float, from_lon: float, 
-                                  to_lat: float, to_lon: float, radius: int = 300):
+                                  to_lat: float, to_lon: float, radius: int = 300,
+                                  max_total_walk: float = None):
         """
         Encuentra rutas cuya GEOMETRÍA pase cerca del origen y destino.
         En Santa Cruz, los micros paran en cualquier esquina.
+        `max_total_walk` (línea recta) descarta trazados con caminata total mayor.
+        Con el snapshot cargado se resuelve con su índice espacial; PostGIS
+        queda como respaldo.
         """
-        query = text("""
-            WITH routes_near_origin AS (
-                SELECT DISTINCT p.id as pattern_id, 
-                       p.id_linea,
-                       p.sentido,
-                       ST_Distance(
-                           p.geometry::geography,
-                           ST_SetSRID(ST_MakePoint(:from_lon, :from_lat), 4326)::geography
-                       ) as dist_from_origin,
-                       ST_Length(p.geometry::geography) as route_length
-                FROM transporte.patterns p
-                WHERE p.geometry IS NOT NULL
-                AND ST_DWithin(
-                    p.geometry::geography,
-                    ST_SetSRID(ST_MakePoint(:from_lon, :from_lat), 4326)::geography,
-                    :radius
-                )
-            ),
-            routes_near_dest AS (
-                SELECT DISTINCT p.id as pattern_id,
-                       ST_Distance(
-                           p.geometry::geography,
-                           ST_SetSRID(ST_MakePoint(:to_lon, :to_lat), 4326)::geography
-                       ) as dist_from_dest
-                FROM transporte.patterns p
-                WHERE p.geometry IS NOT NULL
-                AND ST_DWithin(
-                    p.geometry::geography,
-                    ST_SetSRID(ST_MakePoint(:to_lon, :to_lat), 4326)::geography,
-                    :radius
+        if max_total_walk is None:
+            max_total_walk = 2 * radius
+        network = get_network_snapshot(db)
+        if network is not None:
+            with timed("index.geometry"):
+                return self._routes_by_geometry_in_memory(
+                    network, from_lat, from_lon, to_lat, to_lon, radius, max_total_walk
                 )
-            )
-            SELECT 
-                ro.pattern_id,
-                l.nombre as nombre_linea,
-                COALESCE(l.short_name, l.nombre) as short_name,
-                COALESCE(l.long_name, l.nombre) as long_name,
-                COALESCE(l.color, '0088FF') as color,
-                COALESCE(l.text_color, 'FFFFFF') as text_color,
-                ro.dist_from_origin,
-                rd.dist_from_dest,
-                ro.route_length,
-                ro.sentido,
-                (ro.dist_from_origin + rd.dist_from_dest) as total_walk_dist
-            FROM routes_near_origin ro
-            JOIN routes_near_dest rd ON ro.pattern_id = rd.pattern_id
-            JOIN transporte.patterns p ON ro.pattern_id = p.id
-            JOIN transporte.lineas l ON p.id_linea = l.id_linea
-            WHERE l.activa = true
-            ORDER BY total_walk_dist ASC, ro.route_length ASC
-            LIMIT 200
-        """)
-        
         try:
-            results = db.execute(query, {
+            results = self._execute_stage(db, "sql.geometry", ROUTES_BY_GEOMETRY_QUERY, {
                 "from_lat": from_lat, "from_lon": from_lon,
                 "to_lat": to_lat, "to_lon": to_lon,
-                "radius": radius
-            }).fetchall()
-            print(f"[RoutePlanner] Routes by geometry found: {len(results)}")
+                "radius": radius,
+                "max_total_walk": max_total_walk
+            })
             return results
         except Exception as e:
-            print(f"[RoutePlanner] Error in _find_routes_by_geometry: {e}")
+            logger.error("query_failed query=routes_by_geometry error=%r", e)
             return []
 
+    @staticmethod
+    def _routes_by_geometry_in_memory(network: NetworkSnapshot, from_lat, from_lon, to_lat, to_lon,
+                                      radius: float, max_total_walk: float) -> List[GeometryRoute]:
+        """Mismos filtros, orden y límite que ROUTES_BY_GEOMETRY_QUERY sobre la grilla de segmentos"""
+        near_origin = network.patterns_within(from_lat, from_lon, radius)
+        near_dest = network.patterns_within(to_lat, to_lon, radius)
+        dest_dist = dict(zip(near_dest.pattern.tolist(), near_dest.distance.tolist()))
+        rows = []
+        for idx, dist_from_origin in zip(near_origin.pattern.tolist(), near_origin.distance.tolist()):
+            dist_from_dest = dest_dist.get(idx)
+            if dist_from_dest is None or dist_from_origin + dist_from_dest > max_total_walk:
+                continue
+            line = network.line_for_pattern(network.pattern_ids[idx])
+            if line is None or not line.activa:
+                continue
+            rows.append(GeometryRoute(
+                network.pattern_ids[idx], line.nombre, line.short_name, line.long_name,
+                line.color, line.text_color, dist_from_origin, dist_from_dest,
+                float(network.pattern_length[idx]), network.pattern_sentidos[idx],
+                dist_from_origin + dist_from_dest
+            ))
+        rows.sort(key=lambda r: (r.total_walk_dist, r.route_length))
+        return rows[:200]
+
 
     def _find_direct_routes(self, db: Session, origin_stops, dest_stops):
         """Encuentra patrones que pasen por origen y destino (sin transbordo)"""
@@ -408,7 +966,9 @@ class RoutePlanner:
                 ps1.id_parada as origin_stop_id,
                 ps2.id_parada as dest_stop_id,
                 ps1.sequence as seq_start,
-                ps2.sequence as seq_end
+                ps2.sequence as seq_end,
+                ps1.measure_m as measure_start,
+                ps2.measure_m as measure_end
             FROM transporte.patterns p
             JOIN transporte.lineas l ON p.id_linea = l.id_linea
             JOIN transporte.pattern_stops ps1 ON p.id = ps1.pattern_id
@@ -421,10 +981,10 @@ class RoutePlanner:
         """)
         
         try:
-            results = db.execute(query, {
+            results = self._execute_stage(db, "sql.direct_routes", query, {
                 "origin_ids": origin_ids,
                 "dest_ids": dest_ids
-            }).fetchall()
+            })
             
             # Eliminar duplicados basados en pattern_id
             seen = set()
@@ -436,512 +996,88 @@ class RoutePlanner:
             
             return unique_results[:25]  # Aumentado para más opciones
         except Exception as e:
-            print(f"[RoutePlanner] Error in _find_direct_routes: {e}")
+            logger.error("query_failed query=direct_routes error=%r", e)
             return []
 
-    def _find_transfer_routes_by_geometry(self, db: Session, from_lat: float, from_lon: float,
-                                          to_lat: float, to_lon: float, radius: int = 1500):
-        """
-        SOLUCIÓN DEFINITIVA: Busca transbordos usando GEOMETRÍA de rutas.
-        Encuentra líneas que pasen cerca del origen Y líneas que pasen cerca del destino,
-        luego busca puntos de intersección cercanos entre ambas geometrías.
-        """
-        query = text("""
-            WITH routes_near_origin AS (
-                SELECT DISTINCT 
-                    p.id as pattern1_id,
-                    p.id_linea as linea1_id,
-                    l1.nombre as linea1,
-                    l1.short_name as short_name1,
-                    l1.long_name as long_name1,
-                    l1.color as color1,
-                    l1.text_color as text_color1,
-                    ST_Distance(
-                        p.geometry::geography,
-                        ST_SetSRID(ST_MakePoint(:from_lon, :from_lat), 4326)::geography
-                    ) as dist_from_origin
-                FROM transporte.patterns p
-                JOIN transporte.lineas l1 ON p.id_linea = l1.id_linea
-                WHERE p.geometry IS NOT NULL
-                AND l1.activa = true
-                AND ST_DWithin(
-                    p.geometry::geography,
-                    ST_SetSRID(ST_MakePoint(:from_lon, :from_lat), 4326)::geography,
-                    :radius
-                )
-            ),
-            routes_near_dest AS (
-                SELECT DISTINCT 
-                    p.id as pattern2_id,
-                    p.id_linea as linea2_id,
-                    l2.nombre as linea2,
-                    l2.short_name as short_name2,
-                    l2.long_name as long_name2,
-                    l2.color as color2,
-                    l2.text_color as text_color2,
-                    ST_Distance(
-                        p.geometry::geography,
-                        ST_SetSRID(ST_MakePoint(:to_lon, :to_lat), 4326)::geography
-                    ) as dist_from_dest
-                FROM transporte.patterns p
-                JOIN transporte.lineas l2 ON p.id_linea = l2.id_linea
-                WHERE p.geometry IS NOT NULL
-                AND l2.activa = true
-                AND ST_DWithin(
-                    p.geometry::geography,
-                    ST_SetSRID(ST_MakePoint(:to_lon, :to_lat), 4326)::geography,
-                    :radius
-                )
-            ),
-            intersecting_routes AS (
-                -- Encontrar rutas que se cruzan (puntos cercanos entre geometrías)
-                SELECT DISTINCT
-                    ro.pattern1_id,
-                    ro.linea1,
-                    ro.short_name1,
-                    ro.long_name1,
-                    ro.color1,
-                    ro.text_color1,
-                    ro.dist_from_origin,
-                    rd.pattern2_id,
-                    rd.linea2,
-                    rd.short_name2,
-                    rd.long_name2,
-                    rd.color2,
-                    rd.text_color2,
-                    rd.dist_from_dest,
-                    ST_Distance(
-                        p1.geometry::geography,
-                        p2.geometry::geography
-                    ) as routes_distance,
-                    ST_ClosestPoint(p1.geometry, p2.geometry) as transfer_point
-                FROM routes_near_origin ro
-                JOIN routes_near_dest rd ON ro.linea1_id != rd.linea2_id
-                JOIN transporte.patterns p1 ON ro.pattern1_id = p1.id
-                JOIN transporte.patterns p2 ON rd.pattern2_id = p2.id
-                WHERE ST_DWithin(
-                    p1.geometry::geography,
-                    p2.geometry::geography,
-                    500  -- Rutas deben estar a menos de 500m entre sí
-                )
-            )
-            SELECT 
-                ir.*,
-                ST_Y(ir.transfer_point) as transfer_lat,
-                ST_X(ir.transfer_point) as transfer_lon,
-                (ir.dist_from_origin + ir.dist_from_dest + ir.routes_distance) as total_walk_estimate
-            FROM intersecting_routes ir
-            ORDER BY total_walk_estimate ASC
-            LIMIT 100
-        """)
-        
-        try:
-            results = db.execute(query, {
-                "from_lat": from_lat, "from_lon": from_lon,
-                "to_lat": to_lat, "to_lon": to_lon,
-                "radius": radius
-            }).fetchall()
-            return results
-        except Exception as e:
-            print(f"[RoutePlanner] Error en _find_transfer_routes_by_geometry: {e}")
-            return []
-
-    def _build_transfer_itinerary_by_geometry(self, db: Session, route, from_lat, from_lon, to_lat, to_lon, start_time):
-        """
-        Construye itinerario con transbordo usando GEOMETRÍA (punto de intersección).
-        SOLUCIÓN DEFINITIVA: No depende de paradas oficiales.
-        """
-        try:
-            transfer_lat = float(route.transfer_lat)
-            transfer_lon = float(route.transfer_lon)
-            
-            # Obtener geometrías de ambas líneas
-            bus1_coords = self._get_pattern_geometry(db, route.pattern1_id)
-            bus2_coords = self._get_pattern_geometry(db, route.pattern2_id)
-            
-            if not bus1_coords or not bus2_coords or len(bus1_coords) < 2 or len(bus2_coords) < 2:
-                return None
-            
-            # Encontrar puntos más cercanos en cada línea
-            origin_point, origin_idx = self._find_closest_point_on_line(bus1_coords, from_lat, from_lon)
-            transfer_point1, transfer_idx1 = self._find_closest_point_on_line(bus1_coords, transfer_lat, transfer_lon)
-            transfer_point2, transfer_idx2 = self._find_closest_point_on_line(bus2_coords, transfer_lat, transfer_lon)
-            dest_point, dest_idx = self._find_closest_point_on_line(bus2_coords, to_lat, to_lon)
-            
-            # Validar que el orden es correcto
-            if origin_idx >= transfer_idx1 or transfer_idx2 >= dest_idx:
-                return None
-            
-            # Validar caminata total (siguiendo calles)
-            walk_to_first = walking_distance_realistic(from_lat, from_lon, origin_point[0], origin_point[1])
-            walk_transfer = walking_distance_realistic(transfer_point1[0], transfer_point1[1], transfer_point2[0], transfer_point2[1])
-            walk_from_last = walking_distance_realistic(dest_point[0], dest_point[1], to_lat, to_lon)
-            total_walk = walk_to_first + walk_transfer + walk_from_last
-            
-            if total_walk > 1000:  # Máximo 1km caminata total
-                return None
-            
-            legs = []
-            current_time = start_time
-            total_walk_time = 0
-            total_walk_dist = 0
-            total_transit_time = 0
-            total_wait_time = 0
-            
-            # Leg 1: Caminar a primera línea
-            walk_time1 = self._calculate_walk_time(walk_to_first)
-            legs.append(LegSchema(
-                mode="WALK",
-                startTime=current_time,
-                endTime=current_time + (walk_time1 * 1000),
-                duration=float(walk_time1),
-                distance=walk_to_first,
-                from_=PlaceSchema(lat=from_lat, lon=from_lon, name="Origin"),
-                to=PlaceSchema(lat=origin_point[0], lon=origin_point[1], name="Bus boarding"),
-                legGeometry=LegGeometry(points=encode_polyline([(from_lat, from_lon), origin_point]), length=2)
-            ))
-            current_time += walk_time1 * 1000
-            total_walk_time += walk_time1
-            total_walk_dist += walk_to_first
-            
-            # Espera bus 1
-            wait_time1 = WAIT_TIME_MINUTES * 60
-            current_time += wait_time1 * 1000
-            total_wait_time += wait_time1
-            
-            # Leg 2: Primer bus hasta transbordo
-            route_segment1 = bus1_coords[origin_idx:transfer_idx1+1]
-            bus1_dist = sum(haversine_distance(route_segment1[i][0], route_segment1[i][1],
-                                               route_segment1[i+1][0], route_segment1[i+1][1])
-                           for i in range(len(route_segment1)-1))
-            bus1_time = self._calculate_bus_time(bus1_dist)
-            
-            legs.append(LegSchema(
-                mode="BUS",
-                startTime=current_time,
-                endTime=current_time + (bus1_time * 1000),
-                duration=float(bus1_time),
-                distance=bus1_dist,
-                from_=PlaceSchema(lat=origin_point[0], lon=origin_point[1], name="Bus boarding"),
-                to=PlaceSchema(lat=transfer_point1[0], lon=transfer_point1[1], name="Transfer point"),
-                route=route.linea1,
-                routeId=route.pattern1_id,
-                routeShortName=route.short_name1 or route.linea1,
-                routeLongName=route.long_name1 or f"Línea {route.linea1}",
-                routeColor=route.color1 or "0088FF",
-                routeTextColor=route.text_color1 or "FFFFFF",
-                legGeometry=LegGeometry(points=encode_polyline(route_segment1), length=len(route_segment1)),
-                transitLeg=True
-            ))
-            current_time += bus1_time * 1000
-            total_transit_time += bus1_time
-            
-            # Leg 3: Caminar entre transbordos
-            walk_time_transfer = self._calculate_walk_time(walk_transfer)
-            legs.append(LegSchema(
-                mode="WALK",
-                startTime=current_time,
-                endTime=current_time + (walk_time_transfer * 1000),
-                duration=float(walk_time_transfer),
-                distance=walk_transfer,
-                from_=PlaceSchema(lat=transfer_point1[0], lon=transfer_point1[1], name="Transfer point"),
-                to=PlaceSchema(lat=transfer_point2[0], lon=transfer_point2[1], name="Transfer point"),
-                legGeometry=LegGeometry(points=encode_polyline([transfer_point1, transfer_point2]), length=2)
-            ))
-            current_time += walk_time_transfer * 1000
-            total_walk_time += walk_time_transfer
-            total_walk_dist += walk_transfer
-            
-            # Espera bus 2
-            wait_time2 = WAIT_TIME_MINUTES * 60
-            current_time += wait_time2 * 1000
-            total_wait_time += wait_time2
-            
-            # Leg 4: Segundo bus hasta destino
-            route_segment2 = bus2_coords[transfer_idx2:dest_idx+1]
-            bus2_dist = sum(haversine_distance(route_segment2[i][0], route_segment2[i][1],
-                                               route_segment2[i+1][0], route_segment2[i+1][1])
-                           for i in range(len(route_segment2)-1))
-            bus2_time = self._calculate_bus_time(bus2_dist)
-            
-            legs.append(LegSchema(
-                mode="BUS",
-                startTime=current_time,
-                endTime=current_time + (bus2_time * 1000),
-                duration=float(bus2_time),
-                distance=bus2_dist,
-                from_=PlaceSchema(lat=transfer_point2[0], lon=transfer_point2[1], name="Transfer point"),
-                to=PlaceSchema(lat=dest_point[0], lon=dest_point[1], name="Bus alighting"),
-                route=route.linea2,
-                routeId=route.pattern2_id,
-                routeShortName=route.short_name2 or route.linea2,
-                routeLongName=route.long_name2 or f"Línea {route.linea2}",
-                routeColor=route.color2 or "FF5722",
-                routeTextColor=route.text_color2 or "FFFFFF",
-                legGeometry=LegGeometry(points=encode_polyline(route_segment2), length=len(route_segment2)),
-                transitLeg=True
-            ))
-            current_time += bus2_time * 1000
-            total_transit_time += bus2_time
-            
-            # Leg 5: Caminar al destino final
-            walk_time2 = self._calculate_walk_time(walk_from_last)
-            legs.append(LegSchema(
-                mode="WALK",
-                startTime=current_time,
-                endTime=current_time + (walk_time2 * 1000),
-                duration=float(walk_time2),
-                distance=walk_from_last,
-                from_=PlaceSchema(lat=dest_point[0], lon=dest_point[1], name="Bus alighting"),
-                to=PlaceSchema(lat=to_lat, lon=to_lon, name="Destination"),
-                legGeometry=LegGeometry(points=encode_polyline([dest_point, (to_lat, to_lon)]), length=2)
-            ))
-            current_time += walk_time2 * 1000
-            total_walk_time += walk_time2
-            total_walk_dist += walk_from_last
-            
-            total_duration = (current_time - start_time) // 1000
-            
-            return ItinerarySchema(
-                legs=legs,
-                startTime=start_time,
-                endTime=current_time,
-                duration=total_duration,
-                walkTime=total_walk_time,
-                walkDistance=total_walk_dist,
-                transfers=1,
-                transitTime=total_transit_time,
-                waitingTime=total_wait_time
-            )
-        except Exception as e:
-            print(f"[RoutePlanner] Error en _build_transfer_itinerary_by_geometry: {e}")
-            return None
-
-    def _find_triple_transfer_routes(self, db: Session, from_lat: float, from_lon: float,
-                                    to_lat: float, to_lon: float, radius: int = 1500):
+    def _build_journey_candidate(self, network, journey, from_lat, from_lon, to_lat, to_lon):
         """
-        Encuentra rutas con 2 transbordos (3 micros).
-        Busca: Origen -> Línea1 -> Transbordo1 -> Línea2 -> Transbordo2 -> Línea3 -> Destino
+        Construye el candidato con N micros a partir de un resultado de RaptorSearch.
+        Toda la geometría sale del snapshot en memoria (sin queries).
         """
-        query = text("""
-            WITH routes_near_origin AS (
-                SELECT DISTINCT p.id as pattern1_id, p.id_linea as linea1_id,
-                       l1.short_name as short_name1, l1.nombre as linea1,
-                       l1.color as color1, l1.text_color as text_color1
-                FROM transporte.patterns p
-                JOIN transporte.lineas l1 ON p.id_linea = l1.id_linea
-                WHERE p.geometry IS NOT NULL AND l1.activa = true
-                AND ST_DWithin(p.geometry::geography,
-                    ST_SetSRID(ST_MakePoint(:from_lon, :from_lat), 4326)::geography, :radius)
-            ),
-            routes_near_dest AS (
-                SELECT DISTINCT p.id as pattern3_id, p.id_linea as linea3_id,
-                       l3.short_name as short_name3, l3.nombre as linea3,
-                       l3.color as color3, l3.text_color as text_color3
-                FROM transporte.patterns p
-                JOIN transporte.lineas l3 ON p.id_linea = l3.id_linea
-                WHERE p.geometry IS NOT NULL AND l3.activa = true
-                AND ST_DWithin(p.geometry::geography,
-                    ST_SetSRID(ST_MakePoint(:to_lon, :to_lat), 4326)::geography, :radius)
-            ),
-            middle_routes AS (
-                SELECT DISTINCT p.id as pattern2_id, p.id_linea as linea2_id,
-                       l2.short_name as short_name2, l2.nombre as linea2,
-                       l2.color as color2, l2.text_color as text_color2
-                FROM transporte.patterns p
-                JOIN transporte.lineas l2 ON p.id_linea = l2.id_linea
-                WHERE p.geometry IS NOT NULL AND l2.activa = true
-            ),
-            triple_combinations AS (
-                SELECT 
-                    ro.pattern1_id, ro.linea1, ro.short_name1, ro.color1, ro.text_color1,
-                    mr.pattern2_id, mr.linea2, mr.short_name2, mr.color2, mr.text_color2,
-                    rd.pattern3_id, rd.linea3, rd.short_name3, rd.color3, rd.text_color3,
-                    ST_ClosestPoint(p1.geometry, p2.geometry) as transfer1_point,
-                    ST_ClosestPoint(p2.geometry, p3.geometry) as transfer2_point
-                FROM routes_near_origin ro
-                JOIN middle_routes mr ON ro.linea1_id != mr.linea2_id
-                JOIN routes_near_dest rd ON mr.linea2_id != rd.linea3_id AND ro.linea1_id != rd.linea3_id
-                JOIN transporte.patterns p1 ON ro.pattern1_id = p1.id
-                JOIN transporte.patterns p2 ON mr.pattern2_id = p2.id
-                JOIN transporte.patterns p3 ON rd.pattern3_id = p3.id
-                WHERE ST_DWithin(p1.geometry::geography, p2.geometry::geography, 500)
-                AND ST_DWithin(p2.geometry::geography, p3.geometry::geography, 500)
-            )
-            SELECT 
-                tc.*,
-                ST_Y(tc.transfer1_point) as transfer1_lat,
-                ST_X(tc.transfer1_point) as transfer1_lon,
-                ST_Y(tc.transfer2_point) as transfer2_lat,
-                ST_X(tc.transfer2_point) as transfer2_lon
-            FROM triple_combinations tc
-            LIMIT 50
-        """)
-        
         try:
-            return db.execute(query, {
-                "from_lat": from_lat, "from_lon": from_lon,
-                "to_lat": to_lat, "to_lon": to_lon,
-                "radius": radius
-            }).fetchall()
-        except Exception as e:
-            print(f"[RoutePlanner] Error en _find_triple_transfer_routes: {e}")
-            return []
-
-    def _build_triple_transfer_itinerary(self, db: Session, route, from_lat, from_lon, to_lat, to_lon, start_time):
-        """Construye itinerario con 2 transbordos (3 micros)"""
-        try:
-            # Obtener geometrías
-            bus1_coords = self._get_pattern_geometry(db, route.pattern1_id)
-            bus2_coords = self._get_pattern_geometry(db, route.pattern2_id)
-            bus3_coords = self._get_pattern_geometry(db, route.pattern3_id)
-            
-            if not all([bus1_coords, bus2_coords, bus3_coords]):
-                return None
-            
-            # Encontrar puntos en cada línea
-            origin_point, o1 = self._find_closest_point_on_line(bus1_coords, from_lat, from_lon)
-            t1_1, t1_1_idx = self._find_closest_point_on_line(bus1_coords, float(route.transfer1_lat), float(route.transfer1_lon))
-            t1_2, t1_2_idx = self._find_closest_point_on_line(bus2_coords, float(route.transfer1_lat), float(route.transfer1_lon))
-            t2_1, t2_1_idx = self._find_closest_point_on_line(bus2_coords, float(route.transfer2_lat), float(route.transfer2_lon))
-            t2_2, t2_2_idx = self._find_closest_point_on_line(bus3_coords, float(route.transfer2_lat), float(route.transfer2_lon))
-            dest_point, d3 = self._find_closest_point_on_line(bus3_coords, to_lat, to_lon)
-            
-            # Validar orden
-            if o1 >= t1_1_idx or t1_2_idx >= t2_1_idx or t2_2_idx >= d3:
-                return None
-            
-            # Calcular caminata total (siguiendo calles)
-            walk_total = (
-                walking_distance_realistic(from_lat, from_lon, origin_point[0], origin_point[1]) +
-                walking_distance_realistic(t1_1[0], t1_1[1], t1_2[0], t1_2[1]) +
-                walking_distance_realistic(t2_1[0], t2_1[1], t2_2[0], t2_2[1]) +
-                walking_distance_realistic(dest_point[0], dest_point[1], to_lat, to_lon)
-            )
-            
-            if walk_total > 800:  # Máximo 800m para 3 micros
-                return None
-            
             legs = []
-            current_time = start_time
-            total_walk = 0
-            total_transit = 0
-            total_wait = 0
-            
-            # Leg 1: Caminar a primera línea (siguiendo calles)
-            w1 = walking_distance_realistic(from_lat, from_lon, origin_point[0], origin_point[1])
-            wt1 = self._calculate_walk_time(w1)
-            legs.append(LegSchema(mode="WALK", startTime=current_time,
-                endTime=current_time + wt1*1000, duration=float(wt1), distance=w1,
-                from_=PlaceSchema(lat=from_lat, lon=from_lon, name="Origin"),
-                to=PlaceSchema(lat=origin_point[0], lon=origin_point[1], name="Bus boarding"),
-                legGeometry=LegGeometry(points=encode_polyline([(from_lat, from_lon), origin_point]), length=2)))
-            current_time += wt1*1000
-            total_walk += w1
-            
-            # Espera bus 1
-            wait1 = WAIT_TIME_MINUTES * 60
-            current_time += wait1*1000
-            total_wait += wait1
+            num_buses = len(journey.legs)
             
-            # Leg 2: Bus 1 hasta transbordo 1
-            seg1 = bus1_coords[o1:t1_1_idx+1]
-            d1 = sum(haversine_distance(seg1[i][0], seg1[i][1], seg1[i+1][0], seg1[i+1][1]) for i in range(len(seg1)-1))
-            t1 = self._calculate_bus_time(d1)
-            legs.append(LegSchema(mode="BUS", startTime=current_time, endTime=current_time + t1*1000,
-                duration=float(t1), distance=d1, from_=PlaceSchema(lat=origin_point[0], lon=origin_point[1], name="Bus boarding"),
-                to=PlaceSchema(lat=t1_1[0], lon=t1_1[1], name="Transfer 1"),
-                route=route.linea1, routeId=route.pattern1_id, routeShortName=route.short_name1,
-                routeColor=route.color1 or "0088FF", routeTextColor=route.text_color1 or "FFFFFF",
-                legGeometry=LegGeometry(points=encode_polyline(seg1), length=len(seg1)), transitLeg=True))
-            current_time += t1*1000
-            total_transit += t1
-            
-            # Leg 3: Caminar entre transbordo 1 (siguiendo calles)
-            w2 = walking_distance_realistic(t1_1[0], t1_1[1], t1_2[0], t1_2[1])
-            wt2 = self._calculate_walk_time(w2)
-            legs.append(LegSchema(mode="WALK", startTime=current_time, endTime=current_time + wt2*1000,
-                duration=float(wt2), distance=w2, from_=PlaceSchema(lat=t1_1[0], lon=t1_1[1], name="Transfer 1"),
-                to=PlaceSchema(lat=t1_2[0], lon=t1_2[1], name="Transfer 1"),
-                legGeometry=LegGeometry(points=encode_polyline([t1_1, t1_2]), length=2)))
-            current_time += wt2*1000
-            total_walk += w2
-            
-            # Espera bus 2
-            wait2 = WAIT_TIME_MINUTES * 60
-            current_time += wait2*1000
-            total_wait += wait2
-            
-            # Leg 4: Bus 2 hasta transbordo 2
-            seg2 = bus2_coords[t1_2_idx:t2_1_idx+1]
-            d2 = sum(haversine_distance(seg2[i][0], seg2[i][1], seg2[i+1][0], seg2[i+1][1]) for i in range(len(seg2)-1))
-            t2 = self._calculate_bus_time(d2)
-            legs.append(LegSchema(mode="BUS", startTime=current_time, endTime=current_time + t2*1000,
-                duration=float(t2), distance=d2, from_=PlaceSchema(lat=t1_2[0], lon=t1_2[1], name="Transfer 1"),
-                to=PlaceSchema(lat=t2_1[0], lon=t2_1[1], name="Transfer 2"),
-                route=route.linea2, routeId=route.pattern2_id, routeShortName=route.short_name2,
-                routeColor=route.color2 or "FF5722", routeTextColor=route.text_color2 or "FFFFFF",
-                legGeometry=LegGeometry(points=encode_polyline(seg2), length=len(seg2)), transitLeg=True))
-            current_time += t2*1000
-            total_transit += t2
-            
-            # Leg 5: Caminar entre transbordo 2 (siguiendo calles)
-            w3 = walking_distance_realistic(t2_1[0], t2_1[1], t2_2[0], t2_2[1])
-            wt3 = self._calculate_walk_time(w3)
-            legs.append(LegSchema(mode="WALK", startTime=current_time, endTime=current_time + wt3*1000,
-                duration=float(wt3), distance=w3, from_=PlaceSchema(lat=t2_1[0], lon=t2_1[1], name="Transfer 2"),
-                to=PlaceSchema(lat=t2_2[0], lon=t2_2[1], name="Transfer 2"),
-                legGeometry=LegGeometry(points=encode_polyline([t2_1, t2_2]), length=2)))
-            current_time += wt3*1000
-            total_walk += w3
-            
-            # Espera bus 3
-            wait3 = WAIT_TIME_MINUTES * 60
-            current_time += wait3*1000
-            total_wait += wait3
-            
-            # Leg 6: Bus 3 hasta destino
-            seg3 = bus3_coords[t2_2_idx:d3+1]
-            d3_dist = sum(haversine_distance(seg3[i][0], seg3[i][1], seg3[i+1][0], seg3[i+1][1]) for i in range(len(seg3)-1))
-            t3 = self._calculate_bus_time(d3_dist)
-            legs.append(LegSchema(mode="BUS", startTime=current_time, endTime=current_time + t3*1000,
-                duration=float(t3), distance=d3_dist, from_=PlaceSchema(lat=t2_2[0], lon=t2_2[1], name="Transfer 2"),
-                to=PlaceSchema(lat=dest_point[0], lon=dest_point[1], name="Bus alighting"),
-                route=route.linea3, routeId=route.pattern3_id, routeShortName=route.short_name3,
-                routeColor=route.color3 or "4CAF50", routeTextColor=route.text_color3 or "FFFFFF",
-                legGeometry=LegGeometry(points=encode_polyline(seg3), length=len(seg3)), transitLeg=True))
-            current_time += t3*1000
-            total_transit += t3
-            
-            # Leg 7: Caminar al destino (siguiendo calles)
-            w4 = walking_distance_realistic(dest_point[0], dest_point[1], to_lat, to_lon)
-            wt4 = self._calculate_walk_time(w4)
-            legs.append(LegSchema(mode="WALK", startTime=current_time, endTime=current_time + wt4*1000,
-                duration=float(wt4), distance=w4, from_=PlaceSchema(lat=dest_point[0], lon=dest_point[1], name="Bus alighting"),
-                to=PlaceSchema(lat=to_lat, lon=to_lon, name="Destination"),
-                legGeometry=LegGeometry(points=encode_polyline([dest_point, (to_lat, to_lon)]), length=2)))
-            current_time += wt4*1000
-            total_walk += w4
+            prev_point, prev_name = (from_lat, from_lon), "Origin"
+            for i, jleg in enumerate(journey.legs):
+                lats, lons = network.pattern_arrays(jleg.pattern_idx)
+                cum = network.pattern_cum_dist(jleg.pattern_idx)
+                board, alight = jleg.board_vertex, jleg.alight_vertex
+                board_m, alight_m = float(cum[board]), float(cum[alight])
+                # Geometría: vértices recorridos + puntos proyectados sobre el trazado
+                first_vertex, last_vertex = board, alight
+                if jleg.board_at:
+                    board_point = (jleg.board_at.lat, jleg.board_at.lon)
+                    board_m -= jleg.board_at.offset_m
+                else:
+                    board_point = (float(lats[board]), float(lons[board]))
+                if jleg.alight_at:
+                    alight_point = (jleg.alight_at.lat, jleg.alight_at.lon)
+                    alight_m -= jleg.alight_at.offset_m
+                    last_vertex = alight - 1
+                else:
+                    alight_point = (float(lats[alight]), float(lons[alight]))
+                
+                if i == 0:
+                    board_name = "Bus boarding"
+                else:
+                    board_name = prev_name
+                if i == num_buses - 1:
+                    alight_name = "Bus alighting"
+                elif num_buses == 2:
+                    alight_name = "Transfer point"
+                else:
+                    alight_name = f"Transfer {i + 1}"
+                
+                # Caminar hasta el punto de abordaje (siguiendo calles)
+                legs.append(self._walk_leg(prev_point, prev_name, board_point, board_name))
+                
+                # Viaje en micro (con la espera del micro antes de subir)
+                route_pieces = [
+                    [board_point] if jleg.board_at else [],
+                    VertexRange(network.polyline(jleg.pattern_idx), first_vertex, last_vertex),
+                    [alight_point] if jleg.alight_at else [],
+                ]
+                bus_dist = alight_m - board_m
+                pattern_id = network.pattern_ids[jleg.pattern_idx]
+                line = network.line_for_pattern(pattern_id)
+                nombre = line.nombre if line else ""
+                legs.append(LegPlan(
+                    mode="BUS",
+                    duration=self._calculate_bus_time(bus_dist),
+                    distance=bus_dist,
+                    from_place=(board_point[0], board_point[1], board_name),
+                    to_place=(alight_point[0], alight_point[1], alight_name),
+                    wait=WAIT_TIME_MINUTES * 60,
+                    route=RouteInfo(
+                        name=nombre,
+                        route_id=pattern_id,
+                        short_name=(line.short_name if line else None) or nombre,
+                        long_name=(line.long_name if line else None) or f"Línea {nombre}",
+                        color=(line.color if line else None) or LEG_COLORS[i % len(LEG_COLORS)],
+                        text_color=(line.text_color if line else None) or "FFFFFF",
+                    ),
+                    pieces=route_pieces
+                ))
+                prev_point, prev_name = alight_point, alight_name
             
-            return ItinerarySchema(legs=legs, startTime=start_time, endTime=current_time,
-                duration=(current_time-start_time)//1000, walkTime=sum([wt1,wt2,wt3,wt4]),
-                walkDistance=walk_total, transfers=2, transitTime=total_transit, waitingTime=total_wait)
+            # Caminar al destino final
+            legs.append(self._walk_leg(prev_point, prev_name, (to_lat, to_lon), "Destination"))
+            return Candidate(legs)
         except Exception as e:
-            print(f"[RoutePlanner] Error en _build_triple_transfer_itinerary: {e}")
+            logger.warning("journey_candidate_failed error=%r", e)
             return None
 
-    def _find_quadruple_transfer_routes(self, db: Session, from_lat: float, from_lon: float,
-                                       to_lat: float, to_lon: float, radius: int = 1500):
-        """Encuentra rutas con 3 transbordos (4 micros) - Solo para casos extremos"""
-        # Similar a triple pero con una línea más
-        # Por ahora retornar vacío - implementar solo si es necesario
-        return []
-
-    def _build_quadruple_transfer_itinerary(self, db: Session, route, from_lat, from_lon, to_lat, to_lon, start_time):
-        """Construye itinerario con 3 transbordos (4 micros) - Solo para casos extremos"""
-        # Por ahora retornar None - implementar solo si es necesario
-        return None
-
     def _find_transfer_routes(self, db: Session, origin_stops, dest_stops):
         """
         Encuentra rutas con 1 transbordo.
@@ -1017,11 +1153,29 @@ class RoutePlanner:
         try:
             return db.execute(query, {"origin_ids": origin_ids, "dest_ids": dest_ids}).fetchall()
         except Exception as e:
-            print(f"[RoutePlanner] Error finding transfer routes: {e}")
+            logger.error("query_failed query=transfer_routes error=%r", e)
             return []
 
     def _get_pattern_geometry(self, db: Session, pattern_id: str, from_seq: int = None, to_seq: int = None):
-        """Obtiene los puntos de geometría REAL del patrón"""
+        """
+        Obtiene los puntos de geometría REAL del patrón (del snapshot en memoria si existe).
+        Con `from_seq`/`to_seq` solo los vértices entre esas dos paradas.
+        """
+        network = get_network_snapshot(db)
+        if network is not None and network.has_pattern(pattern_id):
+            coords = network.pattern_coords(pattern_id)
+            if from_seq is None or to_seq is None:
+                return coords
+            idx = network.pattern_index[pattern_id]
+            start_m, end_m = network.stop_measure(idx, from_seq), network.stop_measure(idx, to_seq)
+            if start_m is None or end_m is None or end_m < start_m:
+                return coords
+            (first, end), _, _ = network.locate([idx, idx], [start_m, end_m])
+            return coords[first:end]
+
+        if from_seq is not None and to_seq is not None:
+            return self._get_pattern_slice(db, pattern_id, from_seq, to_seq)
+
         geom_query = text("""
             SELECT 
                 ST_Y((dp).geom) as lat,
@@ -1035,21 +1189,83 @@ class RoutePlanner:
         """)
         
         try:
-            results = db.execute(geom_query, {"pattern_id": pattern_id}).fetchall()
+            with timed("sql.pattern_geometry"):
+                results = db.execute(geom_query, {"pattern_id": pattern_id}).fetchall()
             if results and len(results) > 2:
                 coords = [(float(r.lat), float(r.lon)) for r in results]
                 return coords
         except Exception as e:
-            print(f"[RoutePlanner] Error getting geometry: {e}")
+            logger.error("query_failed query=pattern_geometry pattern=%s error=%r", pattern_id, e)
         
         return []
 
+    def _get_pattern_slice(self, db: Session, pattern_id: str, from_seq: int, to_seq: int):
+        """Vértices del trazado entre dos paradas, usando vertex_index de pattern_stops"""
+        slice_query = text("""
+            SELECT 
+                ST_Y((dp).geom) as lat,
+                ST_X((dp).geom) as lon
+            FROM (
+                SELECT ST_DumpPoints(p.geometry) as dp, ps1.vertex_index as first_vertex,
+                       ps2.vertex_index as end_vertex
+                FROM transporte.patterns p
+                JOIN transporte.pattern_stops ps1 ON ps1.pattern_id = p.id AND ps1.sequence = :from_seq
+                JOIN transporte.pattern_stops ps2 ON ps2.pattern_id = p.id AND ps2.sequence = :to_seq
+                WHERE p.id = :pattern_id
+            ) sub
+            WHERE (dp).path[1] - 1 >= first_vertex
+            AND (dp).path[1] - 1 < end_vertex
+            ORDER BY (dp).path[1]
+        """)
+
+        try:
+            with timed("sql.pattern_geometry"):
+                results = db.execute(slice_query, {
+                    "pattern_id": pattern_id, "from_seq": from_seq, "to_seq": to_seq
+                }).fetchall()
+            return [(float(r.lat), float(r.lon)) for r in results]
+        except Exception as e:
+            logger.error("query_failed query=pattern_slice pattern=%s error=%r", pattern_id, e)
+        
+        return []
+
+    @staticmethod
+    def _stop_to_stop_pieces(network: NetworkSnapshot, idx: int, from_seq: int, to_seq: int):
+        """
+        Tramo del pattern `idx` entre dos de sus paradas a partir de sus medidas
+        lineales: (pieces de la polyline, metros en micro) o None si no se puede.
+        """
+        start_m, end_m = network.stop_measure(idx, from_seq), network.stop_measure(idx, to_seq)
+        if start_m is None or end_m is None:
+            return None
+        distance = network.ride_distance(idx, start_m, end_m)
+        if distance is None:
+            return None
+        (first, end), lats, lons = network.locate([idx, idx], [start_m, end_m])
+        polyline = network.polyline(idx)
+        if end_m >= start_m:
+            ranges = [VertexRange(polyline, int(first), int(end) - 1)]
+        else:
+            # Ruta circular: pasa por el final y sigue desde el inicio
+            ranges = [VertexRange(polyline, int(first), len(polyline) - 1),
+                      VertexRange(polyline, 0, int(end) - 1)]
+        board_point = (float(lats[0]), float(lons[0]))
+        alight_point = (float(lats[1]), float(lons[1]))
+        return [[board_point]] + ranges + [[alight_point]], distance
+
     def _get_stop_coords(self, db: Session, stop_id: int):
         """Obtiene coordenadas y nombre de una parada"""
-        result = db.execute(
-            text("SELECT latitud, longitud, nombre_parada FROM transporte.paradas WHERE id_parada = :id"),
-            {"id": stop_id}
-        ).fetchone()
+        network = get_network_snapshot(db)
+        if network is not None:
+            stop = network.stop(stop_id)
+            if stop is not None:
+                return stop
+
+        with timed("sql.stop"):
+            result = db.execute(
+                text("SELECT latitud, longitud, nombre_parada FROM transporte.paradas WHERE id_parada = :id"),
+                {"id": stop_id}
+            ).fetchone()
         return result
 
     def _calculate_bus_time(self, distance_meters: float) -> int:
@@ -1060,262 +1276,202 @@ class RoutePlanner:
         """Calcula tiempo caminando en segundos"""
         return int((distance_meters / WALK_SPEED) * 60)
 
-    def _build_direct_itinerary(self, db: Session, route, from_lat, from_lon, to_lat, to_lon, start_time):
-        """Construye itinerario para ruta directa (1 micro)"""
+    def _build_direct_candidate(self, db: Session, route, from_lat, from_lon, to_lat, to_lon,
+                                max_walk: float = MAX_WALK_BY_TRANSFERS[0]):
+        """Construye el candidato para ruta directa por paradas (1 micro)"""
         origin_stop = self._get_stop_coords(db, route.origin_stop_id)
         dest_stop = self._get_stop_coords(db, route.dest_stop_id)
         
         if not origin_stop or not dest_stop:
             return None
+        origin_point = (float(origin_stop.latitud), float(origin_stop.longitud))
+        dest_point = (float(dest_stop.latitud), float(dest_stop.longitud))
 
-        # VALIDACIÓN: Rechazar si caminata total > 1.2km (siguiendo calles)
-        walk_to_stop = walking_distance_realistic(from_lat, from_lon, float(origin_stop.latitud), float(origin_stop.longitud))
-        walk_from_stop = walking_distance_realistic(float(dest_stop.latitud), float(dest_stop.longitud), to_lat, to_lon)
+        # VALIDACIÓN: Rechazar si la caminata total (siguiendo calles) supera el límite
+        walk_to_stop = walking_distance_realistic(from_lat, from_lon, origin_point[0], origin_point[1])
+        walk_from_stop = walking_distance_realistic(dest_point[0], dest_point[1], to_lat, to_lon)
         
-        if walk_to_stop + walk_from_stop > 1200:
+        if walk_to_stop + walk_from_stop > max_walk:
             return None
 
-        legs = []
-        current_time = start_time
-        total_walk_time = 0
-        total_walk_dist = 0
-        
-        # Leg 1: Caminar a la parada
-        walk_dist1 = walk_to_stop
-        walk_time1 = self._calculate_walk_time(walk_dist1)
-        
-        walk_coords1 = [(from_lat, from_lon), (float(origin_stop.latitud), float(origin_stop.longitud))]
-        legs.append(LegSchema(
-            mode="WALK",
-            startTime=current_time,
-            endTime=current_time + (walk_time1 * 1000),
-            duration=float(walk_time1),
-            distance=walk_dist1,
-            from_=PlaceSchema(lat=from_lat, lon=from_lon, name="Origin"),
-            to=PlaceSchema(lat=float(origin_stop.latitud), lon=float(origin_stop.longitud), name=origin_stop.nombre_parada),
-            legGeometry=LegGeometry(points=encode_polyline(walk_coords1), length=len(walk_coords1))
-        ))
-        current_time += walk_time1 * 1000
-        total_walk_time += walk_time1
-        total_walk_dist += walk_dist1
-        
-        # Tiempo de espera
-        wait_time = WAIT_TIME_MINUTES * 60
-        current_time += wait_time * 1000
-        
-        # Leg 2: Viaje en bus
-        bus_coords = self._get_pattern_geometry(db, route.pattern_id, route.seq_start, route.seq_end)
-        if not bus_coords:
-            bus_coords = [
-                (float(origin_stop.latitud), float(origin_stop.longitud)),
-                (float(dest_stop.latitud), float(dest_stop.longitud))
-            ]
-        
-        bus_dist = haversine_distance(
-            float(origin_stop.latitud), float(origin_stop.longitud),
-            float(dest_stop.latitud), float(dest_stop.longitud)
-        )
-        bus_time = self._calculate_bus_time(bus_dist)
-        
-        legs.append(LegSchema(
-            mode="BUS",
-            startTime=current_time,
-            endTime=current_time + (bus_time * 1000),
-            duration=float(bus_time),
-            distance=bus_dist,
-            from_=PlaceSchema(lat=float(origin_stop.latitud), lon=float(origin_stop.longitud), name=origin_stop.nombre_parada),
-            to=PlaceSchema(lat=float(dest_stop.latitud), lon=float(dest_stop.longitud), name=dest_stop.nombre_parada),
-            route=route.nombre_linea,
-            routeId=route.pattern_id,
-            routeShortName=route.short_name or route.nombre_linea,
-            routeLongName=route.long_name or f"Línea {route.nombre_linea}",
-            routeColor=route.color or "0088FF",
-            routeTextColor=route.text_color or "FFFFFF",
-            legGeometry=LegGeometry(points=encode_polyline(bus_coords), length=len(bus_coords)),
-            transitLeg=True
-        ))
-        current_time += bus_time * 1000
-        
-        # Leg 3: Caminar al destino
-        walk_dist2 = walking_distance_realistic(float(dest_stop.latitud), float(dest_stop.longitud), to_lat, to_lon)
-        walk_time2 = self._calculate_walk_time(walk_dist2)
-        
-        walk_coords2 = [(float(dest_stop.latitud), float(dest_stop.longitud)), (to_lat, to_lon)]
-        legs.append(LegSchema(
-            mode="WALK",
-            startTime=current_time,
-            endTime=current_time + (walk_time2 * 1000),
-            duration=float(walk_time2),
-            distance=walk_dist2,
-            from_=PlaceSchema(lat=float(dest_stop.latitud), lon=float(dest_stop.longitud), name=dest_stop.nombre_parada),
-            to=PlaceSchema(lat=to_lat, lon=to_lon, name="Destination"),
-            legGeometry=LegGeometry(points=encode_polyline(walk_coords2), length=len(walk_coords2))
-        ))
-        current_time += walk_time2 * 1000
-        total_walk_time += walk_time2
-        total_walk_dist += walk_dist2
-        
-        total_duration = (current_time - start_time) // 1000
-        transit_time = bus_time
-        
-        return ItinerarySchema(
-            legs=legs,
-            startTime=start_time,
-            endTime=current_time,
-            duration=total_duration,
-            walkTime=total_walk_time,
-            walkDistance=total_walk_dist,
-            transfers=0,
-            transitTime=transit_time,
-            waitingTime=wait_time
-        )
+        # Geometría del micro: solo el tramo entre las dos paradas (medidas de
+        # pattern_stops), pre-codificado si el pattern está en el snapshot
+        network = get_network_snapshot(db)
+        idx = network.pattern_index.get(route.pattern_id) if network else None
+        ride = None
+        if idx is not None and network.offsets[idx + 1] - network.offsets[idx] >= 2:
+            ride = self._stop_to_stop_pieces(network, idx, route.seq_start, route.seq_end)
+        if ride is not None:
+            bus_pieces, bus_dist = ride
+        else:
+            bus_pieces = [[origin_point],
+                          self._get_pattern_geometry(db, route.pattern_id, route.seq_start, route.seq_end),
+                          [dest_point]]
+            if route.measure_start is not None and route.measure_end is not None \
+                    and route.measure_end > route.measure_start:
+                bus_dist = route.measure_end - route.measure_start
+            else:
+                bus_dist = CITY_METRIC.distance(origin_point[0], origin_point[1], dest_point[0], dest_point[1])
+        
+        return Candidate([
+            # Leg 1: Caminar a la parada
+            self._walk_leg((from_lat, from_lon), "Origin", origin_point, origin_stop.nombre_parada,
+                           distance=walk_to_stop),
+            # Leg 2: Viaje en bus
+            LegPlan(
+                mode="BUS",
+                duration=self._calculate_bus_time(bus_dist),
+                distance=bus_dist,
+                from_place=(origin_point[0], origin_point[1], origin_stop.nombre_parada),
+                to_place=(dest_point[0], dest_point[1], dest_stop.nombre_parada),
+                wait=WAIT_TIME_MINUTES * 60,
+                route=RouteInfo(
+                    name=route.nombre_linea,
+                    route_id=route.pattern_id,
+                    short_name=route.short_name or route.nombre_linea,
+                    long_name=route.long_name or f"Línea {route.nombre_linea}",
+                    color=route.color or "0088FF",
+                    text_color=route.text_color or "FFFFFF",
+                ),
+                pieces=bus_pieces
+            ),
+            # Leg 3: Caminar al destino
+            self._walk_leg(dest_point, dest_stop.nombre_parada, (to_lat, to_lon), "Destination",
+                           distance=walk_from_stop),
+        ])
 
-    def _build_geometry_itinerary(self, db: Session, route, from_lat, from_lon, to_lat, to_lon, start_time):
+    def _build_geometry_candidate(self, db: Session, route, from_lat, from_lon, to_lat, to_lon):
         """
-        Construye itinerario basado en geometría del trazado.
+        Construye el candidato basado en geometría del trazado.
         El usuario puede subir/bajar en cualquier punto de la ruta.
         """
-        legs = []
-        current_time = start_time
-        total_walk_time = 0
-        total_walk_dist = 0
-        
-        # Obtener el trazado completo de la ruta
-        bus_coords = self._get_pattern_geometry(db, route.pattern_id)
-        if not bus_coords or len(bus_coords) < 2:
+        # Obtener el trazado y proyectar origen y destino sobre sus segmentos
+        projected = self._project_on_pattern(db, route.pattern_id, [from_lat, to_lat], [from_lon, to_lon])
+        if projected is None:
             return None
-        
-        # Encontrar el punto más cercano al origen y destino en el trazado
-        origin_point, origin_idx = self._find_closest_point_on_line(bus_coords, from_lat, from_lon)
-        dest_point, dest_idx = self._find_closest_point_on_line(bus_coords, to_lat, to_lon)
-        
-        # Leg 1: Caminar al punto de abordaje (siguiendo calles)
-        walk_dist1 = walking_distance_realistic(from_lat, from_lon, origin_point[0], origin_point[1])
-        walk_time1 = self._calculate_walk_time(walk_dist1)
-        
-        walk_coords1 = [(from_lat, from_lon), origin_point]
-        legs.append(LegSchema(
-            mode="WALK",
-            startTime=current_time,
-            endTime=current_time + (walk_time1 * 1000),
-            duration=float(walk_time1),
-            distance=walk_dist1,
-            from_=PlaceSchema(lat=from_lat, lon=from_lon, name="Origin"),
-            to=PlaceSchema(lat=origin_point[0], lon=origin_point[1], name="Bus boarding"),
-            legGeometry=LegGeometry(points=encode_polyline(walk_coords1), length=len(walk_coords1))
-        ))
-        current_time += walk_time1 * 1000
-        total_walk_time += walk_time1
-        total_walk_dist += walk_dist1
-        
-        # Tiempo de espera
-        wait_time = WAIT_TIME_MINUTES * 60
-        current_time += wait_time * 1000
-        
-        # Leg 2: Viaje en bus
-        if origin_idx >= dest_idx:
+        network, p, proj = projected
+        bus_lats, bus_lons = network.pattern_arrays(p)
+        origin_point = (float(proj.lat[0]), float(proj.lon[0]))
+        dest_point = (float(proj.lat[1]), float(proj.lon[1]))
+        origin_idx, dest_idx = int(proj.segment[0]), int(proj.segment[1])
+        # Posición de cada punto en metros desde el inicio del trazado
+        origin_m, dest_m = measure_at(network.pattern_cum_dist(p), proj.segment, proj.fraction).tolist()
+        
+        # Viaje en bus (los índices son segmentos: el punto proyectado
+        # está entre el vértice idx e idx+1)
+        polyline = network.polyline(p)
+        if dest_m > origin_m:
+            route_pieces = [VertexRange(polyline, origin_idx + 1, dest_idx)]
+            bus_distance = dest_m - origin_m
+        elif network.pattern_is_loop[p]:
             # Lógica para Rutas Circulares (Wrap-around)
-            is_loop = False
-            if len(bus_coords) > 10:
-                first_p = bus_coords[0]
-                last_p = bus_coords[-1]
-                dist_ends = haversine_distance(first_p[0], first_p[1], last_p[0], last_p[1])
-                if dist_ends < 1000:  # Aumentado de 500 a 1000m para detectar más loops
-                    is_loop = True
-            
-            if is_loop:
-                route_segment_1 = bus_coords[origin_idx:]
-                route_segment_2 = bus_coords[:dest_idx+1]
-                route_segment = route_segment_1 + route_segment_2
-            else:
-                # CAMBIO: Si no es loop, verificar si el destino está "atrás" por poco
-                # En ese caso, invertir y usar solo la sección necesaria
-                if origin_idx - dest_idx < 10:  # Diferencia pequeña
-                    # Usar ruta corta al revés
-                    route_segment = bus_coords[dest_idx:origin_idx+1]
-                    route_segment.reverse()
-                else:
-                    return None  # Ruta no válida
+            route_pieces = [VertexRange(polyline, origin_idx + 1, len(bus_lats) - 1),
+                            VertexRange(polyline, 0, dest_idx)]
+            bus_distance = network.ride_distance(p, origin_m, dest_m)
+        elif origin_idx - dest_idx < 10:
+            # CAMBIO: Si no es loop, verificar si el destino está "atrás" por poco
+            # En ese caso, usar ruta corta al revés
+            route_pieces = [list(zip(bus_lats[dest_idx + 1:origin_idx + 1].tolist()[::-1],
+                                     bus_lons[dest_idx + 1:origin_idx + 1].tolist()[::-1]))]
+            bus_distance = origin_m - dest_m
         else:
-            route_segment = bus_coords[origin_idx:dest_idx+1]
+            return None  # Ruta no válida
+        route_pieces = [[origin_point]] + route_pieces + [[dest_point]]
+        
+        return Candidate([
+            # Leg 1: Caminar al punto de abordaje (siguiendo calles)
+            self._walk_leg((from_lat, from_lon), "Origin", origin_point, "Bus boarding"),
+            # Leg 2: Viaje en bus (con la espera en la parada)
+            LegPlan(
+                mode="BUS",
+                duration=self._calculate_bus_time(bus_distance),
+                distance=bus_distance,
+                from_place=(origin_point[0], origin_point[1], "Bus boarding"),
+                to_place=(dest_point[0], dest_point[1], "Bus alighting"),
+                wait=WAIT_TIME_MINUTES * 60,
+                route=RouteInfo(
+                    name=route.nombre_linea,
+                    route_id=route.pattern_id,
+                    short_name=route.short_name or route.nombre_linea,
+                    long_name=route.long_name or f"Línea {route.nombre_linea}",
+                    color=route.color or "0088FF",
+                    text_color=route.text_color or "FFFFFF",
+                ),
+                pieces=route_pieces
+            ),
+            # Leg 3: Caminar al destino final (siguiendo calles)
+            self._walk_leg(dest_point, "Bus alighting", (to_lat, to_lon), "Destination"),
+        ])
 
-        bus_distance = 0
-        for i in range(len(route_segment) - 1):
-            bus_distance += haversine_distance(
-                route_segment[i][0], route_segment[i][1],
-                route_segment[i+1][0], route_segment[i+1][1]
-            )
-        bus_time = self._calculate_bus_time(bus_distance)
-        
-        legs.append(LegSchema(
-            mode="BUS",
-            startTime=current_time,
-            endTime=current_time + (bus_time * 1000),
-            duration=float(bus_time),
-            distance=bus_distance,
-            from_=PlaceSchema(lat=origin_point[0], lon=origin_point[1], name="Bus boarding"),
-            to=PlaceSchema(lat=dest_point[0], lon=dest_point[1], name="Bus alighting"),
-            route=route.nombre_linea,
-            routeId=route.pattern_id,
-            routeShortName=route.short_name or route.nombre_linea,
-            routeLongName=route.long_name or f"Línea {route.nombre_linea}",
-            routeColor=route.color or "0088FF",
-            routeTextColor=route.text_color or "FFFFFF",
-            legGeometry=LegGeometry(points=encode_polyline(route_segment), length=len(route_segment)),
-            transitLeg=True
-        ))
-        current_time += bus_time * 1000
-        
-        # Leg 3: Caminar al destino final (siguiendo calles)
-        walk_dist2 = walking_distance_realistic(dest_point[0], dest_point[1], to_lat, to_lon)
-        walk_time2 = self._calculate_walk_time(walk_dist2)
-        
-        walk_coords2 = [dest_point, (to_lat, to_lon)]
-        legs.append(LegSchema(
+    def _walk_leg(self, from_point, from_name, to_point, to_name, distance: float = None) -> LegPlan:
+        """Leg a pie en línea recta (distancia siguiendo calles)"""
+        if distance is None:
+            distance = walking_distance_realistic(from_point[0], from_point[1], to_point[0], to_point[1])
+        return LegPlan(
             mode="WALK",
-            startTime=current_time,
-            endTime=current_time + (walk_time2 * 1000),
-            duration=float(walk_time2),
-            distance=walk_dist2,
-            from_=PlaceSchema(lat=dest_point[0], lon=dest_point[1], name="Bus alighting"),
-            to=PlaceSchema(lat=to_lat, lon=to_lon, name="Destination"),
-            legGeometry=LegGeometry(points=encode_polyline(walk_coords2), length=len(walk_coords2))
-        ))
-        current_time += walk_time2 * 1000
-        total_walk_time += walk_time2
-        total_walk_dist += walk_dist2
-        
-        total_duration = (current_time - start_time) // 1000
+            duration=self._calculate_walk_time(distance),
+            distance=distance,
+            from_place=(from_point[0], from_point[1], from_name),
+            to_place=(to_point[0], to_point[1], to_name),
+            pieces=[[from_point, to_point]]
+        )
+
+    def _materialize_itinerary(self, candidate: Candidate, start_time: int) -> ItinerarySchema:
+        """Arma el ItinerarySchema (Pydantic + polylines) de un candidato ganador"""
+        legs = []
+        current_time = start_time
+        for leg in candidate.legs:
+            current_time += leg.wait * 1000
+            route_fields = {}
+            if leg.route:
+                route_fields = dict(
+                    route=leg.route.name,
+                    routeId=leg.route.route_id,
+                    routeShortName=leg.route.short_name,
+                    routeLongName=leg.route.long_name,
+                    routeColor=leg.route.color,
+                    routeTextColor=leg.route.text_color,
+                    transitLeg=True
+                )
+            legs.append(LegSchema(
+                mode=leg.mode,
+                startTime=current_time,
+                endTime=current_time + (leg.duration * 1000),
+                duration=float(leg.duration),
+                distance=leg.distance,
+                from_=PlaceSchema(lat=leg.from_place[0], lon=leg.from_place[1], name=leg.from_place[2]),
+                to=PlaceSchema(lat=leg.to_place[0], lon=leg.to_place[1], name=leg.to_place[2]),
+                legGeometry=LegGeometry(points=encode_pieces(leg.pieces), length=pieces_length(leg.pieces)),
+                **route_fields
+            ))
+            current_time += leg.duration * 1000
         
         return ItinerarySchema(
             legs=legs,
             startTime=start_time,
             endTime=current_time,
-            duration=total_duration,
-            walkTime=total_walk_time,
-            walkDistance=total_walk_dist,
-            transfers=0,
-            transitTime=bus_time,
-            waitingTime=wait_time
+            duration=(current_time - start_time) // 1000,
+            walkTime=candidate.walk_time,
+            walkDistance=candidate.walk_distance,
+            transfers=candidate.transfers,
+            transitTime=candidate.transit_time,
+            waitingTime=candidate.waiting_time
         )
 
-    def _find_closest_point_on_line(self, coords, lat, lon):
-        """Encuentra el punto más cercano en una línea de coordenadas"""
-        if not coords:
-            return (lat, lon), 0
-            
-        min_dist = float('inf')
-        closest_point = coords[0]
-        closest_idx = 0
-        
-        for i, point in enumerate(coords):
-            dist = haversine_distance(lat, lon, point[0], point[1])
-            if dist < min_dist:
-                min_dist = dist
-                closest_point = point
-                closest_idx = i
-        
-        return closest_point, closest_idx
+    def _project_on_pattern(self, db: Session, pattern_id: str, lats, lons):
+        """
+        Proyecta puntos sobre los segmentos del trazado (no solo sobre los vértices).
+        Devuelve (snapshot, índice del pattern, Projection) o None si no tiene geometría.
+        Si el pattern no está en el snapshot se arma uno solo con su geometría.
+        """
+        network = get_network_snapshot(db)
+        idx = network.pattern_index.get(pattern_id) if network else None
+        if idx is None or network.offsets[idx + 1] - network.offsets[idx] <= 2:
+            bus_coords = self._get_pattern_geometry(db, pattern_id)
+            if not bus_coords or len(bus_coords) < 2:
+                return None
+            network, idx = NetworkSnapshot(0, [], [(pattern_id, None, None, bus_coords)], [], []), 0
+        return network, idx, network.project(idx, lats, lons)
 
     def _build_transfer_itinerary(self, db: Session, route, from_lat, from_lon, to_lat, to_lon, start_time):
         """Construye itinerario con 1 transbordo (2 micros)"""
@@ -1374,7 +1530,7 @@ class RoutePlanner:
                 (float(transfer_stop.latitud), float(transfer_stop.longitud))
             ]
         
-        bus1_dist = haversine_distance(
+        bus1_dist = CITY_METRIC.distance(
             float(origin_stop.latitud), float(origin_stop.longitud),
             float(transfer_stop.latitud), float(transfer_stop.longitud)
         )
@@ -1418,7 +1574,7 @@ class RoutePlanner:
                 (float(dest_stop.latitud), float(dest_stop.longitud))
             ]
         
-        bus2_dist = haversine_distance(
+        bus2_dist = CITY_METRIC.distance(
             float(transfer_stop.latitud), float(transfer_stop.longitud),
             float(dest_stop.latitud), float(dest_stop.longitud)
         )
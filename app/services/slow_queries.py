@@ -0,0 +1,183 @@
+"""
+Registro en proceso de las queries lentas, agrupadas por fingerprint.
+
+Los listeners before/after_cursor_execute del engine (ver app/database.py)
+miden cada statement. El texto se normaliza a un fingerprint (literales,
+números y parámetros → ?, listas IN colapsadas, espacios unificados) y por
+fingerprint se acumulan cantidad, tiempo total y máximo. La tabla está
+acotada: al llenarse se descarta el fingerprint con menos tiempo total,
+así que siempre quedan los que más pesan.
+
+Con `explain=True`, cuando una query supera el umbral y es de las `explain_top`
+peores, se guarda su EXPLAIN (ANALYZE, BUFFERS) con los mismos parámetros.
+ANALYZE vuelve a ejecutarla, por eso solo se hace con SELECT/WITH, en un hilo
+aparte y una vez por fingerprint. El resultado se ve en /api/v1/admin/slow-queries.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+MAX_STATEMENT_CHARS = 2000
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PARAMS = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+|\?")
+_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Forma normalizada del statement: mismas queries con distintos valores coinciden"""
+    text = _COMMENTS.sub(" ", statement)
+    text = _STRINGS.sub("?", text)
+    text = _PARAMS.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _LISTS.sub("(?...)", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def fingerprint_id(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+class QueryStats:
+    __slots__ = ("fingerprint", "count", "total_ms", "max_ms", "slow_count", "last_seen", "explain")
+
+    def __init__(self, normalized: str):
+        self.fingerprint = normalized
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_count = 0
+        self.last_seen = 0.0
+        self.explain: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "id": fingerprint_id(self.fingerprint),
+            "fingerprint": self.fingerprint[:MAX_STATEMENT_CHARS],
+            "count": self.count,
+            "slow_count": self.slow_count,
+            "total_ms": round(self.total_ms, 1),
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 1),
+            "last_seen": round(self.last_seen, 1),
+            "explain": self.explain,
+        }
+
+
+class SlowQueryLog:
+    """Estadísticas por fingerprint, acotadas a `max_fingerprints` (thread-safe)"""
+
+    def __init__(self, threshold_ms: float = 500.0, max_fingerprints: int = 200,
+                 explain: bool = False, explain_top: int = 10):
+        self.threshold_ms = threshold_ms
+        self.max_fingerprints = max_fingerprints
+        self.explain = explain
+        self.explain_top = explain_top
+        self._lock = threading.Lock()
+        self._stats: Dict[str, QueryStats] = {}
+        self._explaining = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._engine = None
+        self.since = time.time()
+
+    def record(self, statement: str, ms: float) -> Optional[QueryStats]:
+        """Suma una ejecución; devuelve las estadísticas si quedó entre las `explain_top` peores"""
+        normalized = fingerprint(statement)
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    # Se descarta el que menos tiempo acumuló (suele ser una query rápida y rara)
+                    victim = min(self._stats.values(), key=lambda s: s.total_ms)
+                    if victim.total_ms > ms:
+                        return None
+                    del self._stats[victim.fingerprint]
+                stats = self._stats[normalized] = QueryStats(normalized)
+            stats.count += 1
+            stats.total_ms += ms
+            stats.max_ms = max(stats.max_ms, ms)
+            stats.last_seen = time.time()
+            if ms < self.threshold_ms:
+                return None
+            stats.slow_count += 1
+            if not self.explain or stats.explain is not None or normalized in self._explaining:
+                return None
+            worst = sorted(self._stats.values(), key=lambda s: s.max_ms, reverse=True)[:self.explain_top]
+            if stats not in worst:
+                return None
+            self._explaining.add(normalized)
+            return stats
+
+    def top(self, limit: int = 20, order: str = "total_ms") -> List[dict]:
+        with self._lock:
+            stats = sorted(self._stats.values(), key=lambda s: getattr(s, order), reverse=True)[:limit]
+            return [s.as_dict() for s in stats]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._explaining.clear()
+            self.since = time.time()
+
+    # ----- Integración con SQLAlchemy -----
+
+    def install(self, engine) -> None:
+        """Registra los listeners que miden cada statement del engine"""
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        self._engine = engine
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_slow_query_start", None)
+        if start is None:
+            return
+        ms = (time.perf_counter() - start) * 1000.0
+        if getattr(self._local, "explaining", False):
+            return
+        stats = self.record(statement, ms)
+        if stats is not None and not executemany and conn.dialect.name == "postgresql" \
+                and statement.lstrip()[:6].upper() in ("SELECT", "WITH"):
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+            self._executor.submit(self._capture_explain, stats, statement, parameters)
+        elif stats is not None:
+            with self._lock:
+                self._explaining.discard(stats.fingerprint)
+
+    def _capture_explain(self, stats: QueryStats, statement: str, parameters) -> None:
+        self._local.explaining = True
+        try:
+            with self._engine.connect() as conn:
+                rows = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters).fetchall()
+                conn.rollback()
+            plan = "\n".join(row[0] for row in rows)
+        except Exception as e:
+            # Se guarda el error para no reintentar en cada ejecución lenta
+            plan = f"EXPLAIN falló: {e!r}"
+            logger.warning("explain_failed fingerprint=%s error=%r", fingerprint_id(stats.fingerprint), e)
+        finally:
+            self._local.explaining = False
+        with self._lock:
+            stats.explain = plan
+            self._explaining.discard(stats.fingerprint)
+
+
+SLOW_QUERIES = SlowQueryLog()
@@ -0,0 +1,446 @@
+"""
+Índice espacial en memoria de los segmentos de todos los patterns.
+
+Hash de grilla uniforme en el plano local del snapshot (metros): cada
+segmento se registra en todas las celdas que toca su bounding box y las
+celdas se guardan ordenadas por clave (CSR). Buscar "patterns a menos de R
+metros" solo mira las celdas del cuadrado de lado 2R alrededor del punto, sin
+PostGIS ni recorrer la red entera.
+
+CandidateRaster precalcula, para celdas de ~100 m de toda la ciudad, los
+patterns al alcance de una caminata: buscar candidatos pasa a ser leer una
+celda y refinar la distancia exacta solo sobre esos patterns.
+"""
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+from app.services.geometry import CITY_METRIC, local_xy, segment_inverse_len2
+
+CELL_SIZE_M = 250.0
+RASTER_TILE = 8  # Celdas del raster (por lado) que se calculan juntas
+RASTER_SUBBLOCK = 8  # Segmentos por sub-bloque al acotar distancias del raster
+# Media diagonal de una celda (0.707) con margen por la diferencia entre el
+# plano del raster y el del snapshot
+RASTER_SLACK = 0.75
+
+
+class NearbyPatterns(NamedTuple):
+    """Patterns cerca de un punto, ordenados por distancia (uno por pattern)"""
+    pattern: np.ndarray   # índice del pattern en el snapshot
+    segment: np.ndarray   # segmento más cercano (local al pattern)
+    fraction: np.ndarray  # posición sobre ese segmento (0..1)
+    distance: np.ndarray  # metros
+
+
+class SegmentGrid:
+    """
+    Grilla de segmentos de un NetworkSnapshot.
+
+    `cell_keys` (únicas, ordenadas) y `cell_offsets` indexan `cell_segments`:
+    los segmentos de la celda `cell_keys[i]` son
+    `cell_segments[cell_offsets[i]:cell_offsets[i+1]]` (índices globales de
+    vértice, igual que las columnas de segment_table).
+    """
+
+    def __init__(self, snapshot, cell_size_m: float = CELL_SIZE_M):
+        self.snapshot = snapshot
+        self.cell_size = float(cell_size_m)
+
+        sizes = np.diff(snapshot.offsets)
+        num_segments = np.maximum(sizes - 1, 0)
+        segments = (np.repeat(snapshot.offsets[:-1] - np.cumsum(num_segments) + num_segments, num_segments)
+                    + np.arange(num_segments.sum()))
+
+        x0, y0 = snapshot.xs[segments], snapshot.ys[segments]
+        x1, y1 = x0 + snapshot.seg_dx[segments], y0 + snapshot.seg_dy[segments]
+        cx0 = np.floor(np.minimum(x0, x1) / self.cell_size).astype(np.int64)
+        cx1 = np.floor(np.maximum(x0, x1) / self.cell_size).astype(np.int64)
+        cy0 = np.floor(np.minimum(y0, y1) / self.cell_size).astype(np.int64)
+        cy1 = np.floor(np.maximum(y0, y1) / self.cell_size).astype(np.int64)
+
+        # Segmentos largos ocupan varias celdas: expandir su rectángulo de celdas
+        width = cx1 - cx0 + 1
+        height = cy1 - cy0 + 1
+        counts = width * height
+        owner = np.repeat(np.arange(len(segments)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = cx0[owner] + k // height[owner]
+        cell_y = cy0[owner] + k % height[owner]
+
+        keys = self._key(cell_x, cell_y)
+        order = np.argsort(keys, kind="stable")
+        self.cell_keys, starts = np.unique(keys[order], return_index=True)
+        self.cell_offsets = np.append(starts, len(order)).astype(np.int64)
+        self.cell_segments = segments[owner[order]]
+
+    @staticmethod
+    def _key(cell_x, cell_y):
+        # Celdas de ±2^31 (mucho más que una ciudad a 250 m) en un solo int64
+        return (np.asarray(cell_x, dtype=np.int64) << 32) + (np.asarray(cell_y, dtype=np.int64) + (1 << 31))
+
+    def segments_near(self, qx: float, qy: float, radius: float) -> np.ndarray:
+        """Segmentos (sin repetir) de las celdas que cubren el cuadrado de lado 2·radius"""
+        x_lo, x_hi = np.floor(np.array([qx - radius, qx + radius]) / self.cell_size).astype(np.int64)
+        y_lo, y_hi = np.floor(np.array([qy - radius, qy + radius]) / self.cell_size).astype(np.int64)
+        cx = np.arange(x_lo, x_hi + 1)
+        cy = np.arange(y_lo, y_hi + 1)
+        keys = self._key(np.repeat(cx, len(cy)), np.tile(cy, len(cx)))
+        slots = np.searchsorted(self.cell_keys, keys)
+        inside = slots < len(self.cell_keys)
+        slots, keys = slots[inside], keys[inside]
+        slots = slots[self.cell_keys[slots] == keys]
+        if len(slots) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts, ends = self.cell_offsets[slots], self.cell_offsets[slots + 1]
+        lengths = ends - starts
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.unique(self.cell_segments[rows])
+
+    def query(self, qx: float, qy: float, radius: float) -> NearbyPatterns:
+        """Patterns con algún segmento a menos de `radius` metros de (qx, qy)"""
+        snapshot = self.snapshot
+        segments = self.segments_near(qx, qy, radius)
+        x0, y0 = snapshot.xs[segments], snapshot.ys[segments]
+        dx, dy = snapshot.seg_dx[segments], snapshot.seg_dy[segments]
+        t = np.clip(((qx - x0) * dx + (qy - y0) * dy) * snapshot.seg_inv_len2[segments], 0.0, 1.0)
+        distance = np.hypot(qx - x0 - t * dx, qy - y0 - t * dy)
+
+        near = distance <= radius
+        segments, t, distance = segments[near], t[near], distance[near]
+        pattern = np.searchsorted(snapshot.offsets, segments, side="right") - 1
+
+        # El segmento más cercano de cada pattern, y los patterns por distancia
+        best = _nearest_per_key(pattern, distance)
+        best = best[np.argsort(distance[best], kind="stable")]
+        return NearbyPatterns(pattern[best].astype(np.int32),
+                              (segments[best] - snapshot.offsets[pattern[best]]).astype(np.int32),
+                              t[best], distance[best])
+
+
+def _nearest_per_key(keys: np.ndarray, distance: np.ndarray) -> np.ndarray:
+    """Índices de la menor distancia de cada clave"""
+    order = np.lexsort((distance, keys))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = keys[order][1:] != keys[order][:-1]
+    return order[first]
+
+
+def _expand_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatena los rangos [start, start + length) sin bucle"""
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class CandidateRaster:
+    """
+    Patterns candidatos por celda de `cell_m` metros.
+
+    Las celdas viven en el plano fijo de CITY_METRIC (no en el del snapshot,
+    que se mueve con la red) para poder reusarlas entre versiones. La grilla es
+    densa: la celda absoluta (cx, cy) es la fila `(cx - x0) * height + (cy - y0)`
+    y sus entradas son `offsets[fila]:offsets[fila+1]` de
+    `pattern` (int32), `vertex` (int32, vértice más cercano al centro) y
+    `distance` (float32, metros del centro al trazado), ordenadas por distancia.
+    Cada celda guarda los patterns a menos de `radius_m` de cualquiera de sus
+    puntos, así que una búsqueda con radio ≤ radius_m no pierde candidatos.
+    """
+
+    def __init__(self, snapshot, radius_m: float, cell_m: float,
+                 x0: int, y0: int, width: int, height: int,
+                 rows: np.ndarray, pattern: np.ndarray, vertex: np.ndarray, distance: np.ndarray):
+        self.snapshot = snapshot
+        self.radius_m = float(radius_m)
+        self.cell_m = float(cell_m)
+        self.slack = RASTER_SLACK * self.cell_m
+        self.x0, self.y0, self.width, self.height = x0, y0, width, height
+
+        order = np.lexsort((pattern, distance, rows))
+        self.pattern = pattern[order].astype(np.int32)
+        self.vertex = vertex[order].astype(np.int32)
+        self.distance = distance[order].astype(np.float32)
+        self.offsets = np.zeros(width * height + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=width * height), out=self.offsets[1:])
+
+    @property
+    def reach(self) -> float:
+        return self.radius_m + self.slack
+
+    def __len__(self) -> int:
+        return len(self.pattern)
+
+    # ----- Construcción -----
+
+    @staticmethod
+    def _extent(snapshot, reach: float, cell_m: float):
+        """(x0, y0, ancho, alto) en celdas que cubren la red más `reach` metros"""
+        if snapshot.num_vertices == 0:
+            return 0, 0, 0, 0
+        x, y = CITY_METRIC.to_xy(snapshot.lats, snapshot.lons)
+        x0, x1 = np.floor((np.array([x.min(), x.max()]) + [-reach, reach]) / cell_m).astype(np.int64)
+        y0, y1 = np.floor((np.array([y.min(), y.max()]) + [-reach, reach]) / cell_m).astype(np.int64)
+        return int(x0), int(y0), int(x1 - x0 + 1), int(y1 - y0 + 1)
+
+    @classmethod
+    def build(cls, snapshot, radius_m: float, cell_m: float = 100.0) -> "CandidateRaster":
+        """Rasteriza toda la red"""
+        reach = radius_m + RASTER_SLACK * cell_m
+        x0, y0, width, height = cls._extent(snapshot, reach, cell_m)
+        cell_x = np.repeat(np.arange(x0, x0 + width), height)
+        cell_y = np.tile(np.arange(y0, y0 + height), width)
+        rows, pattern, vertex, distance = _rasterize(snapshot, cell_x, cell_y, cell_m, reach)
+        return cls(snapshot, radius_m, cell_m, x0, y0, width, height,
+                   (cell_x[rows] - x0) * height + (cell_y[rows] - y0), pattern, vertex, distance)
+
+    def refreshed(self, snapshot) -> "CandidateRaster":
+        """
+        Raster para una versión nueva de la red reusando este: solo se
+        recalculan las celdas al alcance (bounding box + radio) de los patterns
+        cuya geometría cambió, se agregó o se eliminó.
+        """
+        old = self.snapshot
+        changed_old: List[int] = []
+        changed_new: List[int] = []
+        remap = np.full(old.num_patterns, -1, dtype=np.int64)
+        for pattern_id, idx in old.pattern_index.items():
+            new_idx = snapshot.pattern_index.get(pattern_id)
+            if new_idx is not None:
+                remap[idx] = new_idx
+                old_lats, old_lons = old.pattern_arrays(idx)
+                new_lats, new_lons = snapshot.pattern_arrays(new_idx)
+                if np.array_equal(old_lats, new_lats) and np.array_equal(old_lons, new_lons):
+                    continue
+                changed_new.append(new_idx)
+            changed_old.append(idx)
+        changed_new.extend(idx for pattern_id, idx in snapshot.pattern_index.items()
+                           if pattern_id not in old.pattern_index)
+
+        reach = self.reach
+        x0, y0, width, height = self._extent(snapshot, reach, self.cell_m)
+        if width and self.width:
+            x1 = max(x0 + width, self.x0 + self.width)
+            y1 = max(y0 + height, self.y0 + self.height)
+            x0, y0 = min(x0, self.x0), min(y0, self.y0)
+            width, height = x1 - x0, y1 - y0
+        elif not width:
+            x0, y0, width, height = self.x0, self.y0, self.width, self.height
+
+        rects = (self._touched_cells(old, changed_old, reach)
+                 + self._touched_cells(snapshot, changed_new, reach))
+
+        # Entradas viejas fuera de las celdas tocadas, con índices de la red nueva
+        old_rows = np.repeat(np.arange(self.width * self.height), np.diff(self.offsets))
+        cell_x = self.x0 + old_rows // max(self.height, 1)
+        cell_y = self.y0 + old_rows % max(self.height, 1)
+        keep = remap[self.pattern] >= 0
+        for rx0, rx1, ry0, ry1 in rects:
+            keep &= ~((cell_x >= rx0) & (cell_x <= rx1) & (cell_y >= ry0) & (cell_y <= ry1))
+        rows = [(cell_x[keep] - x0) * height + (cell_y[keep] - y0)]
+        patterns = [remap[self.pattern[keep]]]
+        vertices = [self.vertex[keep]]
+        distances = [self.distance[keep]]
+
+        if rects:
+            touched = np.unique(np.concatenate([
+                self._rect_rows(rect, x0, y0, width, height) for rect in rects
+            ]))
+            tx, ty = x0 + touched // height, y0 + touched % height
+            new_rows, pattern, vertex, distance = _rasterize(snapshot, tx, ty, self.cell_m, reach)
+            rows.append(touched[new_rows])
+            patterns.append(pattern)
+            vertices.append(vertex)
+            distances.append(distance)
+
+        return CandidateRaster(snapshot, self.radius_m, self.cell_m, x0, y0, width, height,
+                               np.concatenate(rows), np.concatenate(patterns),
+                               np.concatenate(vertices), np.concatenate(distances))
+
+    def _touched_cells(self, snapshot, patterns: Sequence[int], reach: float) -> list:
+        """Rectángulos de celdas (x0, x1, y0, y1) al alcance del bounding box de cada pattern"""
+        rects = []
+        for idx in patterns:
+            lat_min, lat_max, lon_min, lon_max = snapshot.pattern_bbox[idx]
+            if np.isnan(lat_min):
+                continue
+            x, y = CITY_METRIC.to_xy(np.array([lat_min, lat_max]), np.array([lon_min, lon_max]))
+            rx0, rx1 = np.floor((np.array([x.min(), x.max()]) + [-reach, reach]) / self.cell_m).astype(np.int64)
+            ry0, ry1 = np.floor((np.array([y.min(), y.max()]) + [-reach, reach]) / self.cell_m).astype(np.int64)
+            rects.append((int(rx0), int(rx1), int(ry0), int(ry1)))
+        return rects
+
+    @staticmethod
+    def _rect_rows(rect, x0: int, y0: int, width: int, height: int) -> np.ndarray:
+        """Filas de la grilla densa dentro del rectángulo (recortado a la grilla)"""
+        rx0, rx1 = max(rect[0], x0), min(rect[1], x0 + width - 1)
+        ry0, ry1 = max(rect[2], y0), min(rect[3], y0 + height - 1)
+        if rx0 > rx1 or ry0 > ry1:
+            return np.zeros(0, dtype=np.int64)
+        xs = np.arange(rx0, rx1 + 1, dtype=np.int64) - x0
+        ys = np.arange(ry0, ry1 + 1, dtype=np.int64) - y0
+        return (xs[:, None] * height + ys[None, :]).reshape(-1)
+
+    # ----- Consultas -----
+
+    def cell_rows(self, lat: float, lon: float) -> slice:
+        """Entradas de la celda que contiene al punto (vacío fuera del raster)"""
+        x, y = CITY_METRIC.to_xy(lat, lon)
+        cx = int(np.floor(x / self.cell_m)) - self.x0
+        cy = int(np.floor(y / self.cell_m)) - self.y0
+        if not (0 <= cx < self.width and 0 <= cy < self.height):
+            return slice(0, 0)
+        row = cx * self.height + cy
+        return slice(self.offsets[row], self.offsets[row + 1])
+
+    def lookup(self, lat: float, lon: float, radius: float) -> NearbyPatterns:
+        """
+        Igual que SegmentGrid.query para `radius` ≤ radius_m: lee la celda y
+        proyecta el punto solo sobre los bloques de segmentos (ver
+        NetworkSnapshot.project) de sus candidatos que pueden estar a `radius`.
+        """
+        snapshot = self.snapshot
+        rows = self.cell_rows(lat, lon)
+        center = self.distance[rows].astype(np.float64)
+        keep = center - self.slack <= radius
+        pattern = self.pattern[rows][keep]
+        # El trazado está a lo sumo a `center + slack` del punto
+        bound = np.minimum(center[keep] + self.slack, radius)
+
+        qx, qy = local_xy(lat, lon, *snapshot.origin)
+        starts = snapshot.block_offsets[pattern]
+        lengths = snapshot.block_offsets[pattern + 1] - starts
+        blocks = _expand_ranges(starts, lengths)
+        owner = np.repeat(np.arange(len(pattern)), lengths)
+        d = np.hypot(snapshot.block_cx[blocks] - qx, snapshot.block_cy[blocks] - qy)
+        near_blocks = d - snapshot.block_r[blocks] <= bound[owner]
+        blocks, owner = blocks[near_blocks], owner[near_blocks]
+
+        seg_starts = snapshot.block_start[blocks]
+        seg_lengths = snapshot.block_end[blocks] - seg_starts
+        segments = _expand_ranges(seg_starts, seg_lengths)
+        owner = np.repeat(owner, seg_lengths)
+        x0, y0 = snapshot.xs[segments], snapshot.ys[segments]
+        dx, dy = snapshot.seg_dx[segments], snapshot.seg_dy[segments]
+        t = np.clip(((qx - x0) * dx + (qy - y0) * dy) * snapshot.seg_inv_len2[segments], 0.0, 1.0)
+        distance = np.hypot(qx - x0 - t * dx, qy - y0 - t * dy)
+
+        near = distance <= radius
+        segments, owner, t, distance = segments[near], owner[near], t[near], distance[near]
+        best = _nearest_per_key(owner, distance)
+        best = best[np.argsort(distance[best], kind="stable")]
+        found = pattern[owner[best]]
+        return NearbyPatterns(found.astype(np.int32),
+                              (segments[best] - snapshot.offsets[found]).astype(np.int32),
+                              t[best], distance[best])
+
+
+def _rasterize(snapshot, cell_x: np.ndarray, cell_y: np.ndarray, cell_m: float, reach: float):
+    """
+    Patterns a menos de `reach` del centro de cada celda (cell_x, cell_y).
+    Devuelve (fila en cell_x, pattern, vértice más cercano, distancia) por
+    entrada. Las celdas se procesan en bloques de RASTER_TILE × RASTER_TILE
+    contra sub-bloques de RASTER_SUBBLOCK segmentos: con el círculo de cada
+    sub-bloque y la distancia a su primer vértice se acota la distancia de
+    cada (celda, pattern), y solo se proyecta sobre los sub-bloques que
+    pueden tener el más cercano, no sobre la matriz densa celdas × segmentos.
+    Las distancias se miden en el plano de CITY_METRIC y no en el del
+    snapshot: una celda da lo mismo en cualquier versión de la red que no
+    haya tocado sus patterns.
+    """
+    rows, patterns, vertices, distances = [], [], [], []
+    sub = _SubBlocks(snapshot)
+    qx_all, qy_all = (cell_x + 0.5) * cell_m, (cell_y + 0.5) * cell_m
+    tiles, tile_of = np.unique(SegmentGrid._key(cell_x // RASTER_TILE, cell_y // RASTER_TILE),
+                               return_inverse=True)
+    tile_of = tile_of.reshape(-1)
+    order = np.argsort(tile_of, kind="stable")
+    bounds = np.searchsorted(tile_of[order], np.arange(len(tiles) + 1))
+
+    for tile in range(len(tiles)):
+        members = order[bounds[tile]:bounds[tile + 1]]
+        qx, qy = qx_all[members], qy_all[members]
+        cx, cy = (qx.min() + qx.max()) / 2, (qy.min() + qy.max()) / 2
+        spread = float(np.hypot(qx - cx, qy - cy).max())
+        # Sub-bloques (ordenados por pattern) que alcanzan alguna celda del tile
+        near = np.nonzero(np.hypot(sub.cx - cx, sub.cy - cy) - sub.r <= spread + reach)[0]
+        if len(near) == 0:
+            continue
+        lower = np.hypot(qx[:, None] - sub.cx[near], qy[:, None] - sub.cy[near]) - sub.r[near]
+        # Cota superior de cada (celda, pattern): su primer vértice de sub-bloque más cercano
+        upper = np.hypot(qx[:, None] - sub.x0[near, 0], qy[:, None] - sub.y0[near, 0])
+        near_pattern = sub.pattern[near]
+        group_start = np.flatnonzero(np.r_[True, near_pattern[1:] != near_pattern[:-1]])
+        upper = np.minimum.reduceat(upper, group_start, axis=1)
+        group_of = np.repeat(np.arange(len(group_start)), np.diff(np.r_[group_start, len(near)]))
+        ci, bi = np.nonzero(lower <= np.minimum(upper[:, group_of], reach))
+        if len(ci) == 0:
+            continue
+
+        # Segmento más cercano de cada (celda, sub-bloque), en distancia al cuadrado
+        blocks = near[bi]
+        dx, dy = sub.dx[blocks], sub.dy[blocks]
+        ex = qx[ci][:, None] - sub.x0[blocks]
+        ey = qy[ci][:, None] - sub.y0[blocks]
+        t = np.clip((ex * dx + ey * dy) * sub.inv_len2[blocks], 0.0, 1.0)
+        ex -= t * dx
+        ey -= t * dy
+        d2 = ex * ex + ey * ey
+        k = d2.argmin(axis=1)
+        pair = np.arange(len(k))
+        d, t, segment = np.sqrt(d2[pair, k]), t[pair, k], sub.segments[blocks, k]
+
+        # Los pares salen ordenados por celda y luego por pattern: el mejor de
+        # cada (celda, pattern) es un mínimo por grupos contiguos
+        pattern = sub.pattern[blocks]
+        key = ci * np.int64(snapshot.num_patterns) + pattern
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        group_min = np.minimum.reduceat(d, starts)
+        group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(key)]))
+        best = np.minimum.reduceat(np.where(d == group_min[group], pair, len(pair)), starts)
+        best = best[group_min <= reach]
+        ci, segment, t, d, pattern = ci[best], segment[best], t[best], d[best], pattern[best]
+        rows.append(members[ci])
+        patterns.append(pattern)
+        vertices.append(segment - snapshot.offsets[pattern] + (t > 0.5))
+        distances.append(d)
+
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0)
+    return (np.concatenate(rows), np.concatenate(patterns),
+            np.concatenate(vertices), np.concatenate(distances))
+
+
+class _SubBlocks:
+    """
+    Segmentos de la red en el plano de CITY_METRIC, agrupados de a
+    RASTER_SUBBLOCK consecutivos del mismo pattern (ordenados por pattern).
+    Cada sub-bloque es una fila de matrices de ancho fijo; el relleno apunta
+    a un segmento degenerado muy lejos que nunca es el más cercano.
+    """
+
+    def __init__(self, snapshot):
+        vx, vy = CITY_METRIC.to_xy(snapshot.lats, snapshot.lons)
+        num_segments = np.maximum(np.diff(snapshot.offsets) - 1, 0)
+        counts = (num_segments + RASTER_SUBBLOCK - 1) // RASTER_SUBBLOCK
+        self.pattern = np.repeat(np.arange(snapshot.num_patterns), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        first = snapshot.offsets[self.pattern] + local * RASTER_SUBBLOCK
+        last = snapshot.offsets[self.pattern] + num_segments[self.pattern]  # último segmento + 1
+
+        segments = first[:, None] + np.arange(RASTER_SUBBLOCK)
+        valid = segments < last[:, None]
+        self.segments = np.where(valid, segments, len(vx))
+        px, py = np.append(vx, 1e12), np.append(vy, 1e12)
+        seg_dx, seg_dy = np.append(np.diff(px), 0.0), np.append(np.diff(py), 0.0)
+        self.x0, self.y0 = px[self.segments], py[self.segments]
+        self.dx, self.dy = seg_dx[self.segments], seg_dy[self.segments]
+        self.dx[~valid] = self.dy[~valid] = 0.0
+        self.inv_len2 = segment_inverse_len2(self.dx, self.dy)
+
+        # Círculo que contiene los vértices de cada sub-bloque
+        x1, y1 = self.x0 + self.dx, self.y0 + self.dy
+        x_min = np.where(valid, np.minimum(self.x0, x1), np.inf).min(axis=1)
+        x_max = np.where(valid, np.maximum(self.x0, x1), -np.inf).max(axis=1)
+        y_min = np.where(valid, np.minimum(self.y0, y1), np.inf).min(axis=1)
+        y_max = np.where(valid, np.maximum(self.y0, y1), -np.inf).max(axis=1)
+        self.cx, self.cy = (x_min + x_max) / 2, (y_min + y_max) / 2
+        self.r = np.hypot(x_max - x_min, y_max - y_min) / 2
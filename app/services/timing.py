@@ -0,0 +1,101 @@
+"""
+Cronómetro por etapas del planificador.
+
+Cada request abre un StageTimer (ver timing_scope) y el código de las etapas
+mide con `with timed("sql.geometry"):` sin pasar el timer de mano en mano.
+Los hilos del pool de búsquedas lo heredan si la tarea se lanza con
+contextvars.copy_context().run. Los totales salen en el header Server-Timing
+y en el bloque `debug` del plan.
+
+Con `trace_memory=True` (benchmarks, con tracemalloc activo) también suma
+los bytes que cada etapa deja asignados al terminar.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+
+class StageTimer:
+    """Acumula milisegundos y cantidad de llamadas por etapa (thread-safe)"""
+
+    def __init__(self, trace_memory: bool = False):
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.totals: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.trace_memory = trace_memory
+        self.allocated: Dict[str, int] = {}
+
+    def add(self, name: str, ms: float) -> None:
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0.0) + ms
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        memory = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000.0)
+            if tracing:
+                # Memoria neta: lo que la etapa asignó y no liberó (incluye sus sub-etapas)
+                delta = tracemalloc.get_traced_memory()[0] - memory
+                with self._lock:
+                    self.allocated[name] = self.allocated.get(name, 0) + delta
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000.0
+
+    def as_dict(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: {"ms": round(ms, 2), "count": self.counts[name]}
+                    for name, ms in self.totals.items()}
+
+    def server_timing(self) -> str:
+        """Valor del header Server-Timing: `etapa;dur=ms` por etapa más el total"""
+        with self._lock:
+            parts = [f"{name};dur={ms:.1f}" for name, ms in self.totals.items()]
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[StageTimer]] = ContextVar("planner_stage_timer", default=None)
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current.get()
+
+
+@contextmanager
+def timing_scope(timer: Optional[StageTimer] = None) -> Iterator[StageTimer]:
+    """
+    Usa el timer activo o abre uno nuevo que se descarta al salir.
+    Se puede pasar el timer a usar (p. ej. uno con trace_memory).
+    """
+    active = _current.get()
+    if active is not None:
+        yield active
+        return
+    timer = timer or StageTimer()
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Mide el bloque en el timer activo (no hace nada si no hay uno)"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
@@ -0,0 +1 @@
+"""Benchmarks reproducibles del planificador (ver bench_planner.py)"""
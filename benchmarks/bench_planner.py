@@ -0,0 +1,267 @@
+"""
+Benchmark del planificador sobre la red sintética (o sobre la base real).
+
+    python -m benchmarks.bench_planner                       # red sintética, sin base
+    python -m benchmarks.bench_planner --lines 120 --queries 500 --trace-memory
+    python -m benchmarks.bench_planner --json base.json      # guardar resultados
+    python -m benchmarks.bench_planner --compare base.json   # comparar con otra corrida
+    python -m benchmarks.bench_planner --live                # DATABASE_URL real
+
+Corre un corpus fijo de pares origen/destino por RoutePlanner (sin cache) y
+reporta latencia p50/p95/p99, queries SQL por request y, por etapa del
+StageTimer, llamadas, milisegundos y memoria neta asignada (--trace-memory).
+
+Sin --live las etapas PostGIS que quedan (sql.stops, sql.direct_routes)
+se responden desde el snapshot sintético con la misma forma de filas; cada
+respuesta cuenta como una query. Así se puede medir en una laptop sin base
+el resto del pipeline (construcción de candidatos, RAPTOR, ranking,
+materialización) y comparar optimizaciones corrida a corrida. Los trazados
+cerca del origen y destino salen siempre del índice espacial del snapshot
+(index.geometry), igual que en producción.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, NamedTuple
+
+# Sin --live no se abre ninguna conexión: basta con una URL válida para Settings
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.services.geometry import local_xy
+from app.services.network_snapshot import get_network_version, set_network_snapshot
+from app.services.query_budget import count_queries, install_query_counter
+from app.services.route_planner import RoutePlanner
+from app.services.timing import StageTimer, timed, timing_scope
+from benchmarks.stats import PERCENTILES, percentiles
+from benchmarks.synthetic_network import generate_network, od_corpus
+
+
+class StopRow(NamedTuple):
+    id_parada: int
+    nombre_parada: str
+    latitud: float
+    longitud: float
+    distance: float
+
+
+class DirectRouteRow(NamedTuple):
+    pattern_id: str
+    nombre_linea: str
+    short_name: str
+    long_name: str
+    color: str
+    text_color: str
+    origin_stop_id: int
+    dest_stop_id: int
+    seq_start: int
+    seq_end: int
+    measure_start: float
+    measure_end: float
+
+
+class SnapshotPlanner(RoutePlanner):
+    """
+    RoutePlanner cuyas queries PostGIS se resuelven sobre el snapshot en
+    memoria, con los mismos filtros, orden y límites que el SQL.
+    """
+
+    def __init__(self, network):
+        super().__init__()
+        self.network = network
+
+    def _find_nearby_stops(self, db, lat, lon, radius=1000, limit=20):
+        network = self.network
+        with timed("sql.stops"):
+            qx, qy = local_xy(lat, lon, *network.origin)
+            distance = np.hypot(network.stop_xs - qx, network.stop_ys - qy)
+            active = np.array([s.activa for s in network.stops], dtype=bool)
+            near = np.nonzero(active & (distance <= radius))[0]
+            near = near[np.argsort(distance[near], kind="stable")][:limit]
+            return [StopRow(network.stops[i].id_parada, network.stops[i].nombre_parada,
+                            network.stops[i].latitud, network.stops[i].longitud, float(distance[i]))
+                    for i in near]
+
+    def _find_direct_routes(self, db, origin_stops, dest_stops):
+        network = self.network
+        origin_ids = {s.id_parada for s in origin_stops}
+        dest_ids = {s.id_parada for s in dest_stops}
+        if not origin_ids or not dest_ids:
+            return []
+        with timed("sql.direct_routes"):
+            rows = []
+            for idx, pattern_id in enumerate(network.pattern_ids):
+                start, end = network.ps_offsets[idx], network.ps_offsets[idx + 1]
+                visits = [(network.stops[s].id_parada, int(seq), float(m)) for s, seq, m in
+                          zip(network.ps_stop[start:end], network.ps_sequence[start:end],
+                              network.ps_measure[start:end])]
+                origins = [v for v in visits if v[0] in origin_ids]
+                dests = [v for v in visits if v[0] in dest_ids]
+                if not origins or not dests:
+                    continue
+                line = network.line_for_pattern(pattern_id)
+                for origin_id, seq_start, measure_start in origins:
+                    for dest_id, seq_end, measure_end in dests:
+                        if seq_start < seq_end:
+                            rows.append(DirectRouteRow(
+                                pattern_id, line.nombre, line.short_name, line.long_name,
+                                line.color, line.text_color, origin_id, dest_id, seq_start, seq_end,
+                                measure_start, measure_end
+                            ))
+            rows.sort(key=lambda r: r.seq_end - r.seq_start)
+            # Mismo post-proceso que la versión SQL: LIMIT 50 y un resultado por pattern
+            seen = set()
+            unique = []
+            for r in rows[:50]:
+                if r.pattern_id not in seen:
+                    seen.add(r.pattern_id)
+                    unique.append(r)
+            return unique[:25]
+
+
+def run(planner: RoutePlanner, db: Session, corpus, repeat: int, warmup: int, trace_memory: bool) -> dict:
+    """Planifica el corpus `repeat` veces y agrega los tiempos por etapa"""
+    install_query_counter()
+    for from_lat, from_lon, to_lat, to_lon in corpus[:warmup]:
+        planner.plan_route(db, from_lat, from_lon, to_lat, to_lon, use_cache=False)
+
+    latencies, queries, itineraries = [], [], []
+    stage_ms: Dict[str, List[float]] = {}
+    stage_calls: Dict[str, int] = {}
+    stage_bytes: Dict[str, int] = {}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            for from_lat, from_lon, to_lat, to_lon in corpus:
+                timer = StageTimer(trace_memory=trace_memory)
+                start = time.perf_counter()
+                with timing_scope(timer), count_queries() as counter:
+                    plan = planner.plan_route(db, from_lat, from_lon, to_lat, to_lon, use_cache=False)
+                latencies.append((time.perf_counter() - start) * 1000.0)
+                itineraries.append(len(plan.itineraries))
+                # Con --live cuenta los statements reales; en la red sintética, las etapas sql.*
+                queries.append(counter.count or sum(
+                    count for name, count in timer.counts.items() if name.startswith("sql.")
+                ))
+                for name, ms in timer.totals.items():
+                    stage_ms.setdefault(name, []).append(ms)
+                    stage_calls[name] = stage_calls.get(name, 0) + timer.counts[name]
+                for name, allocated in timer.allocated.items():
+                    stage_bytes[name] = stage_bytes.get(name, 0) + allocated
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    requests = len(latencies)
+    stages = {}
+    for name in sorted(stage_ms):
+        stages[name] = {
+            "calls_per_request": round(stage_calls[name] / requests, 2),
+            "mean_ms": round(sum(stage_ms[name]) / requests, 3),
+            **percentiles(stage_ms[name]),
+        }
+        if trace_memory:
+            stages[name]["net_kb_per_request"] = round(stage_bytes.get(name, 0) / requests / 1024, 1)
+    return {
+        "requests": requests,
+        "latency_ms": {"mean": round(sum(latencies) / requests, 2), **percentiles(latencies)},
+        "sql_queries_per_request": round(sum(queries) / requests, 2),
+        "itineraries_per_request": round(sum(itineraries) / requests, 2),
+        "stages": stages,
+    }
+
+
+def print_report(results: dict, baseline: dict = None) -> None:
+    def delta(value, base):
+        if base is None or not base:
+            return ""
+        return f" ({(value - base) / base * 100:+.1f}%)"
+
+    latency = results["latency_ms"]
+    base_latency = baseline["latency_ms"] if baseline else {}
+    print(f"\n📊 {results['requests']} requests  |  "
+          f"{results['sql_queries_per_request']} queries SQL/request  |  "
+          f"{results['itineraries_per_request']} itinerarios/request")
+    for key in ("mean",) + tuple(f"p{p}" for p in PERCENTILES):
+        print(f"   {key:>5}: {latency[key]:9.2f} ms{delta(latency[key], base_latency.get(key))}")
+
+    print(f"\n{'etapa':<22}{'llamadas':>10}{'media ms':>11}{'p50':>9}{'p95':>9}{'p99':>9}{'KB neto':>10}")
+    for name, stage in results["stages"].items():
+        kb = stage.get("net_kb_per_request")
+        print(f"{name:<22}{stage['calls_per_request']:>10}{stage['mean_ms']:>11.3f}"
+              f"{stage['p50']:>9.2f}{stage['p95']:>9.2f}{stage['p99']:>9.2f}"
+              f"{'' if kb is None else kb:>10}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de RoutePlanner")
+    parser.add_argument("--lines", type=int, default=60, help="líneas de la red sintética")
+    parser.add_argument("--rings", type=int, default=4, help="cuántas de esas líneas son anillos")
+    parser.add_argument("--ring-spacing", type=float, default=1500.0, help="metros entre anillos")
+    parser.add_argument("--vertices", type=int, default=200, help="vértices por pattern")
+    parser.add_argument("--stop-every", type=int, default=4, help="una parada cada N vértices")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de la red y del corpus")
+    parser.add_argument("--queries", type=int, default=200, help="pares origen/destino del corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="pasadas sobre el corpus")
+    parser.add_argument("--warmup", type=int, default=10, help="requests de calentamiento (no se miden)")
+    parser.add_argument("--trace-memory", action="store_true", help="medir memoria por etapa (más lento)")
+    parser.add_argument("--raster-radius", type=int, default=settings.CANDIDATE_RASTER_RADIUS_M,
+                        help="radio del raster de candidatos (0 = solo la grilla de segmentos)")
+    parser.add_argument("--live", action="store_true", help="usar la base de DATABASE_URL en vez de la red sintética")
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    parser.add_argument("--compare", help="resultados (--json) de otra corrida para comparar")
+    args = parser.parse_args(argv)
+
+    # Búsquedas en el hilo del request: el pool abriría sesiones contra la base
+    settings.PLANNER_SEARCH_WORKERS = 0
+    corpus = od_corpus(args.queries, radius_m=args.ring_spacing * (args.rings + 0.5) * 0.9, seed=args.seed + 1)
+
+    if args.live:
+        from app.database import SessionLocal
+        db = SessionLocal()
+        planner = RoutePlanner()
+        print(f"🔌 Base real, {len(corpus)} pares origen/destino")
+    else:
+        start = time.perf_counter()
+        network = generate_network(args.lines, args.rings, args.vertices, args.stop_every,
+                                   ring_spacing_m=args.ring_spacing, seed=args.seed,
+                                   version=get_network_version())
+        # Igual que load_network_snapshot (con el raster ya terminado): precalcular antes de medir
+        network.transfers
+        if args.raster_radius > 0:
+            network.build_candidate_raster(args.raster_radius, settings.CANDIDATE_RASTER_CELL_M)
+        set_network_snapshot(network)
+        db = Session(bind=create_engine("sqlite://"))
+        planner = SnapshotPlanner(network)
+        print(f"🧪 Red sintética: {args.lines} líneas, {network.num_patterns} patterns, "
+              f"{network.num_vertices} vértices, {len(network.stops)} paradas "
+              f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    try:
+        results = run(planner, db, corpus, args.repeat, args.warmup, args.trace_memory)
+    finally:
+        db.close()
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Benchmark del generador de transbordos a pie sobre la red sintética.
+
+    python -m benchmarks.bench_transfers                     # 160 líneas = 320 patterns
+    python -m benchmarks.bench_transfers --lines 300 --walk 400
+
+Mide por separado la discretización en nodos de abordaje, la pasada completa
+del hash de grilla (la del comando de rebuild y de la carga del snapshot sin
+tabla), el armado de la TransferTable del motor y la pasada incremental de un
+pattern (la de una edición desde el panel de administración).
+
+La pasada completa tiene que entrar en `--budget-ms` (por defecto 5 s para
+los 320 patterns); si no, el comando termina con código 1. Referencia en una
+sola CPU, mediana de 3 pasadas:
+
+    320 patterns x 200 vértices    45472 nodos   360689 transbordos   ~2.0 s
+    320 patterns x 2000 vértices  120704 nodos   824582 transbordos   ~7.3 s
+"""
+import argparse
+import os
+import sys
+import time
+
+# No se abre ninguna conexión: basta con una URL válida para Settings
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np
+
+from app.services.pattern_transfers import (
+    CORRIDOR_M, NODE_SPACING_M, TRANSFER_MAX_WALK_M,
+    compute_transfer_links, sample_boarding_nodes, table_from_links,
+)
+from benchmarks.synthetic_network import generate_network
+
+
+def measure(fn, repeat: int):
+    """(resultado de la última llamada, mediana en ms)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, float(np.median(samples))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de los transbordos a pie")
+    parser.add_argument("--lines", type=int, default=160, help="líneas de la red sintética")
+    parser.add_argument("--rings", type=int, default=4, help="cuántas de esas líneas son anillos")
+    parser.add_argument("--vertices", type=int, default=200, help="vértices por pattern")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de la red")
+    parser.add_argument("--walk", type=float, default=TRANSFER_MAX_WALK_M, help="caminata máxima (m)")
+    parser.add_argument("--spacing", type=float, default=NODE_SPACING_M, help="metros entre nodos de abordaje")
+    parser.add_argument("--corridor", type=float, default=CORRIDOR_M, help="largo del tramo (m)")
+    parser.add_argument("--repeat", type=int, default=3, help="pasadas por etapa (se reporta la mediana)")
+    parser.add_argument("--budget-ms", type=float, default=5000.0,
+                        help="tiempo máximo de la pasada completa (0 = sin límite)")
+    args = parser.parse_args(argv)
+
+    network = generate_network(args.lines, args.rings, args.vertices, seed=args.seed)
+    print(f"🧪 Red sintética: {args.lines} líneas, {network.num_patterns} patterns, "
+          f"{network.num_vertices} vértices")
+
+    nodes, nodes_ms = measure(lambda: sample_boarding_nodes(network, args.spacing), args.repeat)
+    links, full_ms = measure(lambda: compute_transfer_links(
+        network, max_walk_m=args.walk, node_spacing_m=args.spacing, corridor_m=args.corridor), args.repeat)
+    table, table_ms = measure(lambda: table_from_links(network, links), args.repeat)
+    edited = network.num_patterns // 2
+    partial, partial_ms = measure(lambda: compute_transfer_links(
+        network, [edited], max_walk_m=args.walk, node_spacing_m=args.spacing, corridor_m=args.corridor),
+        args.repeat)
+
+    print(f"\n{'etapa':<28}{'ms':>10}  resultado")
+    print(f"{'nodos de abordaje':<28}{nodes_ms:>10.1f}  {len(nodes.pattern)} nodos")
+    print(f"{'transbordos (completo)':<28}{full_ms:>10.1f}  {len(links)} transbordos")
+    print(f"{'TransferTable':<28}{table_ms:>10.1f}  {len(table)} aristas")
+    print(f"{'transbordos (1 pattern)':<28}{partial_ms:>10.1f}  {len(partial)} transbordos")
+
+    if args.budget_ms and full_ms > args.budget_ms:
+        print(f"\n❌ La pasada completa tardó {full_ms:.0f} ms (límite {args.budget_ms:.0f} ms)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
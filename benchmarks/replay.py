@@ -0,0 +1,161 @@
+"""
+Reproduce contra una instancia local el tráfico capturado con REQUEST_CAPTURE_FILE.
+
+    python -m benchmarks.replay captura.jsonl --base-url http://localhost:8000 \\
+        --concurrency 16 --rate 50 --duration 120
+
+Los requests se disparan en el orden del archivo a `--rate` por segundo
+(0 = lo más rápido posible) con a lo sumo `--concurrency` en vuelo, y el
+archivo se recorre en bucle hasta completar `--duration` segundos o
+`--requests` envíos. Con `--speed` se respeta el espaciado original de la
+captura (2 = el doble de rápido) en lugar de una tasa fija.
+
+Reporta throughput, latencia p50/p95/p99 y tasa de errores (5xx y fallos de
+conexión) en total y por ruta. Sirve para dimensionar workers: subir
+--rate hasta que el p95 o los errores se disparen.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.stats import PERCENTILES, percentiles
+
+
+def load_capture(path: str) -> List[dict]:
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+def schedule(entries: List[dict], rate: float, speed: float, repeat: bool):
+    """Genera (segundo de envío, entrada); con `repeat` recorre la captura sin fin"""
+    sent = 0
+    offset = 0.0
+    first_ts = entries[0].get("ts", 0.0)
+    last = 0.0
+    while True:
+        for entry in entries:
+            if speed > 0:
+                at = offset + (entry.get("ts", first_ts) - first_ts) / speed
+            elif rate > 0:
+                at = sent / rate
+            else:
+                at = 0.0
+            last = max(last, at)
+            yield at, entry
+            sent += 1
+        if not repeat:
+            return
+        offset = last + (1.0 / rate if rate > 0 else 0.0)
+
+
+async def replay(entries: List[dict], base_url: str, concurrency: int, rate: float, speed: float,
+                 duration: float, max_requests: int, timeout: float) -> dict:
+    results: Dict[str, List[tuple]] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def send(entry: dict):
+            try:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(
+                        entry["method"], entry["path"], params=entry.get("query") or None,
+                        json=entry.get("body") if entry["method"] == "POST" else None
+                    )
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0  # Timeout o conexión rechazada
+                ms = (time.perf_counter() - start) * 1000.0
+                results.setdefault(entry["path"], []).append((status, ms))
+            finally:
+                semaphore.release()
+
+        tasks = []
+        start = time.perf_counter()
+        repeat = bool(duration or max_requests)
+        for at, entry in schedule(entries, rate, speed, repeat):
+            if (max_requests and len(tasks) >= max_requests) or \
+                    (duration and max(at, time.perf_counter() - start) > duration):
+                break
+            delay = at - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(send(entry)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    def summarize(samples: List[tuple]) -> dict:
+        errors = sum(1 for status, _ in samples if status == 0 or status >= 500)
+        client_errors = sum(1 for status, _ in samples if 400 <= status < 500)
+        return {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+            "client_error_rate": round(client_errors / len(samples), 4) if samples else 0.0,
+            "latency_ms": percentiles(ms for _, ms in samples),
+        }
+
+    all_samples = [sample for samples in results.values() for sample in samples]
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "total": summarize(all_samples),
+        "routes": {path: summarize(samples) for path, samples in sorted(results.items())},
+    }
+
+
+def print_report(results: dict) -> None:
+    header = f"{'ruta':<18}{'requests':>10}{'req/s':>9}{'errores':>9}{'4xx':>7}" + \
+             "".join(f"{'p' + str(p):>10}" for p in PERCENTILES)
+    print(f"\n⏱️  {results['elapsed_s']} s\n")
+    print(header)
+    for name, summary in [("TOTAL", results["total"])] + list(results["routes"].items()):
+        latency = summary["latency_ms"]
+        print(f"{name:<18}{summary['requests']:>10}{summary['throughput_rps']:>9}"
+              f"{summary['error_rate'] * 100:>8.1f}%{summary['client_error_rate'] * 100:>6.1f}%"
+              + "".join(f"{latency[f'p{p}']:>10.1f}" for p in PERCENTILES))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reproduce una captura de requests contra la API")
+    parser.add_argument("capture", help="archivo JSONL de REQUEST_CAPTURE_FILE")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests en vuelo como máximo")
+    parser.add_argument("--rate", type=float, default=0.0, help="requests por segundo (0 = sin límite)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="respetar los tiempos de la captura con este factor (0 = usar --rate)")
+    parser.add_argument("--duration", type=float, default=0.0, help="segundos de prueba (repite la captura)")
+    parser.add_argument("--requests", type=int, default=0, help="cantidad de envíos (repite la captura)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="timeout por request en segundos")
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    entries = load_capture(args.capture)
+    if not entries:
+        print(f"❌ {args.capture} no tiene requests")
+        return 1
+    print(f"🔁 {len(entries)} requests capturados → {args.base_url} "
+          f"(concurrencia {args.concurrency}, {'sin límite' if not args.rate else f'{args.rate} req/s'})")
+    results = asyncio.run(replay(entries, args.base_url, args.concurrency, args.rate, args.speed,
+                                 args.duration, args.requests, args.timeout))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+"""Percentiles para los reportes de los benchmarks (sin dependencias)"""
+from typing import Dict, Iterable, Sequence
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """Percentil con interpolación lineal (igual que numpy.percentile por defecto)"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def percentiles(values: Iterable[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {f"p{p}": round(float(percentile(ordered, p)), 2) for p in PERCENTILES}
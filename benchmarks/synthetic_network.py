@@ -0,0 +1,128 @@
+"""
+Red de transporte sintética y determinista para benchmarks y tests.
+
+Imita la forma de Santa Cruz: anillos concéntricos alrededor de la plaza
+24 de Septiembre y líneas radiales que cruzan el centro de un extremo de la
+ciudad al otro. Cada línea tiene un pattern de ida y uno de vuelta (el mismo
+trazado al revés) con paradas cada `stop_every` vértices.
+
+Con la misma semilla se obtiene siempre la misma red y el mismo corpus de
+pares origen/destino, así los números de dos corridas son comparables.
+"""
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+from app.services.geometry import local_latlon
+from app.services.network_snapshot import LineInfo, NetworkSnapshot, StopInfo
+
+CENTER = (-17.7833, -63.1821)  # Plaza 24 de Septiembre
+
+
+def _ring(radius: float, n: int) -> np.ndarray:
+    """Círculo de `n` vértices (x, y en metros) sin repetir el primero al final"""
+    angles = np.linspace(0.0, 2 * math.pi, n, endpoint=False)
+    return np.column_stack([radius * np.cos(angles), radius * np.sin(angles)])
+
+
+def _radial(rng: np.random.Generator, angle: float, radius: float, n: int) -> np.ndarray:
+    """Línea que entra por `angle`, pasa cerca del centro y sale por el lado opuesto"""
+    exit_angle = angle + math.pi + rng.uniform(-0.5, 0.5)
+    offset = rng.uniform(-400.0, 400.0)
+    start = radius * np.array([math.cos(angle), math.sin(angle)])
+    middle = offset * np.array([-math.sin(angle), math.cos(angle)])
+    end = radius * np.array([math.cos(exit_angle), math.sin(exit_angle)])
+    half = n // 2
+    first = np.linspace(start, middle, half, endpoint=False)
+    second = np.linspace(middle, end, n - half)
+    return np.vstack([first, second])
+
+
+def generate_network(
+    num_lines: int = 60,
+    num_rings: int = 4,
+    vertices_per_pattern: int = 200,
+    stop_every: int = 4,
+    ring_spacing_m: float = 1500.0,
+    jitter_m: float = 10.0,
+    seed: int = 0,
+    version: int = 0
+) -> NetworkSnapshot:
+    """
+    Construye el snapshot: las primeras `num_rings` líneas son anillos (rutas
+    circulares de radio ring_spacing_m, 2·ring_spacing_m, ...) y el resto
+    radiales repartidas en ángulo. `jitter_m` desplaza los vértices para que
+    los trazados no sean perfectamente regulares.
+    """
+    if num_lines < 1 or vertices_per_pattern < 3 or stop_every < 1:
+        raise ValueError("Se necesita al menos una línea, 3 vértices por pattern y stop_every >= 1")
+    num_rings = min(num_rings, num_lines)
+    num_radials = num_lines - num_rings
+    outer_radius = ring_spacing_m * (num_rings + 0.5)
+    rng = np.random.default_rng(seed)
+
+    lines, patterns, stops, pattern_stops = [], [], [], []
+    for i in range(num_lines):
+        id_linea = i + 1
+        if i < num_rings:
+            xy = _ring(ring_spacing_m * (i + 1), vertices_per_pattern)
+            long_name = f"Línea {id_linea} ({i + 1}er anillo)"
+        else:
+            angle = 2 * math.pi * (i - num_rings) / num_radials + rng.uniform(-0.15, 0.15)
+            xy = _radial(rng, angle, outer_radius, vertices_per_pattern)
+            long_name = f"Línea {id_linea} (radial)"
+        xy = xy + rng.normal(0.0, jitter_m, xy.shape)
+        lats, lons = local_latlon(xy[:, 0], xy[:, 1], *CENTER)
+        coords = list(zip(np.round(lats, 6).tolist(), np.round(lons, 6).tolist()))
+
+        color = "%06X" % int(rng.integers(0, 0xFFFFFF))
+        lines.append(LineInfo(id_linea, f"L{id_linea}", str(id_linea), long_name, color, "FFFFFF", True))
+
+        # Paradas sobre los vértices de la ida; la vuelta las recorre al revés.
+        # Sin measure_m: el snapshot las proyecta sobre el trazado al construirse
+        stop_vertices = list(range(0, vertices_per_pattern, stop_every))
+        stop_ids = []
+        for v in stop_vertices:
+            id_parada = len(stops) + 1
+            lat, lon = coords[v]
+            stops.append(StopInfo(id_parada, f"L{id_linea} parada {len(stop_ids) + 1}", lat, lon, True))
+            stop_ids.append(id_parada)
+
+        for sentido, pattern_coords, pattern_stop_ids in (
+            ("ida", coords, stop_ids),
+            ("vuelta", coords[::-1], stop_ids[::-1]),
+        ):
+            pattern_id = f"synthetic:{id_linea}:{sentido}"
+            patterns.append((pattern_id, id_linea, sentido, pattern_coords))
+            pattern_stops.extend(
+                (pattern_id, id_parada, sequence, None)
+                for sequence, id_parada in enumerate(pattern_stop_ids, start=1)
+            )
+
+    return NetworkSnapshot(version, lines, patterns, stops, pattern_stops)
+
+
+def od_corpus(
+    num_queries: int = 200,
+    radius_m: float = 6000.0,
+    min_distance_m: float = 1000.0,
+    seed: int = 1
+) -> List[Tuple[float, float, float, float]]:
+    """
+    Pares (from_lat, from_lon, to_lat, to_lon) repartidos uniformemente en un
+    círculo de `radius_m` alrededor del centro, a más de `min_distance_m`
+    entre sí (los viajes más cortos se resuelven a pie).
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    while len(corpus) < num_queries:
+        r = radius_m * np.sqrt(rng.uniform(0.0, 1.0, 2))
+        angle = rng.uniform(0.0, 2 * math.pi, 2)
+        x, y = r * np.cos(angle), r * np.sin(angle)
+        if math.hypot(x[1] - x[0], y[1] - y[0]) < min_distance_m:
+            continue
+        lats, lons = local_latlon(x, y, *CENTER)
+        corpus.append((round(float(lats[0]), 6), round(float(lons[0]), 6),
+                       round(float(lats[1]), 6), round(float(lons[1]), 6)))
+    return corpus
@@ -0,0 +1,20 @@
+-- Transbordos precalculados entre patterns
+-- Se llena con: python scripts/rebuild_pattern_transfers.py
+
+CREATE TABLE IF NOT EXISTS transporte.pattern_transfers (
+    id SERIAL PRIMARY KEY,
+    from_pattern_id VARCHAR(50) NOT NULL,
+    to_pattern_id VARCHAR(50) NOT NULL,
+    from_vertex INTEGER NOT NULL,
+    to_vertex INTEGER NOT NULL,
+    from_lat DOUBLE PRECISION NOT NULL,
+    from_lon DOUBLE PRECISION NOT NULL,
+    to_lat DOUBLE PRECISION NOT NULL,
+    to_lon DOUBLE PRECISION NOT NULL,
+    walk_m DOUBLE PRECISION NOT NULL,
+    CONSTRAINT fk_transfer_from FOREIGN KEY (from_pattern_id) REFERENCES transporte.patterns(id) ON DELETE CASCADE,
+    CONSTRAINT fk_transfer_to FOREIGN KEY (to_pattern_id) REFERENCES transporte.patterns(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_pattern_transfers_from ON transporte.pattern_transfers(from_pattern_id);
+CREATE INDEX IF NOT EXISTS idx_pattern_transfers_to ON transporte.pattern_transfers(to_pattern_id);
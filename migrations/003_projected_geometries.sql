@@ -0,0 +1,72 @@
+-- Geometrías proyectadas en UTM 20S (EPSG:32720, metros) con índice GiST
+--
+-- Las consultas por distancia hacían geom::geography en cada fila: el cast
+-- impide usar los índices GiST de geom/geometry y obliga a calcular la
+-- distancia geodésica fila por fila. Santa Cruz entra en la zona UTM 20S
+-- (error de escala < 0.1%), así que ST_DWithin/ST_Distance sobre estas
+-- columnas trabajan en metros y usan el índice.
+--
+-- Las columnas las mantienen triggers a partir de geom/geometry (o de
+-- latitud/longitud en las paradas creadas sin geom).
+-- Ejecutar con: psql "$DATABASE_URL" -f migrations/003_projected_geometries.sql
+
+-- 1. Columnas
+ALTER TABLE transporte.paradas ADD COLUMN IF NOT EXISTS geom_utm geometry(POINT, 32720);
+ALTER TABLE transporte.points_of_interest ADD COLUMN IF NOT EXISTS geom_utm geometry(POINT, 32720);
+ALTER TABLE transporte.patterns ADD COLUMN IF NOT EXISTS geometry_utm geometry(LINESTRING, 32720);
+
+-- 2. Triggers de sincronización
+CREATE OR REPLACE FUNCTION transporte.sync_parada_geom_utm() RETURNS trigger AS $$
+BEGIN
+    NEW.geom_utm := ST_Transform(
+        COALESCE(NEW.geom, ST_SetSRID(ST_MakePoint(NEW.longitud::float8, NEW.latitud::float8), 4326)),
+        32720
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transporte.sync_poi_geom_utm() RETURNS trigger AS $$
+BEGIN
+    NEW.geom_utm := ST_Transform(NEW.geom, 32720);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transporte.sync_pattern_geometry_utm() RETURNS trigger AS $$
+BEGIN
+    NEW.geometry_utm := ST_Transform(NEW.geometry, 32720);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_paradas_geom_utm ON transporte.paradas;
+CREATE TRIGGER trg_paradas_geom_utm
+    BEFORE INSERT OR UPDATE OF geom, latitud, longitud ON transporte.paradas
+    FOR EACH ROW EXECUTE FUNCTION transporte.sync_parada_geom_utm();
+
+DROP TRIGGER IF EXISTS trg_points_of_interest_geom_utm ON transporte.points_of_interest;
+CREATE TRIGGER trg_points_of_interest_geom_utm
+    BEFORE INSERT OR UPDATE OF geom ON transporte.points_of_interest
+    FOR EACH ROW EXECUTE FUNCTION transporte.sync_poi_geom_utm();
+
+DROP TRIGGER IF EXISTS trg_patterns_geometry_utm ON transporte.patterns;
+CREATE TRIGGER trg_patterns_geometry_utm
+    BEFORE INSERT OR UPDATE OF geometry ON transporte.patterns
+    FOR EACH ROW EXECUTE FUNCTION transporte.sync_pattern_geometry_utm();
+
+-- 3. Datos existentes
+UPDATE transporte.paradas SET geom_utm = ST_Transform(
+    COALESCE(geom, ST_SetSRID(ST_MakePoint(longitud::float8, latitud::float8), 4326)), 32720
+);
+UPDATE transporte.points_of_interest SET geom_utm = ST_Transform(geom, 32720) WHERE geom IS NOT NULL;
+UPDATE transporte.patterns SET geometry_utm = ST_Transform(geometry, 32720) WHERE geometry IS NOT NULL;
+
+-- 4. Índices
+CREATE INDEX IF NOT EXISTS idx_paradas_geom_utm ON transporte.paradas USING GIST(geom_utm);
+CREATE INDEX IF NOT EXISTS idx_points_of_interest_geom_utm ON transporte.points_of_interest USING GIST(geom_utm);
+CREATE INDEX IF NOT EXISTS idx_patterns_geometry_utm ON transporte.patterns USING GIST(geometry_utm);
+
+ANALYZE transporte.paradas;
+ANALYZE transporte.points_of_interest;
+ANALYZE transporte.patterns;
@@ -0,0 +1,16 @@
+-- Transbordos entre nodos de abordaje virtuales (medida lineal sobre el pattern)
+--
+-- Los nodos de abordaje ya no son vértices del trazado sino posiciones cada
+-- ~100 m de recorrido. from_measure/to_measure guardan los metros desde el
+-- inicio de cada pattern; from_vertex/to_vertex quedan como el primer vértice
+-- en o después del nodo.
+--
+-- Las filas anteriores no tienen medida: se borran y el snapshot calcula los
+-- transbordos en memoria hasta regenerarlos con
+-- python scripts/rebuild_pattern_transfers.py
+-- Ejecutar con: psql "$DATABASE_URL" -f migrations/004_transfer_measures.sql
+
+ALTER TABLE transporte.pattern_transfers ADD COLUMN IF NOT EXISTS from_measure DOUBLE PRECISION;
+ALTER TABLE transporte.pattern_transfers ADD COLUMN IF NOT EXISTS to_measure DOUBLE PRECISION;
+
+DELETE FROM transporte.pattern_transfers WHERE from_measure IS NULL OR to_measure IS NULL;
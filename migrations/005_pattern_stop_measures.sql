@@ -0,0 +1,25 @@
+-- Medida lineal de cada parada sobre su pattern
+--
+-- measure_m: metros desde el inicio del trazado hasta la proyección de la
+-- parada (ST_LineLocatePoint sobre geometry_utm). vertex_index: primer
+-- vértice del trazado (desde 0) en o después de esa posición. Con ambas el
+-- tramo entre dos paradas se corta sin recorrer la geometría y su largo es
+-- la resta de medidas, no la distancia en línea recta.
+--
+-- app/crud/pattern.py las recalcula al cargar las paradas de un pattern o
+-- al cambiar su trazado.
+-- Ejecutar con: psql "$DATABASE_URL" -f migrations/005_pattern_stop_measures.sql
+
+ALTER TABLE transporte.pattern_stops ADD COLUMN IF NOT EXISTS measure_m DOUBLE PRECISION;
+ALTER TABLE transporte.pattern_stops ADD COLUMN IF NOT EXISTS vertex_index INTEGER;
+
+UPDATE transporte.pattern_stops ps
+SET measure_m = loc.fraction * ST_Length(p.geometry_utm),
+    vertex_index = CASE WHEN loc.fraction = 0 THEN 0
+                        ELSE ST_NumPoints(ST_LineSubstring(p.geometry_utm, 0, loc.fraction)) - 1 END
+FROM transporte.patterns p,
+     transporte.paradas s,
+     LATERAL (SELECT ST_LineLocatePoint(p.geometry_utm, s.geom_utm) AS fraction) loc
+WHERE ps.pattern_id = p.id
+AND ps.id_parada = s.id_parada
+AND p.geometry_utm IS NOT NULL;
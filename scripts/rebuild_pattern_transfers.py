@@ -0,0 +1,31 @@
+"""
+Regenera la tabla transporte.pattern_transfers (transbordos precalculados).
+
+Ejecutar después de importar o scrapear rutas:
+    python scripts/rebuild_pattern_transfers.py
+
+Los workers en ejecución la leen al recargar el snapshot de la red
+(reinicio o siguiente edición desde el panel de administración).
+"""
+import sys
+import time
+from pathlib import Path
+
+# Agregar root al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.database import Base, SessionLocal, engine
+from app.models import PatternTransfer
+from app.services.pattern_transfers import rebuild_transfer_table
+
+print("🔧 Creando tabla transporte.pattern_transfers (si no existe)...")
+Base.metadata.create_all(bind=engine, tables=[PatternTransfer.__table__])
+
+db = SessionLocal()
+try:
+    print("🔄 Calculando transbordos entre patterns...")
+    start = time.time()
+    count = rebuild_transfer_table(db)
+    print(f"✅ {count} transbordos guardados en {time.time() - start:.1f}s")
+finally:
+    db.close()
@@ -0,0 +1,44 @@
+"""Tests de las utilidades geométricas vectorizadas"""
+import numpy as np
+
+from app.services.geometry import CITY_CENTER, CITY_METRIC, haversine_np, project_to_polyline
+
+
+def test_projection_lands_on_segment_not_vertex():
+    # Trazado este-oeste con vértices cada ~1 km; el punto está al norte del medio del segundo tramo
+    lats = [-17.78, -17.78, -17.78]
+    lons = [-63.20, -63.19, -63.18]
+    proj = project_to_polyline(lats, lons, -17.779, -63.185)
+
+    assert proj.segment.tolist() == [1]
+    assert abs(proj.fraction[0] - 0.5) < 1e-6
+    assert abs(proj.lat[0] + 17.78) < 1e-9
+    assert abs(proj.lon[0] + 63.185) < 1e-9
+    assert abs(proj.distance[0] - haversine_np(-17.779, -63.185, -17.78, -63.185)) < 0.5
+
+
+def test_projection_of_many_points_at_once():
+    lats = [-17.78, -17.78, -17.77]
+    lons = [-63.20, -63.19, -63.19]
+    proj = project_to_polyline(lats, lons, [-17.781, -17.775, -17.76], [-63.21, -63.189, -63.19])
+
+    assert proj.segment.tolist() == [0, 1, 1]
+    assert proj.fraction.tolist()[0] == 0.0  # antes del inicio: se ajusta al primer vértice
+    assert proj.fraction.tolist()[2] == 1.0  # después del final: último vértice
+    assert np.all(proj.distance >= 0)
+
+
+def test_city_metric_matches_haversine_across_the_city():
+    # Pares al azar en ±0.25° del centro (más que el área urbana de Santa Cruz)
+    rng = np.random.default_rng(0)
+    lat1, lat2 = CITY_CENTER[0] + rng.uniform(-0.25, 0.25, (2, 5000))
+    lon1, lon2 = CITY_CENTER[1] + rng.uniform(-0.25, 0.25, (2, 5000))
+    exact = haversine_np(lat1, lon1, lat2, lon2)
+    planar = CITY_METRIC.distance_np(lat1, lon1, lat2, lon2)
+    far = exact > 100
+    assert np.max(np.abs(planar[far] - exact[far]) / exact[far]) < 0.005
+    assert abs(CITY_METRIC.distance(lat1[0], lon1[0], lat2[0], lon2[0]) - planar[0]) < 1e-6
+
+    x, y = CITY_METRIC.to_xy(lat1, lon1)
+    back_lat, back_lon = CITY_METRIC.to_latlon(x, y)
+    assert np.allclose(back_lat, lat1) and np.allclose(back_lon, lon1)
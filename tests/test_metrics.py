@@ -0,0 +1,44 @@
+"""Tests del registro de métricas en formato Prometheus"""
+import asyncio
+
+from app.services.metrics import Counter, Gauge, Histogram, MetricsMiddleware, Registry, HTTP_REQUESTS
+
+
+def test_text_exposition_format():
+    registry = Registry()
+    hits = registry.register(Counter("cache_requests_total", "Consultas", ("cache", "result")))
+    latency = registry.register(Histogram("stage_seconds", "Etapas", ("stage",), buckets=(0.1, 1.0)))
+    pool = registry.register(Gauge("pool_connections", "Pool", ("state",)))
+
+    hits.inc(cache="plan", result="hit")
+    hits.inc(2, cache="plan", result="hit")
+    latency.observe(0.05, stage="sql.geometry")
+    latency.observe(0.1, stage="sql.geometry")
+    latency.observe(3.0, stage="sql.geometry")
+    pool.set_function(lambda: 4, state="checkedout")
+
+    text = registry.render()
+    assert "# TYPE cache_requests_total counter" in text
+    assert 'cache_requests_total{cache="plan",result="hit"} 3' in text
+    assert 'stage_seconds_bucket{stage="sql.geometry",le="0.1"} 2' in text
+    assert 'stage_seconds_bucket{stage="sql.geometry",le="1"} 2' in text
+    assert 'stage_seconds_bucket{stage="sql.geometry",le="+Inf"} 3' in text
+    assert 'stage_seconds_count{stage="sql.geometry"} 3' in text
+    assert 'pool_connections{state="checkedout"} 4' in text
+
+
+def test_middleware_labels_by_route_template():
+    class Route:
+        path = "/api/v1/plan"
+
+    async def app(scope, receive, send):
+        scope["route"] = Route()
+        await send({"type": "http.response.start", "status": 200})
+
+    async def send(message):
+        pass
+
+    before = HTTP_REQUESTS.value(method="GET", route="/api/v1/plan", status="200")
+    scope = {"type": "http", "method": "GET", "path": "/api/v1/plan"}
+    asyncio.run(MetricsMiddleware(app)(scope, None, send))
+    assert HTTP_REQUESTS.value(method="GET", route="/api/v1/plan", status="200") == before + 1
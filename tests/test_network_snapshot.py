@@ -0,0 +1,193 @@
+"""Tests del snapshot en memoria de la red (no requieren base de datos)"""
+import threading
+
+import numpy as np
+
+from app.services import network_snapshot
+from app.services.geometry import project_to_polyline
+from app.services.network_snapshot import NetworkSnapshot, LineInfo, StopInfo
+
+
+def build_snapshot():
+    lines = [
+        LineInfo(1, "15", "15", "Línea 15", "FF0000", "FFFFFF", True),
+        LineInfo(2, "27", "27", "Línea 27", "00FF00", "000000", False),
+    ]
+    patterns = [
+        ("pattern:1:ida", 1, "ida", [(-17.78, -63.18), (-17.79, -63.18), (-17.80, -63.18)]),
+        ("pattern:2:ida", 2, "ida", [(-17.70, -63.10), (-17.71, -63.11), (-17.72, -63.12), (-17.73, -63.13)]),
+        ("pattern:3:ida", 99, "ida", []),
+    ]
+    stops = [
+        StopInfo(10, "Parada A", -17.78, -63.18, True),
+        StopInfo(11, "Parada B", -17.80, -63.18, True),
+    ]
+    pattern_stops = [
+        ("pattern:1:ida", 11, 2, None),  # sin medida: se proyecta en memoria
+        ("pattern:1:ida", 10, 1, 0.0),
+        ("pattern:9:ida", 10, 1, None),  # pattern inexistente: se ignora
+    ]
+    return NetworkSnapshot(3, lines, patterns, stops, pattern_stops)
+
+
+def test_coordinates_are_contiguous():
+    snapshot = build_snapshot()
+    assert snapshot.num_patterns == 3
+    assert snapshot.num_vertices == 7
+    assert snapshot.lats.flags["C_CONTIGUOUS"]
+    assert list(snapshot.offsets) == [0, 3, 7, 7]
+
+    lats, lons = snapshot.pattern_arrays(1)
+    assert lats.base is not None  # vista, no copia
+    assert lats.tolist() == [-17.70, -17.71, -17.72, -17.73]
+
+
+def test_pattern_coords_and_line_metadata():
+    snapshot = build_snapshot()
+    assert snapshot.pattern_coords("pattern:1:ida") == [(-17.78, -63.18), (-17.79, -63.18), (-17.80, -63.18)]
+    assert snapshot.pattern_coords("pattern:3:ida") == []
+    assert snapshot.pattern_coords("no-existe") == []
+
+    assert snapshot.line_for_pattern("pattern:2:ida").color == "00FF00"
+    assert snapshot.line_for_pattern("pattern:3:ida") is None
+    assert snapshot.line_activa.tolist() == [True, False]
+
+
+def test_stops_and_pattern_stops():
+    snapshot = build_snapshot()
+    stop = snapshot.stop(11)
+    assert stop.nombre_parada == "Parada B"
+    assert stop.latitud == -17.80
+    assert snapshot.stop(999) is None
+    assert snapshot.pattern_stop_ids("pattern:1:ida") == [10, 11]
+    assert snapshot.pattern_stop_ids("pattern:2:ida") == []
+
+
+def test_stop_measures_along_the_pattern():
+    snapshot = build_snapshot()
+    assert snapshot.stop_measure(0, 1) == 0.0
+    assert np.isclose(snapshot.stop_measure(0, 2), snapshot.pattern_length[0])
+    assert snapshot.stop_measure(0, 3) is None
+    assert snapshot.stop_measure(1, 1) is None
+
+
+def test_locate_matches_searching_each_pattern():
+    snapshot = build_snapshot()
+    patterns = np.array([1, 0, 1, 0, 1])
+    measures = np.array([0.0, 1500.0, 1200.0, 1e9, -5.0])
+    vertex, lat, lon = snapshot.locate(patterns, measures)
+
+    for p, m, v in zip(patterns, measures, vertex):
+        cum = snapshot.pattern_cum_dist(p)
+        assert v == np.searchsorted(cum, np.clip(m, 0.0, cum[-1]), side="left")
+    assert np.isclose(lat[3], -17.80) and np.isclose(lon[3], -63.18)
+    assert np.isclose(lat[4], -17.70) and np.isclose(lon[4], -63.10)
+
+
+def test_project_matches_brute_force():
+    rng = np.random.default_rng(7)
+    heading = np.cumsum(rng.normal(0, 0.1, 500))
+    lats = -17.8 + np.cumsum(0.0002 * np.sin(heading))
+    lons = -63.18 + np.cumsum(0.0002 * np.cos(heading))
+    lines = [LineInfo(1, "15", "15", "Línea 15", "FF0000", "FFFFFF", True)]
+    snapshot = NetworkSnapshot(0, lines, [("pattern:1:ida", 1, "ida", list(zip(lats, lons)))], [], [])
+
+    q_lats = lats[rng.integers(0, 500, 50)] + rng.normal(0, 0.003, 50)
+    q_lons = lons[rng.integers(0, 500, 50)] + rng.normal(0, 0.003, 50)
+    fast = snapshot.project(0, q_lats, q_lons)
+    brute = project_to_polyline(lats, lons, q_lats, q_lons)
+    assert np.allclose(fast.distance, brute.distance, rtol=0.01, atol=0.5)
+
+
+def test_loop_metadata_and_ride_distance():
+    lines = [LineInfo(1, "15", "15", "Línea 15", "FF0000", "FFFFFF", True)]
+    # Circuito de ~4 km que cierra a ~110 m del inicio, y una recta
+    square = ([(-17.78, -63.18 + i * 0.001) for i in range(10)] +
+              [(-17.78 + i * 0.001, -63.171) for i in range(10)] +
+              [(-17.771, -63.171 - i * 0.001) for i in range(10)] +
+              [(-17.771 - i * 0.001, -63.18) for i in range(9)])
+    line_coords = [(-17.70, -63.10 - i * 0.001) for i in range(20)]
+    snapshot = NetworkSnapshot(0, lines, [
+        ("pattern:1:ida", 1, "ida", square),
+        ("pattern:1:vuelta", 1, "vuelta", line_coords),
+    ], [], [])
+
+    assert snapshot.pattern_is_loop.tolist() == [True, False]
+    length = snapshot.pattern_length[0]
+    assert abs(length - snapshot.pattern_cum_dist(0)[-1]) < 1e-9
+
+    assert snapshot.ride_distance(0, 100.0, 600.0) == 500.0
+    wrapped = snapshot.ride_distance(0, length - 50.0, 200.0)
+    assert abs(wrapped - (250.0 + snapshot.pattern_closing_m[0])) < 1e-6
+    assert snapshot.ride_distance(1, 600.0, 100.0) is None
+
+
+class FakeSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_failed_load_rolls_back_and_waits_before_retrying(monkeypatch):
+    calls = []
+
+    def failing_load(db, version=0):
+        calls.append(version)
+        raise RuntimeError("column measure_m does not exist")
+
+    monkeypatch.setattr(NetworkSnapshot, "load", failing_load)
+    monkeypatch.setattr(network_snapshot.settings, "SNAPSHOT_RETRY_SECONDS", 60)
+    network_snapshot.set_network_snapshot(None)
+    network_snapshot.invalidate_network_snapshot()
+    db = FakeSession()
+    try:
+        assert network_snapshot.get_network_snapshot(db) is None
+        assert network_snapshot.get_network_snapshot(db) is None
+        assert len(calls) == 1 and db.rollbacks == 1
+
+        monkeypatch.setattr(network_snapshot.settings, "SNAPSHOT_RETRY_SECONDS", 0)
+        assert network_snapshot.get_network_snapshot(db) is None
+        assert len(calls) == 2
+    finally:
+        network_snapshot.invalidate_network_snapshot()
+
+
+def test_stale_snapshot_is_served_while_reloading(monkeypatch):
+    release = threading.Event()
+    fresh = build_snapshot()
+
+    def slow_load(db, version=0):
+        release.wait(5)
+        fresh.version = version
+        return fresh
+
+    def reload_without_database():
+        network_snapshot.load_network_snapshot(FakeSession())
+        with network_snapshot._lock:
+            network_snapshot._reloading = False
+
+    monkeypatch.setattr(NetworkSnapshot, "load", slow_load)
+    monkeypatch.setattr(network_snapshot, "_reload_in_background", reload_without_database)
+    monkeypatch.setattr(network_snapshot.settings, "CANDIDATE_RASTER_RADIUS_M", 0)
+    stale = build_snapshot()
+    stale.version = network_snapshot.get_network_version()
+    network_snapshot.set_network_snapshot(stale)
+    network_snapshot.invalidate_network_snapshot()
+    try:
+        assert network_snapshot.get_network_snapshot(FakeSession()) is stale
+        assert network_snapshot.serving_stale_snapshot()
+        # Otro request durante la carga no queda esperando ni lanza otra
+        assert network_snapshot.get_network_snapshot(FakeSession()) is stale
+
+        release.set()
+        for _ in range(100):
+            if network_snapshot.get_network_snapshot() is fresh:
+                break
+            threading.Event().wait(0.05)
+        assert network_snapshot.get_network_snapshot() is fresh
+        assert not network_snapshot.serving_stale_snapshot()
+    finally:
+        release.set()
+        network_snapshot.set_network_snapshot(None)
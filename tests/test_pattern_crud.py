@@ -0,0 +1,46 @@
+"""
+Transbordos incrementales al crear o editar patterns desde el panel.
+Necesita la base de prueba con PostGIS (ver conftest.py); todo se descarta
+al terminar el test.
+"""
+from sqlalchemy import text
+
+from app.crud.pattern import crud_pattern
+from app.models import Line
+from app.schemas.pattern import PatternCreate
+from app.services.pattern_transfers import rebuild_transfer_table
+
+
+def create_pattern(db, nombre, coords):
+    line = Line(nombre=nombre, short_name=nombre, activa=True)
+    db.add(line)
+    db.flush()
+    return crud_pattern.create(db, PatternCreate(
+        name=f"Línea {nombre} - Ida", sentido="ida", id_linea=line.id_linea,
+        geometry_geojson={"type": "LineString", "coordinates": coords},
+    ))
+
+
+def transfers_of(db, pattern_id):
+    return db.execute(text("""
+        SELECT
+            COUNT(*) FILTER (WHERE from_pattern_id = :pattern_id) AS outgoing,
+            COUNT(*) FILTER (WHERE to_pattern_id = :pattern_id) AS incoming
+        FROM transporte.pattern_transfers
+    """), {"pattern_id": pattern_id}).one()
+
+
+def test_created_pattern_gets_transfers_when_the_table_is_in_use(db):
+    # Lejos de la ciudad para no cruzarse con datos cargados en la base
+    east_west = [[-63.300 + i * 0.001, -18.500] for i in range(20)]
+    north_south = [[-63.290, -18.510 + i * 0.001] for i in range(20)]
+    create_pattern(db, "test-eo", east_west)
+    create_pattern(db, "test-ns", north_south)
+    assert rebuild_transfer_table(db) > 0
+
+    parallel = [[lon, lat + 0.001] for lon, lat in east_west]
+    created = create_pattern(db, "test-paralela", parallel)
+
+    assert created.geometry is not None
+    outgoing, incoming = transfers_of(db, created.id)
+    assert outgoing > 0 and incoming > 0
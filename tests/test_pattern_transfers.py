@@ -0,0 +1,47 @@
+"""Tests del generador de transbordos a pie (hash de grilla sobre nodos de abordaje)"""
+import numpy as np
+
+from app.services.geometry import local_xy
+from app.services.pattern_transfers import compute_transfer_links, sample_boarding_nodes
+from benchmarks.synthetic_network import generate_network
+
+
+def brute_force(network, max_walk_m, corridor_m):
+    """Mejor transbordo por (pattern origen, pattern destino, tramo) comparando todos los nodos"""
+    nodes = sample_boarding_nodes(network)
+    x, y = local_xy(nodes.lat, nodes.lon, *network.origin)
+    distance = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    line = network.pattern_line[nodes.pattern]
+    a, b = np.nonzero((distance <= max_walk_m) & (line[:, None] != line[None, :]))
+    best = {}
+    for i, j in zip(a.tolist(), b.tolist()):
+        key = (int(nodes.pattern[i]), int(nodes.pattern[j]), int(nodes.measure[i] // corridor_m))
+        best[key] = min(best.get(key, np.inf), float(distance[i, j]))
+    return best
+
+
+def as_dict(links, corridor_m):
+    return {
+        (p, q, int(m // corridor_m)): w
+        for p, m, q, w in zip(links.from_pattern.tolist(), links.from_measure.tolist(),
+                              links.to_pattern.tolist(), links.walk_m.tolist())
+    }
+
+
+def test_grid_hash_matches_comparing_every_node():
+    network = generate_network(num_lines=10, num_rings=3, vertices_per_pattern=60, seed=3)
+    links = compute_transfer_links(network, max_walk_m=400, corridor_m=1000)
+
+    found = as_dict(links, 1000)
+    expected = brute_force(network, 400, 1000)
+    assert len(found) == len(links), "un solo transbordo por par de patterns y tramo"
+    assert found.keys() == expected.keys()
+    assert np.allclose([found[k] for k in expected], list(expected.values()))
+
+
+def test_incremental_pass_covers_links_of_the_edited_pattern():
+    network = generate_network(num_lines=10, num_rings=3, vertices_per_pattern=60, seed=3)
+    full = as_dict(compute_transfer_links(network), 1000)
+    partial = as_dict(compute_transfer_links(network, [5]), 1000)
+
+    assert partial == {k: w for k, w in full.items() if 5 in (k[0], k[1])}
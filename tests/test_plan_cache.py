@@ -0,0 +1,64 @@
+"""Tests del cache de planes (no requieren base de datos)"""
+import time
+
+from app.schemas.otp_schemas import ItinerarySchema, LegSchema, PlaceSchema, PlanSchema
+from app.services.network_snapshot import invalidate_network_snapshot
+from app.services.plan_cache import PlanCache, grid_cell, retime_plan
+
+
+def build_plan(date_ms=1_000_000):
+    walk = LegSchema(mode="WALK", startTime=date_ms, endTime=date_ms + 60_000, duration=60, distance=80,
+                     from_=PlaceSchema(name="Origin", lat=-17.7800, lon=-63.1800),
+                     to=PlaceSchema(name="Parada A", lat=-17.7805, lon=-63.1800))
+    bus = LegSchema(mode="BUS", startTime=date_ms + 60_000, endTime=date_ms + 600_000, duration=540,
+                    distance=4000, transitLeg=True,
+                    from_=PlaceSchema(name="Parada A", lat=-17.7805, lon=-63.1800),
+                    to=PlaceSchema(name="Destination", lat=-17.8100, lon=-63.1800))
+    itinerary = ItinerarySchema(legs=[walk, bus], startTime=date_ms, endTime=date_ms + 600_000,
+                                duration=600, walkTime=60, walkDistance=80, transfers=0)
+    return PlanSchema(itineraries=[itinerary], date=date_ms,
+                      from_=PlaceSchema(name="Origin", lat=-17.7800, lon=-63.1800),
+                      to=PlaceSchema(name="Destination", lat=-17.8100, lon=-63.1800))
+
+
+def test_nearby_points_share_a_cell():
+    assert grid_cell(-17.78001, -63.18001, 50) == grid_cell(-17.78010, -63.18010, 50)
+    assert grid_cell(-17.7800, -63.1800, 50) != grid_cell(-17.7810, -63.1800, 50)
+
+
+def test_roundtrip_and_lru_eviction():
+    cache = PlanCache(max_entries=2, ttl_seconds=60, cell_m=50)
+    key = cache.make_key(-17.78, -63.18, -17.81, -63.18, 10, 1500.0, 3)
+    cache.put(key, build_plan())
+    cached = cache.get(key)
+    assert cached.itineraries[0].legs[1].to.name == "Destination"
+    assert cache.make_key(-17.78, -63.18, -17.81, -63.18, 5, 1500.0, 3) != key
+
+    cache.put("b", build_plan())
+    cache.get(key)  # key pasa a ser la más reciente
+    cache.put("c", build_plan())
+    assert cache.get("b") is None
+    assert cache.get(key) is not None
+    assert len(cache) == 2
+
+
+def test_ttl_and_network_version():
+    cache = PlanCache(max_entries=10, ttl_seconds=0.01, cell_m=50)
+    cache.put("a", build_plan())
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+    cache = PlanCache(max_entries=10, ttl_seconds=60, cell_m=50)
+    cache.put("a", build_plan())
+    invalidate_network_snapshot()
+    assert cache.get("a") is None
+
+
+def test_retime_shifts_times_and_walk_endpoints():
+    plan = retime_plan(build_plan(1_000_000), 5_000_000, -17.78002, -63.18003, -17.81001, -63.18002)
+    itinerary = plan.itineraries[0]
+    assert plan.date == 5_000_000
+    assert itinerary.startTime == 5_000_000
+    assert itinerary.legs[1].endTime == 5_600_000
+    assert itinerary.legs[0].from_.lat == -17.78002
+    assert plan.to.lon == -63.18002
@@ -0,0 +1,36 @@
+"""Tests de la codificación de polylines pre-calculada por pattern"""
+import numpy as np
+
+from app.services.polyline import PatternPolyline, VertexRange, encode_pieces, encode_polyline
+
+
+def sample_coords(n=200):
+    rng = np.random.default_rng(3)
+    lats = -17.78 + np.cumsum(rng.normal(0, 0.0004, n))
+    lons = -63.18 + np.cumsum(rng.normal(0, 0.0004, n))
+    return lats, lons
+
+
+def test_encode_polyline_known_value():
+    # Ejemplo de la documentación de Google
+    assert encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_slices_match_full_encoding():
+    lats, lons = sample_coords()
+    coords = list(zip(lats.tolist(), lons.tolist()))
+    polyline = PatternPolyline(lats, lons)
+
+    for i, j in [(0, 199), (5, 6), (17, 150), (42, 42)]:
+        assert polyline.encode_slice(i, j) == encode_polyline(coords[i:j + 1])
+
+
+def test_pieces_with_projected_points_and_wrap_around():
+    lats, lons = sample_coords()
+    coords = list(zip(lats.tolist(), lons.tolist()))
+    polyline = PatternPolyline(lats, lons)
+    board, alight = (-17.7791, -63.1802), (-17.7755, -63.1833)
+
+    pieces = [[board], VertexRange(polyline, 180, 199), VertexRange(polyline, 0, 10), [alight]]
+    expected = [board] + coords[180:] + coords[:11] + [alight]
+    assert encode_pieces(pieces) == encode_polyline(expected)
@@ -0,0 +1,45 @@
+"""Tests del conteo de queries SQL por request y los presupuestos por endpoint"""
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.config import settings
+from app.services.query_budget import QUERY_BUDGETS, count_queries, install_query_counter
+
+
+def test_counter_is_scoped_and_follows_copied_context():
+    install_query_counter()
+    engine = create_engine("sqlite://")
+
+    def query():
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    query()  # Fuera de un scope no se cuenta
+    with count_queries(keep=1) as counter, ThreadPoolExecutor(max_workers=1) as pool:
+        query()
+        query()
+        pool.submit(copy_context().run, query).result()
+        pool.submit(query).result()  # Sin el contexto no hay contador
+    assert counter.count == 3
+    assert counter.statements == ["SELECT 1"]
+
+
+@pytest.fixture
+def query_headers(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_DEBUG_HEADERS", True)
+    monkeypatch.setattr(settings, "PLAN_CACHE_ENABLED", False)
+
+
+@pytest.mark.parametrize("url, route", [
+    ("/api/v1/plan?fromPlace=-17.7833,-63.1821&toPlace=-17.7512,-63.1755", "/api/v1/plan"),
+    ("/api/v1/patterns/", "/api/v1/patterns/"),
+])
+def test_endpoints_stay_within_query_budget(client, query_headers, url, route):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert int(response.headers["x-query-budget"]) == QUERY_BUDGETS[route]
+    assert int(response.headers["x-query-count"]) <= QUERY_BUDGETS[route], \
+        f"{route} emitió {response.headers['x-query-count']} queries (presupuesto {QUERY_BUDGETS[route]})"
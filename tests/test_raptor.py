@@ -0,0 +1,112 @@
+"""Tests del motor de búsqueda por rondas (RAPTOR) sobre una red sintética"""
+import numpy as np
+
+from app.services.network_snapshot import NetworkSnapshot, LineInfo
+from app.services.pattern_transfers import compute_transfer_links, sample_boarding_nodes, table_from_links
+from app.services.raptor import RaptorParams, RaptorSearch
+
+
+def straight(lat0, lon0, lat1, lon1, n=60):
+    return list(zip(np.linspace(lat0, lat1, n).tolist(), np.linspace(lon0, lon1, n).tolist()))
+
+
+def staircase_network_patterns():
+    return [
+        ("pattern:1:ida", 1, "ida", straight(-17.80, -63.20, -17.80, -63.17)),
+        ("pattern:2:ida", 2, "ida", straight(-17.80, -63.17, -17.77, -63.17)),
+        ("pattern:3:ida", 3, "ida", straight(-17.77, -63.17, -17.77, -63.14)),
+        ("pattern:4:ida", 4, "ida", straight(-17.77, -63.14, -17.74, -63.14)),
+    ]
+
+
+def staircase_network():
+    """Cuatro líneas en escalera: A (este) → B (norte) → C (este) → D (norte)"""
+    lines = [LineInfo(i, name, name, f"Línea {name}", "0088FF", "FFFFFF", True)
+             for i, name in enumerate(["A", "B", "C", "D"], start=1)]
+    return NetworkSnapshot(0, lines, staircase_network_patterns(), [], [])
+
+
+def params(max_transfers):
+    return RaptorParams(walk_speed=70, bus_speed=333, wait_s=300,
+                        access_radius_m=300, max_transfers=max_transfers)
+
+
+def test_three_transfers_found_in_one_pass():
+    search = RaptorSearch(staircase_network())
+    journeys = search.search(-17.8003, -63.1995, -17.7405, -63.1397, params(3))
+
+    assert journeys, "debería encontrar la ruta con 4 micros"
+    best = journeys[0]
+    assert best.transfers == 3
+    assert [leg.pattern_idx for leg in best.legs] == [0, 1, 2, 3]
+    for leg in best.legs:
+        assert leg.board_at.measure < leg.alight_at.measure
+        assert leg.board_vertex <= leg.alight_vertex
+    assert len(best.walks) == 5
+    assert all(w <= 500 for w in best.walks[1:-1])
+
+
+def test_max_transfers_bounds_the_rounds():
+    search = RaptorSearch(staircase_network())
+    assert search.search(-17.8003, -63.1995, -17.7405, -63.1397, params(2)) == []
+
+
+def test_transfer_walk_limit_and_early_stop_prune_rounds():
+    search = RaptorSearch(staircase_network())
+    no_walk = params(3)
+    no_walk.max_transfer_walk_m = -1.0
+    assert search.search(-17.8003, -63.1995, -17.7405, -63.1397, no_walk) == []
+    assert search.search(-17.8003, -63.1995, -17.7405, -63.1397, params(3), should_stop=lambda: True) == []
+
+
+def test_direct_trip_and_min_transfers():
+    search = RaptorSearch(staircase_network())
+    journeys = search.search(-17.8003, -63.1995, -17.8003, -63.1705, params(3))
+    assert journeys[0].transfers == 0
+
+    only_transfers = search.search(-17.8003, -63.1995, -17.8003, -63.1705, params(3), min_transfers=1)
+    assert all(j.transfers >= 1 for j in only_transfers)
+
+
+def test_incremental_links_match_full_pass():
+    snapshot = staircase_network()
+    full = compute_transfer_links(snapshot)
+    partial = compute_transfer_links(snapshot, [1])
+
+    def touching(links, p):
+        rows = zip(links.from_pattern.tolist(), links.from_measure.tolist(),
+                   links.to_pattern.tolist(), links.to_measure.tolist())
+        return sorted(r for r in rows if p in (r[0], r[2]))
+
+    assert touching(partial, 1) == touching(full, 1)
+    assert touching(full, 1), "B debería conectar con A y C"
+
+
+def test_transfer_rows_round_trip():
+    snapshot = staircase_network()
+    links = compute_transfer_links(snapshot)
+    rows = [(snapshot.pattern_ids[p], fm, snapshot.pattern_ids[q], tm, w)
+            for p, fm, q, tm, w in zip(*(c.tolist() for c in links))]
+    rows.append(("pattern:borrado", 0.0, "pattern:1:ida", 0.0, 10.0))  # pattern eliminado: se ignora
+    rows.append(("pattern:1:ida", 1e6, "pattern:2:ida", 0.0, 10.0))  # medida fuera del trazado
+
+    restored = NetworkSnapshot(0, snapshot.lines, staircase_network_patterns(), [], [], transfer_rows=rows)
+    assert len(restored.transfers) == len(table_from_links(snapshot, links))
+    journeys = RaptorSearch(restored).search(-17.8003, -63.1995, -17.7405, -63.1397, params(3))
+    assert journeys[0].transfers == 3
+
+
+def test_boarding_nodes_are_evenly_spaced_along_long_segments():
+    lines = [LineInfo(1, "A", "A", "Línea A", "0088FF", "FFFFFF", True)]
+    # Un solo segmento de ~3,2 km: antes daba solo dos nodos (los vértices)
+    snapshot = NetworkSnapshot(0, lines, [("pattern:1:ida", 1, "ida", [(-17.80, -63.20), (-17.80, -63.17)])], [], [])
+    nodes = sample_boarding_nodes(snapshot, 100.0)
+
+    length = float(snapshot.pattern_length[0])
+    assert len(nodes.measure) == int(np.ceil(length / 100.0)) + 1
+    assert np.allclose(np.diff(nodes.measure)[:-1], 100.0)
+    assert nodes.measure[-1] == length
+    # Cada nodo queda sobre el trazado, a la distancia que indica su medida
+    assert np.allclose(nodes.lat, -17.80)
+    assert np.all(np.diff(nodes.lon) > 0)
+    assert set(nodes.vertex.tolist()) <= {0, 1}
@@ -0,0 +1,89 @@
+"""Tests de la captura anonimizada de requests"""
+import asyncio
+import json
+
+from app.services.request_capture import (
+    RequestCapture, RequestCaptureMiddleware, anonymize_body, anonymize_query, should_capture
+)
+
+
+def test_coordinates_are_rounded_and_other_params_kept():
+    query = anonymize_query([("fromPlace", "-17.783312,-63.182145"), ("toPlace", "-17.75,-63.1757"),
+                             ("numItineraries", "5"), ("q", "Plaza 24")], precision=3)
+    assert query == [["fromPlace", "-17.783,-63.182"], ["toPlace", "-17.750,-63.176"],
+                     ["numItineraries", "5"], ["q", "Plaza 24"]]
+
+
+def test_graphql_body_keeps_query_and_rounds_variables():
+    body = json.dumps({"query": "query($id: String!) { pattern(id: $id) { name } }",
+                       "variables": {"id": "12", "lat": -17.783312, "point": ["-17.783312"]},
+                       "extensions": {"secret": "x"}}).encode()
+    assert anonymize_body(body, precision=3) == {
+        "query": "query($id: String!) { pattern(id: $id) { name } }",
+        "variables": {"id": "12", "lat": -17.783, "point": ["-17.783"]},
+    }
+    assert anonymize_body(b"not json", precision=3) is None
+    assert anonymize_body(b'{"password": "x"}', precision=3) is None
+
+
+def test_only_planner_search_and_graphql_are_captured():
+    assert should_capture("/api/v1/plan")
+    assert should_capture("/api")
+    assert should_capture("/graphql/")
+    assert not should_capture("/api/v1/auth/login")
+    assert not should_capture("/apis")
+
+
+def test_middleware_writes_one_line_per_request(tmp_path):
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    capture = RequestCapture(str(tmp_path / "capture.jsonl"), precision=2)
+    middleware = RequestCaptureMiddleware(app, capture)
+    for path in ("/api/v1/plan", "/api/v1/auth/login"):
+        scope = {"type": "http", "method": "GET", "path": path,
+                 "query_string": b"fromPlace=-17.7833,-63.1821&toPlace=-17.7512,-63.1755",
+                 "headers": [(b"authorization", b"Bearer x")]}
+        asyncio.run(middleware(scope, receive, send))
+    capture.close()
+
+    lines = (tmp_path / "capture.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry["path"] == "/api/v1/plan" and entry["status"] == 200
+    assert entry["query"][0] == ["fromPlace", "-17.78,-63.18"]
+    assert "headers" not in entry
+
+
+def test_capture_failures_are_logged_without_breaking_the_request(tmp_path, caplog):
+    sent = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def send(message):
+        sent.append(message)
+
+    def broken_record(*args):
+        raise OSError("disk full")
+
+    capture = RequestCapture(str(tmp_path / "capture.jsonl"))
+    capture.record = broken_record
+    scope = {"type": "http", "method": "GET", "path": "/api/v1/plan", "query_string": b""}
+    with caplog.at_level("ERROR", logger="app.services.request_capture"):
+        asyncio.run(RequestCaptureMiddleware(app, capture)(scope, None, send))
+    capture.close()
+
+    assert [m["type"] for m in sent] == ["http.response.start", "http.response.body"]
+    record, = caplog.records
+    assert record.getMessage() == "request_capture_failed path=/api/v1/plan"
+    assert record.exc_info is not None
@@ -0,0 +1,192 @@
+"""Tests del ranking de candidatos del planificador (sin base de datos)"""
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from app.config import settings
+from app.services import route_planner
+from app.services.metrics import PLANNER_SEARCH_SEQUENTIAL, PLANNER_SEARCH_TIMEOUTS
+from app.services.route_planner import (
+    Candidate, CandidateRanking, LegPlan, PlanDeadline, PlanLimits, RoutePlanner, SearchPool, StageController,
+    generalized_cost, parse_modes, plan_budget_ms, search_workers, transfer_cost_lower_bound
+)
+
+
+def make_candidate(walk_m, bus_m, buses=1):
+    legs = [LegPlan("WALK", int(walk_m / 70 * 60), walk_m, (0, 0, "Origin"), (0, 0, "Bus boarding"))]
+    for _ in range(buses):
+        legs.append(LegPlan("BUS", int(bus_m / 333 * 60), bus_m, (0, 0, "a"), (0, 0, "b"), wait=300))
+    return Candidate(legs)
+
+
+def test_candidate_totals():
+    c = make_candidate(700, 3330, buses=2)
+    assert c.transfers == 1
+    assert c.walk_distance == 700
+    assert c.transit_time == 1200
+    assert c.waiting_time == 600
+    assert c.duration == 600 + 1200 + 600
+
+
+def test_ranking_matches_full_sort_and_walk_filter():
+    rng = random.Random(11)
+    candidates = [make_candidate(rng.uniform(50, 3000), rng.uniform(500, 8000), rng.randint(1, 3))
+                  for _ in range(300)]
+    cost = lambda c: generalized_cost(c, 4000)
+
+    ranking = CandidateRanking(5, cost, keep=lambda c: c.walk_distance < 2000)
+    for c in candidates:
+        ranking.push(c)
+
+    ordered = sorted(candidates, key=cost)  # Implementación anterior: ordenar todo
+    assert ranking.best()[:5] == ordered[:5]
+    expected = [c for i, c in enumerate(ordered) if c.walk_distance < 2000 or i < 3][:5]
+    assert ranking.best_filtered(keep_first=3) == expected
+    assert len(ranking) == 300
+
+
+def fake_planner(monkeypatch, geometry, stops, transfers):
+    planner = RoutePlanner()
+    calls = []
+
+    def search(name, result):
+        def run(db, *args):
+            calls.append(name)
+            return result
+        return run
+
+    monkeypatch.setattr(planner, "_geometry_candidates", search("geometry", geometry))
+    monkeypatch.setattr(planner, "_stop_candidates", search("stops", stops))
+    monkeypatch.setattr(planner, "_transfer_candidates", lambda *args: transfers)
+    monkeypatch.setattr(RoutePlanner, "_in_own_session", staticmethod(lambda deadline, search, *args: search(None, *args)))
+    return planner, calls
+
+
+def make_stages(num_itineraries=5, direct_distance=4000):
+    limits = PlanLimits.for_request(direct_distance, 1500, num_itineraries, 3)
+    ranking = CandidateRanking(num_itineraries, lambda c: generalized_cost(c, direct_distance),
+                               keep=lambda c: c.walk_distance < 2000)
+    return StageController(ranking, direct_distance, limits)
+
+
+def test_concurrent_search_matches_sequential(monkeypatch):
+    geometry = [make_candidate(300, 4000)]
+    stops = [make_candidate(500, 3000)]
+    transfers = [make_candidate(200, 2000, buses=2)]
+    planner, _ = fake_planner(monkeypatch, geometry, stops, transfers)
+
+    sequential, concurrent = make_stages(), make_stages()
+    planner._search_sequentially(None, None, 0, 0, 1, 1, sequential.limits, PlanDeadline(10_000), sequential)
+    planner._search_concurrently(None, 0, 0, 1, 1, concurrent.limits, PlanDeadline(10_000), concurrent)
+    assert sequential.ranking.best() == concurrent.ranking.best()
+    assert len(concurrent.ranking) == 3
+
+
+def test_concurrent_search_drops_stops_when_geometry_is_enough(monkeypatch):
+    geometry = [make_candidate(300, 4000 + i) for i in range(5)]
+    planner, _ = fake_planner(monkeypatch, geometry, [make_candidate(500, 3000)], [])
+
+    stages = make_stages()
+    planner._search_concurrently(None, 0, 0, 1, 1, stages.limits, PlanDeadline(10_000), stages)
+    assert stages.ranking.best() == sorted(geometry, key=stages.ranking.cost)
+    assert "stops" in stages.skipped
+
+
+def test_concurrent_search_returns_partial_results_when_budget_runs_out(monkeypatch):
+    planner, _ = fake_planner(monkeypatch, [make_candidate(300, 4000)], [], [])
+    deadline = PlanDeadline(50)
+
+    def slow_stops(db, *args):
+        time.sleep(0.5)
+        return [make_candidate(500, 3000)]
+
+    monkeypatch.setattr(planner, "_stop_candidates", slow_stops)
+    timeouts = PLANNER_SEARCH_TIMEOUTS.value(stage="stops", state="running")
+    stages = make_stages()
+    planner._search_concurrently(None, 0, 0, 1, 1, stages.limits, deadline, stages)
+    assert len(stages.ranking) == 1
+    assert deadline.truncated
+    assert PLANNER_SEARCH_TIMEOUTS.value(stage="stops", state="running") == timeouts + 1
+
+
+def test_busy_search_pool_falls_back_to_sequential(monkeypatch):
+    planner, calls = fake_planner(monkeypatch, [make_candidate(300, 4000)], [], [])
+    pool = SearchPool(3)
+    assert pool.reserve(2)  # Otro request ya ocupa dos hilos
+    monkeypatch.setattr(route_planner, "_search_pool", pool)
+    fallbacks = PLANNER_SEARCH_SEQUENTIAL.value()
+
+    stages = make_stages()
+    assert not planner._search_concurrently(None, 0, 0, 1, 1, stages.limits, PlanDeadline(10_000), stages)
+    assert calls == [] and len(stages.ranking) == 0
+    assert PLANNER_SEARCH_SEQUENTIAL.value() == fallbacks + 1
+
+
+def test_search_workers_leave_connections_for_the_requests():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=3, max_overflow=2)
+    assert search_workers(engine, 4) == 2
+    assert search_workers(create_engine("sqlite://", poolclass=QueuePool, pool_size=10), 4) == 4
+
+
+def test_transfer_rounds_skipped_when_they_cannot_beat_top_k():
+    stages = make_stages()
+    assert stages.useful_transfers() == 3  # Sin candidatos todavía no se poda nada
+
+    direct = [make_candidate(100, 4000) for _ in range(5)]
+    stages.add("geometry", direct)
+    assert stages.ranking.cutoff() < transfer_cost_lower_bound(4000, 1)
+    assert stages.useful_transfers() == 0
+    assert stages.skipped == ["transfers>0"]
+
+    # La cota nunca supera el costo real de un itinerario con transbordo
+    transfer = make_candidate(0, 4000, buses=2)
+    assert transfer_cost_lower_bound(4000, 1) <= generalized_cost(transfer, 4000)
+
+
+def test_budget_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "PLANNER_BUDGET_MS", 4000)
+    monkeypatch.setattr(settings, "PLANNER_MAX_BUDGET_MS", 10000)
+    assert plan_budget_ms() == 4000
+    assert plan_budget_ms(1500) == 1500
+    assert plan_budget_ms(60_000) == 10000
+
+
+def test_limits_follow_max_walk_and_mode():
+    default = PlanLimits.for_request(8000, 5000, 5, 3)
+    assert (default.geometry_radius, default.stop_radius) == (2500, 3000)
+    assert default.max_walk_for(0) == 1200
+    assert default.max_walk_for(3) == 600
+
+    short = PlanLimits.for_request(8000, 390, 5, 3, parse_modes("WALK,BUS"))
+    assert short.geometry_radius == short.stop_radius == 300
+    assert short.max_walk_for(0) == short.max_walk_for(1) == 390
+    assert short.transit
+
+    assert not PlanLimits.for_request(8000, 1500, 5, 3, parse_modes("walk")).transit
+    assert parse_modes("") is None
+
+
+def test_direct_leg_is_sliced_between_the_stops():
+    from benchmarks.synthetic_network import generate_network
+    network = generate_network(num_lines=4, num_rings=1, vertices_per_pattern=40, stop_every=4, seed=5)
+    idx = network.pattern_index["synthetic:3:ida"]
+    cum = network.pattern_cum_dist(idx)
+    lats, lons = network.pattern_arrays(idx)
+
+    # Paradas 2 y 5 de la ida: vértices 4 y 16
+    pieces, distance = RoutePlanner._stop_to_stop_pieces(network, idx, 2, 5)
+    assert abs(distance - (cum[16] - cum[4])) < 0.01
+    (board,), vertices, (alight,) = pieces
+    assert abs(board[0] - lats[4]) < 1e-6 and abs(alight[1] - lons[16]) < 1e-6
+    assert 4 <= vertices.first and vertices.last <= 16 and len(vertices) >= 11
+
+    # Al revés solo es posible en una ruta circular, dando la vuelta por el final
+    assert RoutePlanner._stop_to_stop_pieces(network, idx, 5, 2) is None
+    ring = network.pattern_index["synthetic:1:ida"]
+    pieces, distance = RoutePlanner._stop_to_stop_pieces(network, ring, 5, 2)
+    assert network.pattern_is_loop[ring]
+    assert distance > network.pattern_length[ring] / 2
+    assert len(pieces) == 4
+    assert pieces[1].last == len(network.polyline(ring)) - 1 and pieces[2].first == 0
@@ -0,0 +1,48 @@
+"""Tests del registro de queries lentas por fingerprint"""
+from sqlalchemy import create_engine, text
+
+from app.services.slow_queries import SlowQueryLog, fingerprint
+
+
+def test_fingerprint_ignores_values_comments_and_whitespace():
+    a = fingerprint("SELECT * FROM transporte.paradas\n  WHERE id_parada = 12 AND nombre_parada = 'Plaza' -- x")
+    b = fingerprint("SELECT *   FROM transporte.paradas WHERE id_parada = 9 AND nombre_parada = 'O''Brien'")
+    assert a == b == "SELECT * FROM transporte.paradas WHERE id_parada = ? AND nombre_parada = ?"
+
+    assert fingerprint("SELECT id FROM t WHERE id IN (%(id_1)s, %(id_2)s, %(id_3)s)") == \
+        fingerprint("SELECT id FROM t WHERE id IN (:a, :b)") == "SELECT id FROM t WHERE id IN (?...)"
+    # Los casts de Postgres y los identificadores con dígitos no se tocan
+    assert fingerprint("SELECT geom::geography FROM ps1 LIMIT 50") == "SELECT geom::geography FROM ps1 LIMIT ?"
+
+
+def test_stats_are_aggregated_and_bounded():
+    log = SlowQueryLog(threshold_ms=100, max_fingerprints=2)
+    log.record("SELECT 1 FROM a WHERE x = 1", 50)
+    log.record("SELECT 1 FROM a WHERE x = 2", 150)
+    log.record("SELECT 1 FROM b", 300)
+    log.record("SELECT 1 FROM c", 10)  # Menos que todos: no desplaza a nadie
+    log.record("SELECT 1 FROM d", 400)  # Desplaza al de menor tiempo total (a)
+
+    top = log.top()
+    assert [q["fingerprint"] for q in top] == ["SELECT ? FROM d", "SELECT ? FROM b"]
+    assert top[0]["slow_count"] == 1
+
+    log = SlowQueryLog(threshold_ms=100)
+    log.record("SELECT 1 FROM a WHERE x = 1", 50)
+    log.record("SELECT 1 FROM a WHERE x = 2", 150)
+    stats = log.top()[0]
+    assert (stats["count"], stats["slow_count"], stats["total_ms"], stats["max_ms"]) == (2, 1, 200, 150)
+    log.reset()
+    assert log.top() == []
+
+
+def test_engine_statements_are_recorded():
+    engine = create_engine("sqlite://")
+    log = SlowQueryLog(threshold_ms=0)
+    log.install(engine)
+    with engine.connect() as connection:
+        for value in range(3):
+            connection.execute(text("SELECT :value"), {"value": value})
+    stats = log.top()[0]
+    assert stats["fingerprint"] == "SELECT ?"
+    assert stats["count"] == 3
@@ -0,0 +1,143 @@
+"""Tests del índice espacial de segmentos y de /api/v1/lines/nearby"""
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.services import spatial_index
+from app.services.geometry import local_xy
+from app.services.network_snapshot import (
+    LineInfo, NetworkSnapshot, get_network_version, set_network_snapshot
+)
+from app.services.spatial_index import CandidateRaster
+from benchmarks.synthetic_network import generate_network, od_corpus
+
+
+def brute_force(network, lat, lon, radius):
+    """Distancia al trazado completo de cada pattern, proyectando uno por uno"""
+    found = {}
+    for idx in range(network.num_patterns):
+        if network.offsets[idx + 1] - network.offsets[idx] < 2:
+            continue
+        projection = network.project(idx, [lat], [lon])
+        if projection.distance[0] <= radius:
+            found[idx] = (int(projection.segment[0]), float(projection.distance[0]))
+    return found
+
+
+def test_patterns_within_matches_projecting_every_pattern():
+    network = generate_network(num_lines=12, num_rings=3, vertices_per_pattern=80, seed=1)
+    for lat, lon, _, _ in od_corpus(40, seed=2):
+        for radius in (50, 300, 1200):
+            near = network.patterns_within(lat, lon, radius)
+            expected = brute_force(network, lat, lon, radius)
+            assert sorted(near.pattern.tolist()) == sorted(expected)
+            assert np.all(np.diff(near.distance) >= 0)
+            for idx, segment, distance in zip(near.pattern, near.segment, near.distance):
+                assert distance == pytest.approx(expected[idx][1], abs=1e-6)
+                assert segment == expected[idx][0]
+
+
+def test_long_segments_are_found_from_any_cell():
+    lines = [LineInfo(1, "15", "15", "Línea 15", "FF0000", "FFFFFF", True)]
+    # Un solo segmento de ~5.5 km: atraviesa más de 20 celdas de la grilla
+    patterns = [("pattern:1:ida", 1, "ida", [(-17.80, -63.20), (-17.75, -63.20)]),
+                ("pattern:2:ida", 1, "ida", [])]
+    network = NetworkSnapshot(0, lines, patterns, [], [])
+
+    near = network.patterns_within(-17.775, -63.199, 200)
+    assert near.pattern.tolist() == [0]
+    assert near.segment.tolist() == [0]
+    assert near.fraction[0] == pytest.approx(0.5, abs=0.01)
+    assert near.distance[0] == pytest.approx(106, abs=2)
+    assert len(network.patterns_within(-17.775, -63.19, 200).pattern) == 0
+
+
+def network_patterns(network):
+    """Patterns del snapshot en el formato del constructor (para editarlos)"""
+    return [(pattern_id, network.lines[network.pattern_line[i]].id_linea, network.pattern_sentidos[i],
+             list(zip(*(a.tolist() for a in network.pattern_arrays(i)))))
+            for i, pattern_id in enumerate(network.pattern_ids)]
+
+
+def raster_cells(raster):
+    """{(cx, cy): {pattern_id: distancia}} de las celdas no vacías"""
+    cells = {}
+    for row in np.nonzero(np.diff(raster.offsets))[0]:
+        rows = slice(raster.offsets[row], raster.offsets[row + 1])
+        cell = (raster.x0 + row // raster.height, raster.y0 + row % raster.height)
+        cells[cell] = {raster.snapshot.pattern_ids[p]: float(d)
+                       for p, d in zip(raster.pattern[rows], raster.distance[rows])}
+    return cells
+
+
+def test_raster_lookup_matches_segment_grid():
+    network = generate_network(num_lines=12, num_rings=3, vertices_per_pattern=80, seed=1)
+    raster = network.build_candidate_raster(radius_m=800, cell_m=100)
+    assert len(raster) > 0
+    for lat, lon, _, _ in od_corpus(40, seed=3):
+        qx, qy = local_xy(lat, lon, *network.origin)
+        for radius in (100, 400, 800):
+            expected = network.segment_index.query(float(qx), float(qy), radius)
+            found = network.patterns_within(lat, lon, radius)
+            assert sorted(found.pattern.tolist()) == sorted(expected.pattern.tolist())
+            assert np.allclose(found.distance, expected.distance)
+
+    # Fuera del área rasterizada no hay candidatos
+    assert len(network.patterns_within(-18.5, -63.18, 800).pattern) == 0
+
+
+def test_refresh_recomputes_only_cells_near_edited_patterns(monkeypatch):
+    old = generate_network(num_lines=10, num_rings=2, vertices_per_pattern=60, seed=4)
+    old.build_candidate_raster(600, 100)
+    patterns = network_patterns(old)
+    # Se corre ~210 m al este el radial norte-sur y se borra el este-oeste (los anillos tocan todo)
+    pattern_id, id_linea, sentido, coords = patterns[8]
+    patterns[8] = (pattern_id, id_linea, sentido, [(lat, lon + 0.002) for lat, lon in coords])
+    del patterns[4]
+    new = NetworkSnapshot(1, old.lines, patterns, [], [])
+
+    rasterized = []
+    rasterize = spatial_index._rasterize
+
+    def counting_rasterize(snapshot, cell_x, *args):
+        rasterized.append(len(cell_x))
+        return rasterize(snapshot, cell_x, *args)
+
+    monkeypatch.setattr(spatial_index, "_rasterize", counting_rasterize)
+    refreshed = new.build_candidate_raster(600, 100, previous=old)
+    full = CandidateRaster.build(new, 600, 100)
+    assert rasterized[0] < rasterized[1] == full.width * full.height
+
+    refreshed_cells, full_cells = raster_cells(refreshed), raster_cells(full)
+    assert refreshed_cells.keys() == full_cells.keys()
+    for cell, expected in full_cells.items():
+        assert refreshed_cells[cell].keys() == expected.keys()
+        for pattern_id, distance in expected.items():
+            assert refreshed_cells[cell][pattern_id] == pytest.approx(distance, abs=1e-3)
+
+
+@pytest.fixture
+def synthetic_snapshot(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_DEBUG_HEADERS", True)
+    network = generate_network(num_lines=10, num_rings=2, vertices_per_pattern=60,
+                               seed=5, version=get_network_version())
+    set_network_snapshot(network)
+    yield network
+    set_network_snapshot(None)
+
+
+def test_nearby_lines_endpoint_uses_the_index(client, synthetic_snapshot):
+    lat, lon = synthetic_snapshot.lats[30], synthetic_snapshot.lons[30]
+    response = client.get(f"/api/v1/lines/nearby?lat={lat}&lon={lon}&radius=400")
+    assert response.status_code == 200
+    assert response.headers["x-query-count"] == "0"
+
+    lines = response.json()
+    assert lines and lines[0]["distance"] == pytest.approx(0, abs=0.1)
+    assert [line["distance"] for line in lines] == sorted(line["distance"] for line in lines)
+    assert len({line["id_linea"] for line in lines}) == len(lines)
+    for line in lines:
+        assert line["patterns"][0]["distance"] == line["distance"]
+        assert all(p["distance"] <= 400 for p in line["patterns"])
+
+    assert client.get(f"/api/v1/lines/nearby?lat={lat}&lon={lon}&radius=50000").status_code == 422
@@ -0,0 +1,82 @@
+"""
+Las búsquedas espaciales usan los índices GiST de las columnas UTM.
+Necesita la base de prueba con PostGIS (ver conftest.py); la migración 003
+se aplica dentro de la transacción del test y se descarta al terminar.
+"""
+import json
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+from app.crud.stop import crud_stop
+from app.database import ensure_projected_geometries
+from app.services.route_planner import NEARBY_STOPS_QUERY, ROUTES_BY_GEOMETRY_QUERY
+
+MIGRATION = Path(__file__).parent.parent / "migrations" / "003_projected_geometries.sql"
+
+
+@pytest.fixture
+def projected_db(db):
+    db.connection().exec_driver_sql(MIGRATION.read_text(encoding="utf-8"))
+    # Con tablas chicas el planner elige seq scan; sin esa opción solo queda el índice
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    return db
+
+
+def explain(db, query, params) -> str:
+    plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {query.text}"), params).scalar()
+    return json.dumps(plan)
+
+
+def test_nearby_stops_uses_gist_index(projected_db):
+    plan = explain(projected_db, NEARBY_STOPS_QUERY,
+                   {"lat": -17.7833, "lon": -63.1821, "radius": 500, "limit": 20})
+    assert "idx_paradas_geom_utm" in plan
+
+
+def test_routes_by_geometry_uses_gist_index(projected_db):
+    plan = explain(projected_db, ROUTES_BY_GEOMETRY_QUERY, {
+        "from_lat": -17.7833, "from_lon": -63.1821, "to_lat": -17.7512, "to_lon": -63.1755,
+        "radius": 400, "max_total_walk": 800,
+    })
+    assert "idx_patterns_geometry_utm" in plan
+
+
+def test_trigger_projects_new_stops(projected_db):
+    projected_db.execute(text("""
+        INSERT INTO transporte.paradas (nombre_parada, latitud, longitud, activa)
+        VALUES ('Plaza 24 de Septiembre', -17.7833, -63.1821, true)
+    """))
+    nearby = crud_stop.get_nearby(projected_db, -17.7840, -63.1821, radius=100)
+    assert "Plaza 24 de Septiembre" in [s.nombre_parada for s in nearby]
+    far = crud_stop.get_nearby(projected_db, -17.7950, -63.1821, radius=100)
+    assert "Plaza 24 de Septiembre" not in [s.nombre_parada for s in far]
+
+
+def test_startup_installs_missing_triggers_and_fills_utm_columns(db):
+    # Base creada solo con create_all: columnas UTM sin triggers
+    for trigger, table in (("trg_paradas_geom_utm", "paradas"), ("trg_patterns_geometry_utm", "patterns")):
+        db.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON transporte.{table}"))
+    assert ensure_projected_geometries(db.connection())
+    assert not ensure_projected_geometries(db.connection())
+
+    db.execute(text("""
+        INSERT INTO transporte.paradas (nombre_parada, latitud, longitud, activa)
+        VALUES ('Parada UTM', -17.7833, -63.1821, true)
+    """))
+    id_linea = db.execute(text("""
+        INSERT INTO transporte.lineas (nombre, activa) VALUES ('test-utm', true) RETURNING id_linea
+    """)).scalar()
+    db.execute(text("""
+        INSERT INTO transporte.patterns (id, name, id_linea, sentido, geometry)
+        VALUES ('pattern:test-utm:ida', 'Línea test-utm - Ida', :id_linea, 'ida',
+                ST_GeomFromText('LINESTRING(-63.1821 -17.7833, -63.1755 -17.7512)', 4326))
+    """), {"id_linea": id_linea})
+
+    assert db.execute(text(
+        "SELECT geom_utm IS NOT NULL FROM transporte.paradas WHERE nombre_parada = 'Parada UTM'"
+    )).scalar()
+    assert db.execute(text(
+        "SELECT geometry_utm IS NOT NULL FROM transporte.patterns WHERE id = 'pattern:test-utm:ida'"
+    )).scalar()
@@ -0,0 +1,39 @@
+"""Tests de la red sintética de los benchmarks"""
+import numpy as np
+
+from app.services.geometry import haversine_np
+from benchmarks.synthetic_network import generate_network, od_corpus
+
+
+def test_same_seed_builds_the_same_network():
+    a = generate_network(num_lines=8, num_rings=2, vertices_per_pattern=40, stop_every=5, seed=3)
+    b = generate_network(num_lines=8, num_rings=2, vertices_per_pattern=40, stop_every=5, seed=3)
+    c = generate_network(num_lines=8, num_rings=2, vertices_per_pattern=40, stop_every=5, seed=4)
+
+    assert a.pattern_ids == b.pattern_ids
+    assert np.array_equal(a.lats, b.lats) and np.array_equal(a.lons, b.lons)
+    assert not np.array_equal(a.lats, c.lats)
+    assert a.num_patterns == 16  # ida y vuelta por línea
+    assert a.num_vertices == 16 * 40
+    assert len(a.stops) == 8 * 8
+
+
+def test_rings_are_loops_and_vuelta_reverses_ida():
+    network = generate_network(num_lines=6, num_rings=2, vertices_per_pattern=60, seed=0)
+
+    rings = [network.pattern_index[f"synthetic:{i}:ida"] for i in (1, 2)]
+    radials = [network.pattern_index[f"synthetic:{i}:ida"] for i in (3, 4, 5, 6)]
+    assert network.pattern_is_loop[rings].all()
+    assert not network.pattern_is_loop[radials].any()
+
+    ida = network.pattern_stop_ids("synthetic:3:ida")
+    assert network.pattern_stop_ids("synthetic:3:vuelta") == ida[::-1]
+
+
+def test_od_corpus_is_fixed_and_skips_short_trips():
+    corpus = od_corpus(50, min_distance_m=1500, seed=7)
+    assert corpus == od_corpus(50, min_distance_m=1500, seed=7)
+    assert len(corpus) == 50
+    trips = np.array(corpus)
+    distance = haversine_np(trips[:, 0], trips[:, 1], trips[:, 2], trips[:, 3])
+    assert (distance >= 1400).all()  # Aproximación plana vs haversine
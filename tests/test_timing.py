@@ -0,0 +1,59 @@
+"""Tests del cronómetro por etapas del planificador"""
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from app.services.timing import StageTimer, current_timer, timed, timing_scope
+
+
+def test_stages_accumulate_and_scope_is_reset():
+    assert current_timer() is None
+    with timing_scope() as timer:
+        for _ in range(3):
+            with timed("sql.geometry"):
+                pass
+        with timing_scope() as inner:
+            assert inner is timer  # Se reutiliza el timer activo
+            with timed("rank"):
+                pass
+    assert current_timer() is None
+
+    stages = timer.as_dict()
+    assert stages["sql.geometry"]["count"] == 3
+    assert stages["rank"]["count"] == 1
+    header = timer.server_timing()
+    assert header.startswith("sql.geometry;dur=")
+    assert header.split(", ")[-1].startswith("total;dur=")
+
+
+def test_worker_threads_inherit_timer_through_context():
+    def work():
+        with timed("sql.stops"):
+            pass
+
+    with timing_scope() as timer, ThreadPoolExecutor(max_workers=2) as pool:
+        pool.submit(copy_context().run, work).result()
+        pool.submit(work).result()  # Sin copiar el contexto no hay timer
+    assert timer.as_dict()["sql.stops"]["count"] == 1
+
+
+def test_timed_without_scope_is_a_noop():
+    with timed("sql.geometry"):
+        pass
+    assert current_timer() is None
+
+
+def test_scope_uses_given_timer_and_traces_memory():
+    timer = StageTimer(trace_memory=True)
+    tracemalloc.start()
+    try:
+        with timing_scope(timer) as active:
+            assert active is timer
+            with timed("build.geometry"):
+                kept = [bytearray(1024) for _ in range(64)]
+    finally:
+        tracemalloc.stop()
+    assert current_timer() is None
+    assert timer.counts["build.geometry"] == 1
+    assert timer.allocated["build.geometry"] >= 64 * 1024
+    assert len(kept) == 64